@@ -0,0 +1,133 @@
+"""
+Gráficos matplotlib para lotes_gui.py (Tkinter).
+
+Se importa de forma diferida desde las funciones grafico_* para que el arranque
+de la app de escritorio no pague el costo de importar matplotlib/numpy. Las
+figuras se guardan en caché por tipo de gráfico y hash de los datos: reabrir un
+gráfico sin cambios en el CSV reutiliza la figura ya calculada.
+"""
+
+import hashlib
+
+import numpy as np
+from matplotlib import cm
+from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+from matplotlib.figure import Figure
+
+# tipo de gráfico -> (hash de datos, Figure). Solo se conserva la última figura por tipo.
+_FIGURE_CACHE = {}
+
+
+def hash_datos(data) -> str:
+    """Hash estable de los datos agregados de un gráfico (respeta el orden de inserción)."""
+    try:
+        return hashlib.sha256(repr(list(data.items())).encode('utf-8')).hexdigest()
+    except Exception:
+        return ''
+
+
+def _figura_cacheada(tipo, data, construir):
+    """Devuelve la figura en caché si los datos no cambiaron; si no, la construye y la guarda."""
+    h = hash_datos(data)
+    cached = _FIGURE_CACHE.get(tipo)
+    if h and cached and cached[0] == h:
+        return cached[1]
+    fig = construir(data)
+    if h:
+        _FIGURE_CACHE[tipo] = (h, fig)
+    return fig
+
+
+def limpiar_cache():
+    """Descarta todas las figuras en caché."""
+    _FIGURE_CACHE.clear()
+
+
+def _construir_radar_sucursal(data):
+    branches = list(set(l[0] for l in data.keys()))
+    stages = list(set(l[1] for l in data.keys()))
+
+    fig = Figure(figsize=(10, 10), dpi=100)
+    ax = fig.add_subplot(111, projection='polar')
+
+    angles = np.linspace(0, 2 * np.pi, len(branches), endpoint=False).tolist()
+    angles += angles[:1]  # Cerrar el polígono
+
+    for stage in stages:
+        values = [data.get((b, stage), 0) for b in branches]
+        values += values[:1]
+        ax.plot(angles, values, 'o-', linewidth=2, label=stage)
+        ax.fill(angles, values, alpha=0.15)
+
+    ax.set_xticks(angles[:-1])
+    ax.set_xticklabels(branches)
+    ax.set_ylim(0, max([v for v in data.values()]) + 1)
+    ax.set_title('Distribución de Lotes por Sucursal y Etapa', pad=20)
+    ax.legend(loc='upper right', bbox_to_anchor=(1.3, 1.1))
+    ax.grid(True)
+    return fig
+
+
+def _construir_pie_etapas(por_etapa):
+    fig = Figure(figsize=(10, 8), dpi=100)
+    ax = fig.add_subplot(111)
+
+    labels = list(por_etapa.keys())
+    sizes = list(por_etapa.values())
+    colors = cm.Set3(np.linspace(0, 1, len(labels)))
+
+    wedges, texts, autotexts = ax.pie(sizes, labels=labels, autopct='%1.1f%%',
+                                      colors=colors, startangle=90)
+    ax.set_title('Distribución de Lotes por Etapa')
+
+    for autotext in autotexts:
+        autotext.set_color('black')
+        autotext.set_fontweight('bold')
+    return fig
+
+
+def _construir_barras_ubicaciones(por_ubicacion):
+    fig = Figure(figsize=(12, 6), dpi=100)
+    ax = fig.add_subplot(111)
+
+    locations = list(por_ubicacion.keys())
+    counts = list(por_ubicacion.values())
+    colors = cm.Spectral(np.linspace(0, 1, len(locations)))
+
+    bars = ax.bar(locations, counts, color=colors)
+    ax.set_xlabel('Ubicación', fontsize=11, fontweight='bold')
+    ax.set_ylabel('Cantidad de Lotes', fontsize=11, fontweight='bold')
+    ax.set_title('Distribución de Lotes por Ubicación')
+    ax.tick_params(axis='x', rotation=45)
+
+    # Agregar valor en cada barra
+    for bar, count in zip(bars, counts):
+        height = bar.get_height()
+        ax.text(bar.get_x() + bar.get_width()/2., height,
+                f'{int(count)}', ha='center', va='bottom', fontweight='bold')
+
+    fig.tight_layout()
+    return fig
+
+
+def figura_por_sucursal(data):
+    """Radar de lotes por (sucursal, etapa). data: {(branch, stage): count}."""
+    return _figura_cacheada('sucursal', data, _construir_radar_sucursal)
+
+
+def figura_etapas(por_etapa):
+    """Pastel de lotes por etapa. por_etapa: {stage: count}."""
+    return _figura_cacheada('etapas', por_etapa, _construir_pie_etapas)
+
+
+def figura_ubicaciones(por_ubicacion):
+    """Barras de lotes por ubicación. por_ubicacion: {location: count}."""
+    return _figura_cacheada('ubicaciones', por_ubicacion, _construir_barras_ubicaciones)
+
+
+def mostrar_figura(master, fig):
+    """Incrusta la figura en un frame Tk y la dibuja."""
+    canvas = FigureCanvasTkAgg(fig, master=master)
+    canvas.draw()
+    canvas.get_tk_widget().pack(fill='both', expand=True)
+    return canvas
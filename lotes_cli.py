@@ -0,0 +1,169 @@
+"""
+Control de Lotes - línea de comandos (sin interfaz gráfica).
+
+Reutiliza la lógica de datos y sincronización de lotes_flet.py sin importar Flet ni
+Tkinter, para tareas programadas (cron) en un servidor:
+
+    python lotes_cli.py pull
+    python lotes_cli.py avanzar [--ponerse-al-dia] [--dry-run] [--sin-subir]
+    python lotes_cli.py exportar pdf --sucursal FSM --salida /srv/reportes
+    python lotes_cli.py push [--force]
+    python lotes_cli.py reportes [--sin-avanzar] [--forzar]
+    python lotes_cli.py restaurar
+    python lotes_cli.py estado
+
+Usa la misma configuración y los mismos archivos locales que lotes_flet.py en escritorio.
+"""
+
+import argparse
+import os
+import sys
+from datetime import datetime
+
+# Antes de importar: lotes_flet no carga Flet en modo sin interfaz
+os.environ.setdefault('LOTES_HEADLESS', '1')
+
+import lotes_flet as lotes  # noqa: E402
+
+EXPORTADORES = {
+    'csv': lambda ruta, predicado: lotes.exportar_csv_streaming(ruta, predicado),
+    'xlsx': lambda ruta, predicado: lotes.exportar_excel_streaming(ruta, predicado),
+    'pdf': lambda ruta, predicado: lotes.exportar_pdf(ruta, predicado),
+}
+
+
+def subir(force=False):
+    """Sube el CSV local con el mismo camino que la sincronización manual. Devuelve (success, msg)."""
+    transporte = lotes.obtener_transporte()
+    if lotes.usa_particiones(transporte):
+        return lotes.sincronizar_particiones(force=force, transporte=transporte)
+    return lotes.subir_csv_github(force=force)
+
+
+def cmd_pull(args):
+    return lotes.descargar_csv_github()
+
+
+def cmd_push(args):
+    return subir(force=args.force)
+
+
+def cmd_avanzar(args):
+    cambios = []
+
+    def aplicar(lotes_csv):
+        # Bajo el lock de escritura del servicio: calcular y aplicar sobre la misma lectura
+        cambios.extend(lotes.calcular_avance(lotes_csv, omitir=lotes.es_archivado,
+                                             ponerse_al_dia=args.ponerse_al_dia))
+        if not cambios or args.dry_run:
+            return None
+        lotes.aplicar_avance(lotes_csv, cambios)
+        return cambios
+
+    try:
+        lotes.SERVICIO_LOTES.mutar(aplicar, subir=False)
+    except lotes.ErrorEscrituraCSV as e:
+        return False, str(e)
+    for c in cambios:
+        print(f"{c['id']}: Sem {c['sem_ant']}→{c['sem_nueva']} | {c['etapa_ant']}→{c['etapa_nueva']}")
+    if not cambios:
+        return True, 'Todos los lotes ya están actualizados para esta semana'
+    if args.dry_run:
+        return True, f'{len(cambios)} lotes se actualizarían (sin guardar)'
+    if args.sin_subir:
+        return True, f'{len(cambios)} lotes actualizados (sin subir)'
+    success, msg = subir()
+    return success, f'{len(cambios)} lotes actualizados; {msg}'
+
+
+def cmd_exportar(args):
+    if args.formato == 'xlsx' and not lotes.OPENPYXL_AVAILABLE:
+        return False, 'openpyxl no disponible. Instalar: pip install openpyxl'
+    if args.formato == 'pdf' and not lotes.FPDF_AVAILABLE:
+        return False, 'fpdf2 no disponible. Instalar: pip install fpdf2'
+    filtros = (args.sucursal or 'Todas', args.etapa or 'Todas', args.ubicacion or 'Todas')
+    predicado = lotes.filtro_listado(*filtros)
+    os.makedirs(args.salida, exist_ok=True)
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    destino = os.path.join(args.salida, f'lotes_export_{timestamp}.{args.formato}')
+    n, desde_cache = lotes.exportar_cacheado(args.formato, filtros, destino,
+                                             lambda ruta: EXPORTADORES[args.formato](ruta, predicado))
+    if not n:
+        return False, 'No hay datos para exportar'
+    return True, f'{n} lotes exportados{" (caché)" if desde_cache else ""}: {destino}'
+
+
+def cmd_reportes(args):
+    formatos = [f.strip() for f in args.formatos.split(',') if f.strip() in lotes.REPORT_FORMATOS]
+    success, msg, carpeta = lotes.generar_reportes_semanales(
+        avanzar=not args.sin_avanzar, subir=not args.sin_subir, formatos=formatos, forzar=args.forzar,
+        ponerse_al_dia=args.ponerse_al_dia)
+    return success, f'{msg}: {carpeta}' if carpeta else msg
+
+
+def cmd_restaurar(args):
+    return lotes.restore_latest_backup()
+
+
+def cmd_estado(args):
+    # Archivados: los del CSV principal más los del archivo frío (archivo/)
+    archivados = lotes.leer_lotes_archivados()
+    print(f"Lotes: {len(lotes.leer_lotes_activos())} activos, {len(archivados)} archivados")
+    print(f"Cambios pendientes de subir: {lotes.pendientes_outbox()}")
+    transporte = lotes.obtener_transporte()
+    print(f"Transporte: {transporte.nombre if transporte else 'github'}")
+    return True, 'OK'
+
+
+def crear_parser():
+    parser = argparse.ArgumentParser(prog='lotes_cli', description='Control de Lotes sin interfaz gráfica')
+    sub = parser.add_subparsers(dest='comando', required=True)
+
+    sub.add_parser('pull', help='Descargar el CSV remoto').set_defaults(func=cmd_pull)
+
+    p = sub.add_parser('push', help='Subir el CSV local')
+    p.add_argument('--force', action='store_true', help='Subir aunque el remoto haya cambiado')
+    p.set_defaults(func=cmd_push)
+
+    p = sub.add_parser('avanzar', help='Actualizar semanas y etapas (avance semanal)')
+    p.add_argument('--ponerse-al-dia', action='store_true',
+                   help='Avanzar todas las semanas transcurridas desde la última actualización')
+    p.add_argument('--dry-run', action='store_true', help='Mostrar los cambios sin guardar')
+    p.add_argument('--sin-subir', action='store_true', help='Guardar localmente sin subir')
+    p.set_defaults(func=cmd_avanzar)
+
+    p = sub.add_parser('exportar', help='Exportar los lotes activos')
+    p.add_argument('formato', choices=sorted(EXPORTADORES))
+    p.add_argument('--sucursal')
+    p.add_argument('--etapa')
+    p.add_argument('--ubicacion')
+    p.add_argument('--salida', default=os.path.join(lotes.REGISTROS_DIR, 'cli'),
+                   help='Carpeta de destino (por defecto registros/cli)')
+    p.set_defaults(func=cmd_exportar)
+
+    p = sub.add_parser('reportes', help='Avance semanal y reportes por sucursal en registros/reports')
+    p.add_argument('--sin-avanzar', action='store_true', help='Solo generar reportes')
+    p.add_argument('--sin-subir', action='store_true', help='No subir el avance semanal')
+    p.add_argument('--forzar', action='store_true', help='Generar aunque los datos no hayan cambiado')
+    p.add_argument('--ponerse-al-dia', action='store_true',
+                   help='Avanzar todas las semanas transcurridas desde la última actualización')
+    p.add_argument('--formatos', default=','.join(lotes.REPORT_FORMATOS), help='Lista separada por comas')
+    p.set_defaults(func=cmd_reportes)
+
+    sub.add_parser('restaurar', help='Restaurar el backup local más reciente').set_defaults(func=cmd_restaurar)
+    sub.add_parser('estado', help='Resumen de datos y pendientes').set_defaults(func=cmd_estado)
+    return parser
+
+
+def main(argv=None):
+    args = crear_parser().parse_args(argv)
+    ok, msg = lotes.cargar_config_desde_storage()
+    if not ok and args.comando in ('pull', 'push'):
+        print(f"[CLI] {msg}", file=sys.stderr)
+    success, msg = args.func(args)
+    print(f"[CLI] {msg}", file=sys.stdout if success else sys.stderr)
+    return 0 if success else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,7 +3,6 @@ Control de Lotes - Versión Flet (Android/Desktop/Web)
 Adaptado de lotes_gui.py (Tkinter) para funcionar en múltiples plataformas.
 """
 
-import flet as ft
 import asyncio
 import csv
 import os
@@ -15,7 +14,32 @@ import requests
 import shutil
 import glob
 import hashlib
+import hmac
+import heapq
+import io
+import pickle
+import tempfile
 import time
+import threading
+import itertools
+import multiprocessing
+import re
+from difflib import get_close_matches
+from concurrent.futures import (Future, ProcessPoolExecutor, ThreadPoolExecutor, wait,
+                                as_completed, FIRST_COMPLETED)
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import unquote, urlparse
+from xml.etree import ElementTree
+
+# lotes_cli.py define LOTES_HEADLESS para usar la lógica de datos/sync sin cargar Flet.
+# Los workers del pool de procesos (spawn) reimportan el script principal como
+# '__mp_main__' y tampoco necesitan Flet (ver pool_procesos).
+if os.environ.get('LOTES_HEADLESS') or __name__ == '__mp_main__':
+    ft = None
+else:
+    import flet as ft
+
+from lotes_semanas import calcular_avance, aplicar_avance
 
 # Importar fpdf2 para exportar PDF (opcional)
 try:
@@ -27,9 +51,17 @@ except ImportError:
     XPos = None
     YPos = None
 
+# Importar pypdf para unir secciones de PDF renderizadas en paralelo (opcional)
+try:
+    from pypdf import PdfReader, PdfWriter
+    PYPDF_AVAILABLE = True
+except ImportError:
+    PYPDF_AVAILABLE = False
+
 # Importar openpyxl para exportar Excel (opcional)
 try:
     from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
     from openpyxl.styles import Font
     OPENPYXL_AVAILABLE = True
 except ImportError:
@@ -78,6 +110,7 @@ VARIETIES = [
     'Kosher Kush', 'Mozzerella', 'Orangel', 'Purple Diesel', 'ReCon',
     'Red Red Wine', 'Runtz', 'Sugar Cane', 'Wedding Cake', 'Zallah Bread',
 ]
+MAX_VARIEDADES_LOTE = 20
 
 # Variables globales
 GITHUB_REPO = ""
@@ -85,6 +118,28 @@ GITHUB_TOKEN = ""
 GITHUB_FILE_PATH = "lotes_template.csv"
 GITHUB_BRANCH = "main"
 CURRENT_USER = ""  # Usuario actual de la app
+# Motor de subida: "contents" (API de contenidos, un archivo por commit) o "git"
+# (API Git Data: blobs/trees/commits/refs, varios archivos en un commit atómico).
+SYNC_ENGINE = "contents"
+# Archivo frío: los lotes archivados se guardan aparte en archivo/lotes_archivo_<año>.csv
+COLD_ARCHIVE = False
+# Reportes semanales automáticos (escritorio): avance + reportes por sucursal una vez por semana
+REPORTES_AUTO = False
+# Transporte de sincronización: "github", "carpeta" (carpeta compartida/NAS) o "webdav"
+SYNC_TRANSPORT = "github"
+SYNC_FOLDER = ""
+WEBDAV_URL = ""
+WEBDAV_USER = ""
+WEBDAV_PASSWORD = ""
+LAN_URL = ""          # cliente: URL del servidor LAN de escritorio (sync_transport = "lan")
+LAN_TOKEN = ""        # secreto compartido entre servidor y clientes LAN
+LAN_SERVER = False    # escritorio: exponer el servidor de sincronización en la LAN
+LAN_PORT = 8765
+# Layout remoto: "archivo" (un solo CSV) o "particionado" (un CSV por sucursal + manifest)
+DATA_LAYOUT = "archivo"
+
+# Métricas del arranque por etapas (tiempo hasta la primera lista, verificación remota)
+STARTUP_METRICS = {}
 
 
 def normalizar_nombre(nombre: str) -> str:
@@ -126,6 +181,22 @@ def user_has_config():
 # explicit button and helper were removed to avoid accidental reactivation.
 
 
+def aplicar_config_transporte(config: dict):
+    """Lee del config el transporte de sincronización y sus parámetros."""
+    globals()["SYNC_TRANSPORT"] = config.get("sync_transport", "github") or "github"
+    globals()["SYNC_FOLDER"] = config.get("sync_folder", "")
+    globals()["WEBDAV_URL"] = config.get("webdav_url", "")
+    globals()["WEBDAV_USER"] = config.get("webdav_user", "")
+    globals()["WEBDAV_PASSWORD"] = config.get("webdav_password", "")
+    globals()["LAN_URL"] = config.get("lan_url", "")
+    globals()["LAN_TOKEN"] = config.get("lan_token", "")
+    globals()["LAN_SERVER"] = bool(config.get("lan_server", False))
+    try:
+        globals()["LAN_PORT"] = int(config.get("lan_port", 8765))
+    except Exception:
+        globals()["LAN_PORT"] = 8765
+
+
 def cargar_config_desde_storage(page=None):
     """Carga la configuración desde archivo JSON (desktop) o client_storage (Android)."""
     global GITHUB_REPO, GITHUB_TOKEN, CURRENT_USER
@@ -141,6 +212,11 @@ def cargar_config_desde_storage(page=None):
                     repo = config.get("github_repo", "")
                     token = config.get("github_token", "")
                     globals()["CURRENT_USER"] = config.get("current_user", "")
+                    globals()["SYNC_ENGINE"] = config.get("sync_engine", "contents") or "contents"
+                    globals()["DATA_LAYOUT"] = config.get("data_layout", "archivo") or "archivo"
+                    globals()["COLD_ARCHIVE"] = bool(config.get("cold_archive", False))
+                    globals()["REPORTES_AUTO"] = bool(config.get("reportes_auto", False))
+                    aplicar_config_transporte(config)
                     if repo and token and "/" in repo:
                         globals()["GITHUB_REPO"] = repo
                         globals()["GITHUB_TOKEN"] = token
@@ -165,6 +241,11 @@ def cargar_config_desde_storage(page=None):
                 GITHUB_REPO = repo
                 GITHUB_TOKEN = token
                 CURRENT_USER = user
+                globals()["SYNC_ENGINE"] = config.get("sync_engine", "contents") or "contents"
+                globals()["DATA_LAYOUT"] = config.get("data_layout", "archivo") or "archivo"
+                globals()["COLD_ARCHIVE"] = bool(config.get("cold_archive", False))
+                globals()["REPORTES_AUTO"] = bool(config.get("reportes_auto", False))
+                aplicar_config_transporte(config)
                 # Además, si se leyó desde una ruta distinta, reescribir config en la ruta esperada
                 expected = get_config_path()
                 if os.path.abspath(config_path) != os.path.abspath(expected):
@@ -282,11 +363,25 @@ def descargar_csv_github():
     """Descarga el CSV desde GitHub y guarda como local si no hay conflicto.
     Devuelve (success, msg)."""
     print("[NETWORK] descargar_csv_github: inicio")
+    transporte = obtener_transporte()
+    if usa_particiones(transporte):
+        return descargar_particiones(transporte)
+    if transporte is not None:
+        return descargar_con_transporte(transporte)
     ok, msg, remote_content, remote_hash = get_remote_csv_content()
     if not ok:
         print(f"[NETWORK] descargar_csv_github: no ok -> {msg}")
         return False, msg
+    return aplicar_csv_remoto(remote_content, remote_hash)
+
+
+def aplicar_csv_remoto(remote_content: str, remote_hash: str):
+    """Escribe el contenido remoto ya descargado como CSV local si no hay conflicto.
+    Devuelve (success, msg)."""
+    return escribir_csv_externo(lambda: _aplicar_csv_remoto(remote_content, remote_hash))
 
+
+def _aplicar_csv_remoto(remote_content: str, remote_hash: str):
     # Leer estado local/meta
     meta = load_local_meta()
     local_content = ''
@@ -306,43 +401,262 @@ def descargar_csv_github():
             if b:
                 print(f"[NETWORK] descargar_csv_github: backup local creado {b}")
         try:
-            with open(LOTES_CSV, 'w', encoding='utf-8') as f:
-                f.write(remote_content)
-            fix_csv_structure()
-            # Actualizar meta
-            meta['local_hash'] = remote_hash
-            meta['remote_hash'] = remote_hash
-            save_local_meta(meta)
+            _escribir_remoto_local(remote_content, remote_hash)
             return True, 'Conectado'
         except Exception as e:
             print(f"[NETWORK] error escribiendo local: {e}")
             return False, f'Error escritura: {e}'
 
     # Si hay diferencias y local cambió desde el último remoto conocido -> conflicto
-    if meta.get('local_hash') and meta.get('local_hash') != remote_hash and local_hash != meta.get('remote_hash'):
+    if meta.get('local_hash') and meta.get('local_hash') != remote_hash and not local_sin_cambios(local_content, meta):
         # Guardar ambos en registros para revisión manual y no sobrescribir
         b = crear_backup()
         rb = save_remote_backup(remote_content)
         print(f"[NETWORK] conflicto remoto/local: backup_local={b} backup_remote={rb}")
-        return False, 'Conflicto local/remoto, backups guardados'
+        return False, MensajeSync('Conflicto local/remoto, backups guardados', SYNC_CONFLICTO)
 
-    # Si local no fue modificado desde último remote conocido, entonces remote es la fuente -> sobrescribir
+    # Si local no fue modificado desde último remote conocido, entonces remote es la fuente -> sobrescribir.
+    # El contenido local es distinto: backup antes (sin línea base no se puede saber si tenía ediciones)
+    b = crear_backup()
+    if b:
+        print(f"[NETWORK] descargar_csv_github: backup local creado {b}")
     try:
-        with open(LOTES_CSV, 'w', encoding='utf-8') as f:
-            f.write(remote_content)
-        fix_csv_structure()
-        meta['local_hash'] = remote_hash
-        meta['remote_hash'] = remote_hash
-        save_local_meta(meta)
+        _escribir_remoto_local(remote_content, remote_hash)
         return True, 'Conectado'
     except Exception as e:
         print(f"[NETWORK] error escribiendo (2): {e}")
         return False, f'Error escritura: {e}'
 
 
-def subir_csv_github(force: bool = False):
-    """Sube el CSV a GitHub. Devuelve (success, msg). Maneja conflictos basados en meta local/remote."""
+def _escribir_remoto_local(remote_content: str, remote_hash: str):
+    """Escribe el remoto como CSV local, aplica las migraciones y registra la línea base.
+
+    Si una migración reescribió el archivo (remoto no canónico, p.e. escrito por la app Tk),
+    el hash local ya no es el remoto: se guarda en 'migrado_hash' para que esa diferencia
+    no cuente como cambio local pendiente (ver local_sin_cambios)."""
+    with open(LOTES_CSV, 'w', encoding='utf-8') as f:
+        f.write(remote_content)
+    invalidar_snapshot_lotes()
+    fix_csv_structure()
+    # Recargar meta: fix_csv_structure registra la versión de esquema
+    meta = load_local_meta()
+    with open(LOTES_CSV, 'r', encoding='utf-8') as f:
+        local_hash = compute_hash(f.read())
+    meta['local_hash'] = local_hash
+    meta['remote_hash'] = remote_hash
+    meta['remote_sha'] = git_blob_sha(remote_content.encode('utf-8'))
+    if local_hash != remote_hash:
+        print("[SCHEMA] remoto migrado al descargar; la diferencia no es un cambio local")
+        meta['migrado_desde'] = remote_hash
+        meta['migrado_hash'] = local_hash
+    else:
+        meta.pop('migrado_desde', None)
+        meta.pop('migrado_hash', None)
+    save_local_meta(meta)
+
+
+def local_sin_cambios(local_content: str, meta: dict) -> bool:
+    """True si el CSV local es el último remoto sincronizado (tal cual o solo migrado)."""
+    remote_hash = meta.get('remote_hash')
+    if not remote_hash:
+        return False
+    h = compute_hash(local_content)
+    if h == remote_hash:
+        return True
+    return meta.get('migrado_desde') == remote_hash and meta.get('migrado_hash') == h
+
+
+def preparar_subida(content: str) -> dict:
+    """Prepara una subida una sola vez por intento de sincronización.
+
+    Devuelve un dict con el texto, los bytes UTF-8, el hash, el número de filas con datos
+    y el payload base64, para que la validación, la detección de conflictos y el PUT
+    compartan el mismo cálculo en lugar de releer/recodificar el CSV en cada paso.
+    """
+    raw = content.encode('utf-8')
+    try:
+        reader = csv.reader(io.StringIO(content))
+        next(reader, None)
+        filas = sum(1 for r in reader if any((c or '').strip() for c in r))
+    except Exception:
+        # None = no se pudo analizar
+        filas = None
+    return {
+        'content': content,
+        'bytes': raw,
+        'hash': hashlib.sha256(raw).hexdigest(),
+        'sha': git_blob_sha(raw),
+        'filas': filas,
+        'b64': base64.b64encode(raw).decode('utf-8'),
+    }
+
+
+def preparar_subida_local():
+    """Lee LOTES_CSV y prepara su subida. Devuelve None si no se pudo leer."""
+    try:
+        with open(LOTES_CSV, 'r', encoding='utf-8') as f:
+            return preparar_subida(f.read())
+    except Exception as e:
+        print(f"[NETWORK] preparar_subida_local: error leyendo local: {e}")
+        return None
+
+
+# --- Cola de subidas pendientes (outbox) ---
+# Cada subida fallida por red queda registrada en meta['outbox'] (sobrevive reinicios).
+# Como cada subida manda el estado completo del CSV, basta con un contador: el flusher
+# en background sube todo junto en un único commit cuando vuelve la conexión.
+OUTBOX_BACKOFF_BASE = 15   # segundos
+OUTBOX_BACKOFF_MAX = 900
+
+
+# Códigos de error de sincronización. Las funciones siguen devolviendo (success, msg) con
+# msg legible para la UI; los errores que no se arreglan reintentando devuelven un
+# MensajeSync con su código, y se clasifica por el código y no por la redacción.
+SYNC_CONFLICTO = 'conflicto'
+SYNC_BLOQUEADO = 'bloqueado'
+SYNC_LOCAL_VACIO = 'local_vacio'
+SYNC_NO_ENCONTRADO = 'no_encontrado'
+SYNC_ERRORES_DEFINITIVOS = {SYNC_CONFLICTO, SYNC_BLOQUEADO, SYNC_LOCAL_VACIO, SYNC_NO_ENCONTRADO}
+
+
+class MensajeSync(str):
+    """Mensaje de error de sincronización con código (ver SYNC_*)."""
+
+    def __new__(cls, texto, codigo):
+        obj = super().__new__(cls, texto)
+        obj.codigo = codigo
+        return obj
+
+
+def codigo_sync(msg) -> str:
+    """Código de un mensaje de sincronización ('' = sin clasificar: red, servidor, etc.)."""
+    return getattr(msg, 'codigo', '')
+
+
+def _error_reintentable(msg) -> bool:
+    """Errores que se resuelven reintentando (red, servidor); no conflictos ni bloqueos."""
+    return codigo_sync(msg) not in SYNC_ERRORES_DEFINITIVOS
+
+
+def leer_outbox() -> dict:
+    return load_local_meta().get('outbox') or {}
+
+
+def pendientes_outbox() -> int:
+    try:
+        return int(leer_outbox().get('cambios', 0))
+    except Exception:
+        return 0
+
+
+def registrar_pendiente(msg: str):
+    """Anota un cambio local que no se pudo subir."""
+    meta = load_local_meta()
+    outbox = meta.get('outbox') or {}
+    outbox['cambios'] = int(outbox.get('cambios', 0)) + 1
+    outbox.setdefault('desde', datetime.now().isoformat(timespec='seconds'))
+    outbox['ultimo_error'] = msg
+    meta['outbox'] = outbox
+    save_local_meta(meta)
+
+
+def limpiar_outbox():
+    meta = load_local_meta()
+    if meta.pop('outbox', None) is not None:
+        save_local_meta(meta)
+
+
+def espera_outbox(intentos: int) -> float:
+    """Backoff exponencial entre reintentos del flusher."""
+    return min(OUTBOX_BACKOFF_BASE * (2 ** max(intentos, 0)), OUTBOX_BACKOFF_MAX)
+
+
+def hay_conexion(timeout: int = 3) -> bool:
+    """Comprobación barata de conectividad con la API (rate_limit no consume cuota)."""
+    try:
+        r = github_request('GET', 'https://api.github.com/rate_limit', headers=github_headers(), timeout=timeout)
+        return r.status_code < 500
+    except Exception:
+        return False
+
+
+# Una sola subida a la vez por proceso (sesiones web, flusher, servidor LAN)
+_SUBIDA_LOCK = threading.Lock()
+
+
+def vaciar_outbox():
+    """Intenta subir los cambios pendientes en un solo commit. Devuelve (success, msg)."""
+    if not _SUBIDA_LOCK.acquire(blocking=False):
+        return False, 'Subida en curso'
+    try:
+        return _vaciar_outbox()
+    finally:
+        _SUBIDA_LOCK.release()
+
+
+def _vaciar_outbox():
+    outbox = leer_outbox()
+    if not outbox.get('cambios'):
+        return True, 'Sin pendientes'
+    transporte = obtener_transporte()
+    if transporte is not None:
+        if transporte.version()[0] == 0:
+            success, msg = False, 'Sin conexión'
+        elif usa_particiones(transporte):
+            success, msg = sincronizar_particiones(transporte=transporte)
+        else:
+            success, msg = subir_con_transporte(transporte)
+    elif hay_conexion():
+        if DATA_LAYOUT == 'particionado':
+            success, msg = sincronizar_particiones()
+        else:
+            success, msg = _subir_csv_github()
+    else:
+        success, msg = False, 'Sin conexión'
+    if success:
+        limpiar_outbox()
+        print(f"[OUTBOX] {outbox.get('cambios')} cambio(s) pendientes subidos")
+        return True, msg
+    meta = load_local_meta()
+    outbox = meta.get('outbox') or outbox
+    outbox['intentos'] = int(outbox.get('intentos', 0)) + 1
+    outbox['ultimo_error'] = msg
+    meta['outbox'] = outbox
+    save_local_meta(meta)
+    return False, msg
+
+
+def subir_csv_github(force: bool = False, preparada: dict = None, extras: dict = None):
+    """Sube el CSV a GitHub. Devuelve (success, msg).
+
+    Si falla por red el cambio queda en la cola de pendientes (outbox) para que el
+    flusher lo reintente; un éxito vacía la cola."""
+    with _SUBIDA_LOCK:
+        success, msg = _subir_csv_github(force=force, preparada=preparada, extras=extras)
+    try:
+        if success:
+            limpiar_outbox()
+        elif _error_reintentable(msg):
+            registrar_pendiente(msg)
+    except Exception:
+        pass
+    return success, msg
+
+
+def _subir_csv_github(force: bool = False, preparada: dict = None, extras: dict = None):
+    """Sube el CSV a GitHub. Devuelve (success, msg). Maneja conflictos basados en meta local/remote.
+
+    preparada: resultado de preparar_subida() ya calculado por el llamador (opcional).
+    extras: {ruta_en_repo: bytes} de archivos auxiliares a incluir en el mismo commit; si se
+    indican (o el CSV supera el límite de la API de contenidos) se usa la API Git Data."""
     print("[NETWORK] subir_csv_github: inicio")
+    transporte = obtener_transporte()
+    if transporte is not None:
+        if globals().get('LOCAL_DATA_CLEARED'):
+            return False, MensajeSync('Subidas bloqueadas tras borrar datos locales. Reactiva subidas en Config para continuar.', SYNC_BLOQUEADO)
+        if usa_particiones(transporte):
+            return subir_particiones(force=force, transporte=transporte)
+        return subir_con_transporte(transporte, force=force, preparada=preparada)
     # Validaciones: token, repo y usuario
     if not GITHUB_TOKEN:
         print("[NETWORK] subir_csv_github: sin token")
@@ -364,51 +678,46 @@ def subir_csv_github(force: bool = False):
     try:
         if globals().get('LOCAL_DATA_CLEARED'):
             print("[NETWORK] subir_csv_github: upload bloqueado porque se borraron datos locales recientemente (requiere reactivar subidas)")
-            return False, 'Subidas bloqueadas tras borrar datos locales. Reactiva subidas en Config para continuar.'
+            return False, MensajeSync('Subidas bloqueadas tras borrar datos locales. Reactiva subidas en Config para continuar.', SYNC_BLOQUEADO)
     except Exception:
         pass
 
+    if DATA_LAYOUT == 'particionado':
+        return subir_particiones(force=force)
+
     # Leer meta y local
     meta = load_local_meta()
-    try:
-        with open(LOTES_CSV, 'r', encoding='utf-8') as f:
-            content = f.read()
-    except Exception as e:
-        print(f"[NETWORK] subir_csv_github: error leyendo local: {e}")
-        return False, 'Error lectura local'
+    if preparada is None:
+        preparada = preparar_subida_local()
+        if preparada is None:
+            return False, 'Error lectura local'
     # Comprobar si el CSV local tiene datos útiles (más allá del encabezado)
-    try:
-        import io
-        reader = csv.reader(io.StringIO(content))
-        rows = list(reader)
-        data_rows = [r for r in rows[1:] if any((c or '').strip() for c in r)] if len(rows) > 1 else []
-        if not data_rows and not force:
-            print("[NETWORK] subir_csv_github: local vacío o sólo cabecera, abortando")
-            return False, 'Local vacío o sólo cabecera, usa force=True para forzar subida'
-    except Exception:
-        # Si falla al analizar, continuar con hash calculado
-        pass
-
-    local_hash = compute_hash(content)
-
-    # Consultar remoto breve para detectar cambios
-    try:
-        resp = requests.get(url, headers=headers, params={'ref': GITHUB_BRANCH}, timeout=5)
-        remote_content = ''
-        if resp.status_code == 200:
-            remote_content = base64.b64decode(resp.json().get('content', '')).decode('utf-8')
-            remote_hash = compute_hash(remote_content)
-        elif resp.status_code == 404:
-            # No existe el archivo remoto
-            remote_hash = ''
-            remote_content = ''
-            if not force:
-                return False, f'Archivo {GITHUB_FILE_PATH} no encontrado', '', ''
-            # Si force==True, permitimos crear el archivo más abajo (sólo si hay datos locales)
+    # (si no se pudo analizar, continuar con el hash calculado)
+    if preparada['filas'] == 0 and not force:
+        print("[NETWORK] subir_csv_github: local vacío o sólo cabecera, abortando")
+        return False, MensajeSync('Local vacío o sólo cabecera, usa force=True para forzar subida', SYNC_LOCAL_VACIO)
+
+    local_hash = preparada['hash']
+
+    # Consultar solo metadatos del remoto (SHA) para detectar cambios; el contenido
+    # se descarga (en crudo) únicamente si el remoto cambió desde la última sincronización.
+    remote_content = ''
+    remote_hash = ''
+    status, remote_sha, _size = probar_remoto(GITHUB_BRANCH)
+    if status == 200:
+        if remote_sha == preparada['sha']:
+            remote_hash = local_hash
+        elif remote_sha == meta.get('remote_sha') and meta.get('remote_hash'):
+            remote_hash = meta.get('remote_hash')
         else:
-            remote_hash = ''
-    except Exception:
-        remote_hash = ''
+            st, remote_content, remote_hash = descargar_remoto_texto(GITHUB_BRANCH)
+            if st != 200:
+                remote_content, remote_hash = '', ''
+    elif status == 404:
+        # No existe el archivo remoto
+        if not force:
+            return False, MensajeSync(f'Archivo {GITHUB_FILE_PATH} no encontrado', SYNC_NO_ENCONTRADO)
+        # Si force==True, permitimos crear el archivo más abajo (sólo si hay datos locales)
 
     # Conflicto: el remoto cambió respecto a la línea base sincronizada (meta.remote_hash)
     # y nuestro local difiere del remoto actual -> subir sobrescribiría cambios ajenos.
@@ -422,30 +731,24 @@ def subir_csv_github(force: bool = False):
         if remote_content:
             rb = save_remote_backup(remote_content)
             print(f"[NETWORK] subir_csv_github: backup remoto guardado {rb}")
-        return False, 'Conflicto remoto detectado'
+        return False, MensajeSync('Conflicto remoto detectado', SYNC_CONFLICTO)
 
     # Proceder a subir
     try:
-        encoded_content = base64.b64encode(content.encode('utf-8')).decode('utf-8')
         fecha_hora = datetime.now().strftime("%Y-%m-%d %H:%M")
         commit_msg = f"Actualización {fecha_hora} {CURRENT_USER}"
-        data = {'message': commit_msg, 'content': encoded_content, 'branch': GITHUB_BRANCH}
-        if resp.status_code == 200:
-            data['sha'] = resp.json().get('sha', '')
-
-        # Si resp.status_code == 404 y force is True, permitimos crear el archivo solo si hay datos locales
-        if resp.status_code == 404:
-            try:
-                import io
-                reader = csv.reader(io.StringIO(content))
-                rows = list(reader)
-                data_rows = [r for r in rows[1:] if any((c or '').strip() for c in r)] if len(rows) > 1 else []
-                if not data_rows:
-                    print("[NETWORK] subir_csv_github: no se crea archivo remoto vacío")
-                    return False, 'No se crea archivo remoto vacío'
-            except Exception:
+        data = {'message': commit_msg, 'content': preparada['b64'], 'branch': GITHUB_BRANCH}
+        if status == 200:
+            data['sha'] = remote_sha
+
+        # Si status == 404 y force is True, permitimos crear el archivo solo si hay datos locales
+        if status == 404:
+            if preparada['filas'] is None:
                 # Si no podemos analizar, ser conservadores: no crear
                 return False, 'No se puede crear remoto sin datos'
+            if preparada['filas'] == 0:
+                print("[NETWORK] subir_csv_github: no se crea archivo remoto vacío")
+                return False, MensajeSync('No se crea archivo remoto vacío', SYNC_LOCAL_VACIO)
 
         # Crear backup remoto previo (por seguridad) si existe contenido remoto
         try:
@@ -455,7 +758,25 @@ def subir_csv_github(force: bool = False):
         except Exception:
             pass
 
-        response = requests.put(url, headers=headers, json=data, timeout=10)
+        extras = dict(extras or {})
+        extras.update(archivos_frio_pendientes())
+        if usar_git_data(preparada, extras):
+            archivos = {GITHUB_FILE_PATH: preparada['bytes']}
+            archivos.update(extras)
+            ok, msg, blobs = commit_git_data(archivos, commit_msg)
+            print(f"[NETWORK] subir_csv_github: git data -> {msg}")
+            if not ok:
+                return False, msg
+            marcar_frio_subido(blobs)
+            crear_backup()
+            meta = load_local_meta()
+            meta['local_hash'] = local_hash
+            meta['remote_hash'] = local_hash
+            meta['remote_sha'] = blobs.get(GITHUB_FILE_PATH, preparada['sha'])
+            save_local_meta(meta)
+            return True, 'Sincronizado'
+
+        response = github_request('PUT', url, headers=headers, json=data, timeout=10)
         print(f"[NETWORK] subir_csv_github: put status={response.status_code}")
         if response.status_code in [200, 201]:
             # Crear backup local DESPUÉS de sincronizar exitosamente
@@ -463,6 +784,10 @@ def subir_csv_github(force: bool = False):
             # Actualizar meta
             meta['local_hash'] = local_hash
             meta['remote_hash'] = local_hash
+            try:
+                meta['remote_sha'] = response.json().get('content', {}).get('sha') or preparada['sha']
+            except Exception:
+                meta['remote_sha'] = preparada['sha']
             save_local_meta(meta)
             return True, 'Sincronizado'
         else:
@@ -472,15 +797,40 @@ def subir_csv_github(force: bool = False):
         return False, f'Error: {str(e)[:50]}'
 
 
-def leer_csv():
-    """Lee lotes del CSV."""
+# Último CSV parseado: {'key': (ruta, mtime_ns, tamaño), 'hash': sha256 del contenido,
+# 'lotes': [...], 'indices': {...}}
+_LOTES_SNAPSHOT = {'key': None, 'hash': '', 'lotes': [], 'indices': {'activos': [], 'archivados': []}}
+
+
+def _copiar_lote(lote):
+    """Copia una fila de lote incluyendo su lista de variedades."""
+    c = dict(lote)
+    c['Variedades'] = [dict(v) for v in lote.get('Variedades', [])]
+    return c
+
+
+def invalidar_snapshot_lotes():
+    """Descarta el snapshot en memoria; la próxima lectura vuelve a parsear el CSV."""
+    _LOTES_SNAPSHOT['key'] = None
+    _LOTES_SNAPSHOT['hash'] = ''
+    _LOTES_SNAPSHOT['lotes'] = []
+    _LOTES_SNAPSHOT['indices'] = {'activos': [], 'archivados': []}
+
+
+def ruta_csv_escritura():
+    """CSV donde se escriben los lotes: el archivo de trabajo si el usuario borró los datos locales."""
+    return LOTES_WORKING if globals().get('LOCAL_DATA_CLEARED') else LOTES_CSV
+
+
+def _ruta_csv_lectura():
+    """Ruta del CSV a leer (archivo de trabajo, original o alternativos). None si no hay datos."""
     # Si el usuario marcó borrado local, preferimos el archivo de trabajo o devolver vacío sin tocar el original
     try:
         if globals().get('LOCAL_DATA_CLEARED'):
             if os.path.exists(LOTES_WORKING):
                 csv_path = LOTES_WORKING
             else:
-                return []
+                return None
         else:
             csv_path = LOTES_CSV
     except Exception:
@@ -506,59 +856,210 @@ def leer_csv():
                 except Exception:
                     pass
     if not os.path.exists(csv_path):
-        return []
+        return None
+    return csv_path
+
+
+def _parsear_csv(texto):
+    """Parsea el texto del CSV. Devuelve (cabecera, lotes) con 'Variedades' ya armado."""
+    reader = csv.DictReader(io.StringIO(texto, newline=None))
+    lotes_final = [_fila_a_lote(row) for row in reader]
+    return list(reader.fieldnames or []), lotes_final
+
+
+def _fila_a_lote(row):
+    """Arma 'Variedades' a partir de las columnas Variedad_i/Cantidad_i de una fila."""
+    variedades = []
+    for i in range(1, 21):
+        v = (row.get(f'Variedad_{i}', '') or '').strip()
+        c = (row.get(f'Cantidad_{i}', '') or '').strip()
+        if v:
+            try:
+                c = int(c)
+            except:
+                c = 0
+            variedades.append({'name': v, 'count': c})
+    row['Variedades'] = variedades
+    return row
+
+
+def _indices_lotes(lotes):
+    """Índices posicionales del snapshot: filas activas y archivadas."""
+    activos, archivados = [], []
+    for i, lote in enumerate(lotes):
+        (archivados if es_archivado(lote) else activos).append(i)
+    return {'activos': activos, 'archivados': archivados}
+
+
+def _snapshot_actual():
+    """Devuelve el snapshot en memoria al día con el CSV (o None si no hay CSV legible).
+
+    Orden de búsqueda: snapshot en memoria (mismo mtime/tamaño), snapshot binario en disco
+    (mismo hash de contenido) y, por último, parseo del CSV que regenera el binario."""
+    csv_path = _ruta_csv_lectura()
+    if csv_path is None:
+        return None
     try:
-        with open(csv_path, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            lotes_final = []
-            for row in reader:
-                variedades = []
-                for i in range(1, 21):
-                    v = row.get(f'Variedad_{i}', '').strip()
-                    c = row.get(f'Cantidad_{i}', '').strip()
-                    if v:
-                        try:
-                            c = int(c)
-                        except:
-                            c = 0
-                        variedades.append({'name': v, 'count': c})
-                row['Variedades'] = variedades
-                lotes_final.append(row)
-            return lotes_final
+        st = os.stat(csv_path)
+        snap_key = (csv_path, st.st_mtime_ns, st.st_size)
+    except Exception:
+        snap_key = None
+    if snap_key is not None and _LOTES_SNAPSHOT.get('key') == snap_key:
+        return _LOTES_SNAPSHOT
+    try:
+        with open(csv_path, 'rb') as f:
+            raw = f.read()
+        content_hash = hashlib.sha256(raw).hexdigest()
+        snap = cargar_snapshot_binario(content_hash)
+        if snap is not None:
+            lotes = snap['lotes']
+            indices = snap['indices']
+        else:
+            cabecera, lotes = _parsear_csv(raw.decode('utf-8'))
+            indices = _indices_lotes(lotes)
+            guardar_snapshot_binario(content_hash, cabecera, lotes, indices)
+        _LOTES_SNAPSHOT['key'] = snap_key
+        _LOTES_SNAPSHOT['hash'] = content_hash
+        _LOTES_SNAPSHOT['lotes'] = lotes
+        _LOTES_SNAPSHOT['indices'] = indices
+        return _LOTES_SNAPSHOT
     except Exception as e:
         try:
             print(f"[READ] error leyendo CSV {csv_path}: {e}")
         except Exception:
             pass
+        return None
+
+
+def leer_csv():
+    """Lee lotes del CSV."""
+    # Se devuelven copias porque los llamadores modifican las filas (guardar_csv borra 'Variedades').
+    snap = _snapshot_actual()
+    if snap is None:
+        return []
+    return [_copiar_lote(l) for l in snap['lotes']]
+
+
+def leer_lotes_activos():
+    """Lee solo los lotes no archivados (usa el índice del snapshot, sin filtrar todo)."""
+    snap = _snapshot_actual()
+    if snap is None:
         return []
+    lotes = snap['lotes']
+    return [_copiar_lote(lotes[i]) for i in snap['indices']['activos']]
+
+
+def leer_lotes_archivados():
+    """Lee solo los lotes archivados (incluye el archivo frío si está activo)."""
+    snap = _snapshot_actual()
+    lotes = snap['lotes'] if snap is not None else []
+    calientes = [_copiar_lote(lotes[i]) for i in snap['indices']['archivados']] if snap is not None else []
+    # El archivo frío se lee si existe, aunque este equipo no tenga cold_archive activo
+    return calientes + leer_archivo_frio()
+
+
+# Columnas canónicas del CSV (orden en que se escriben)
+CSV_FIELDNAMES = ['ID', 'Branch', 'LoteNum', 'Stage', 'Location', 'Semana',
+                  'DateCreated', 'ÚltimaActualización', 'Notes', 'Archivado']
+for _i in range(1, 21):
+    CSV_FIELDNAMES.extend([f'Variedad_{_i}', f'Cantidad_{_i}'])
+del _i
+
+
+def _escribir_lotes(f, lotes):
+    """Escribe cabecera y filas (aplanando 'Variedades') en un archivo abierto."""
+    writer = csv.DictWriter(f, fieldnames=CSV_FIELDNAMES, quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
+    writer.writeheader()
+
+    for row in lotes:
+        if 'ÚltimaActualización' not in row:
+            row['ÚltimaActualización'] = ''
+        if 'Variedades' in row:
+            variedades = row['Variedades']
+            for i in range(1, 21):
+                row[f'Variedad_{i}'] = ''
+                row[f'Cantidad_{i}'] = ''
+            for i, v in enumerate(variedades[:20], start=1):
+                row[f'Variedad_{i}'] = v.get('name', '')
+                row[f'Cantidad_{i}'] = str(v.get('count', 0))
+            del row['Variedades']
+        writer.writerow(row)
+
+
+# Serializa las escrituras del CSV entre hilos (UI, servidor LAN). Reentrante para que
+# quien hace leer-modificar-guardar pueda tomarlo alrededor de toda la operación.
+_ESCRITURA_LOCK = threading.RLock()
 
 
 def guardar_csv(lotes):
-    """Guarda lotes en el CSV. Si el usuario marcó borrado local, escribimos en el archivo de trabajo para preservar el original."""
-    target = LOTES_WORKING if globals().get('LOCAL_DATA_CLEARED') else LOTES_CSV
+    """Guarda lotes en el CSV. Si el usuario marcó borrado local, escribimos en el archivo de trabajo para preservar el original.
+
+    Con COLD_ARCHIVE los lotes archivados se mueven al archivo frío y el CSV solo guarda los activos."""
+    with _ESCRITURA_LOCK:
+        return _guardar_csv(lotes)
+
+
+def escribir_csv_externo(escribir):
+    """Ejecuta escribir() bajo el lock de escritura y avisa a las sesiones si cambiaron los lotes.
+
+    Para lo que reemplaza el CSV local fuera de ServicioLotes.mutar (descargas, restauraciones):
+    así no se intercala con una lectura-modificación-escritura de otra sesión."""
+    with _ESCRITURA_LOCK:
+        antes = leer_csv()
+        resultado = escribir()
+        despues = leer_csv()
+    if any(diff_lotes(antes, despues).values()):
+        SERVICIO_LOTES.publicar({'tipo': 'cambio', 'sesion': None, 'antes': antes, 'despues': despues})
+    return resultado
+
+
+def _guardar_csv(lotes):
+    target = ruta_csv_escritura()
+    temporales = []   # (temporal, destino); el CSV principal va primero
     try:
-        with open(target, 'w', newline='', encoding='utf-8') as f:
-            fieldnames = ['ID', 'Branch', 'LoteNum', 'Stage', 'Location', 'Semana',
-                         'DateCreated', 'ÚltimaActualización', 'Notes', 'Archivado']
-            for i in range(1, 21):
-                fieldnames.extend([f'Variedad_{i}', f'Cantidad_{i}'])
-            
-            writer = csv.DictWriter(f, fieldnames=fieldnames, quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
-            writer.writeheader()
-            
-            for row in lotes:
-                if 'ÚltimaActualización' not in row:
-                    row['ÚltimaActualización'] = ''
-                if 'Variedades' in row:
-                    variedades = row['Variedades']
-                    for i in range(1, 21):
-                        row[f'Variedad_{i}'] = ''
-                        row[f'Cantidad_{i}'] = ''
-                    for i, v in enumerate(variedades[:20], start=1):
-                        row[f'Variedad_{i}'] = v.get('name', '')
-                        row[f'Cantidad_{i}'] = str(v.get('count', 0))
-                    del row['Variedades']
-                writer.writerow(row)
+        # Filas sacadas del archivo frío en esta mutación (ver sacar_de_frio)
+        rescatados = [l.pop('_frio') for l in lotes if '_frio' in l]
+        archivados = []
+        if globals().get('COLD_ARCHIVE'):
+            archivados = [l for l in lotes if es_archivado(l)]
+            lotes = [l for l in lotes if not es_archivado(l)]
+        planes = _plan_frio(archivados, rescatados) if (archivados or rescatados) else {}
+
+        # 1) Todo a temporales: si algo falla aquí no cambió ningún archivo
+        tmp = target + '.tmp'
+        temporales.append((tmp, target))
+        with open(tmp, 'w', newline='', encoding='utf-8') as f:
+            _escribir_lotes(f, lotes)
+        if planes:
+            os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        for path, filas in planes.items():
+            temporales.append((path + '.tmp', path))
+            with open(path + '.tmp', 'w', newline='', encoding='utf-8') as f:
+                _escribir_lotes(f, filas)
+
+        # 2) Reemplazos: primero el frío y al final el CSV principal. Si el principal falla,
+        # se restaura el frío: los lotes no quedan duplicados ni se pierden.
+        originales = {}
+        for path in planes:
+            try:
+                with open(path, 'rb') as f:
+                    originales[path] = f.read()
+            except FileNotFoundError:
+                originales[path] = None
+        hechos = []
+        try:
+            for tmp_path, path in reversed(temporales):
+                os.replace(tmp_path, path)
+                hechos.append(path)
+        except Exception:
+            for path in hechos:
+                if path in originales:
+                    _restaurar_archivo(path, originales[path])
+            raise
+        if planes:
+            _COLD_CACHE['key'] = None
+            print(f"[ARCHIVO] {len(archivados)} lote(s) al archivo frío, {len(rescatados)} recuperado(s)")
+        invalidar_snapshot_lotes()
         # Actualizar hash local en meta
         try:
             with open(target, 'r', encoding='utf-8') as f:
@@ -569,10 +1070,203 @@ def guardar_csv(lotes):
         except Exception:
             pass
         return True
-    except Exception:
+    except Exception as e:
+        print(f"[WRITE] error guardando CSV: {e}")
+        for tmp_path, _path in temporales:
+            try:
+                os.remove(tmp_path)
+            except Exception:
+                pass
         return False
 
 
+def _restaurar_archivo(path, datos):
+    """Deja path como estaba (datos = bytes originales, o None si no existía)."""
+    try:
+        if datos is None:
+            os.remove(path)
+        else:
+            with open(path, 'wb') as f:
+                f.write(datos)
+    except Exception as e:
+        print(f"[WRITE] no se pudo restaurar {path}: {e}")
+
+
+# --- Archivo frío (lotes archivados por año) ---
+# Los archivados casi nunca se consultan; con COLD_ARCHIVE salen del CSV principal para que
+# parsear, hashear, reescribir y subir en cada edición solo cueste lo de los activos. Se
+# leen bajo demanda (pestaña Archivados, reportes) y se sincronizan como archivos aparte.
+ARCHIVE_DIR = os.path.join(BASE_PATH, 'archivo')
+REMOTE_ARCHIVE_DIR = 'archivo'
+NOMBRE_ARCHIVO_FRIO = re.compile(r'^lotes_archivo_\d{4}\.csv$')
+
+# Caché del archivo frío: {'key': ((nombre, mtime_ns, tamaño), ...), 'lotes': [...]}
+_COLD_CACHE = {'key': None, 'lotes': []}
+
+
+def anio_archivo(lote) -> str:
+    """Año de la partición fría de un lote: fecha de última actualización o de creación."""
+    for campo in ('ÚltimaActualización', 'DateCreated'):
+        valor = (lote.get(campo, '') or '').strip()
+        if len(valor) >= 4 and valor[:4].isdigit():
+            return valor[:4]
+    return datetime.now().strftime('%Y')
+
+
+def ruta_archivo_frio(anio: str) -> str:
+    return os.path.join(ARCHIVE_DIR, f'lotes_archivo_{anio}.csv')
+
+
+def archivos_frio():
+    """Rutas de las particiones frías existentes, ordenadas por año."""
+    return sorted(glob.glob(os.path.join(ARCHIVE_DIR, 'lotes_archivo_*.csv')))
+
+
+def _leer_particion_fria(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return _parsear_csv(f.read())[1]
+    except Exception as e:
+        print(f"[READ] error leyendo archivo frío {path}: {e}")
+        return []
+
+
+def _escribir_archivo_frio(nombre: str, datos: bytes):
+    """Reemplaza una partición fría con contenido descargado (bajo el lock de escritura)."""
+    path = os.path.join(ARCHIVE_DIR, nombre)
+    with _ESCRITURA_LOCK:
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(datos)
+        os.replace(tmp, path)
+        _COLD_CACHE['key'] = None
+
+
+def leer_archivo_frio():
+    """Lee (con caché por mtime/tamaño) todos los lotes del archivo frío."""
+    try:
+        key = tuple((os.path.basename(p), os.stat(p).st_mtime_ns, os.stat(p).st_size) for p in archivos_frio())
+    except Exception:
+        key = None
+    if key is None or _COLD_CACHE.get('key') != key:
+        lotes = []
+        for path in archivos_frio():
+            lotes.extend(_leer_particion_fria(path))
+        _COLD_CACHE['key'] = key
+        _COLD_CACHE['lotes'] = lotes
+    return [_copiar_lote(l) for l in _COLD_CACHE['lotes']]
+
+
+def _plan_frio(archivados, rescatados):
+    """Contenido nuevo de las particiones frías afectadas por un guardado: {ruta: lotes}.
+
+    archivados se agregan a su partición por año; rescatados = [(ruta, version_fila)] se quitan."""
+    planes = {}
+
+    def particion(path):
+        if path not in planes:
+            planes[path] = _leer_particion_fria(path) if os.path.exists(path) else []
+        return planes[path]
+
+    for path, version in rescatados:
+        filas = particion(path)
+        for i, lote in enumerate(filas):
+            if version_fila(lote) == version:
+                del filas[i]
+                break
+    for lote in archivados:
+        particion(ruta_archivo_frio(anio_archivo(lote))).append(_copiar_lote(lote))
+    return planes
+
+
+def sacar_de_frio(lote_id):
+    """Primer lote del archivo frío que coincide con lote_id (o None), sin modificar el archivo.
+
+    La fila lleva '_frio' con su origen: _guardar_csv la quita del archivo frío en la misma
+    escritura que la agrega al CSV principal (si esa escritura falla, el frío queda igual)."""
+    for path in archivos_frio():
+        lotes = _leer_particion_fria(path)
+        idx, lote = find_lote_by_id(lote_id, lotes)
+        if lote is not None:
+            lote['_frio'] = (path, version_fila(lote))
+            return lote
+    return None
+
+
+def archivos_frio_pendientes():
+    """Particiones frías cuyo contenido cambió desde la última subida: {ruta_remota: bytes}."""
+    estado = load_local_meta().get('archivo_frio') or {}
+    pendientes = {}
+    for path in archivos_frio():
+        try:
+            with open(path, 'rb') as f:
+                raw = f.read()
+        except Exception:
+            continue
+        nombre = os.path.basename(path)
+        if git_blob_sha(raw) != estado.get(nombre, {}).get('remote_sha'):
+            pendientes[f'{REMOTE_ARCHIVE_DIR}/{nombre}'] = raw
+    return pendientes
+
+
+def marcar_frio_subido(blobs: dict):
+    """Registra en meta el SHA remoto de las particiones frías subidas."""
+    prefijo = f'{REMOTE_ARCHIVE_DIR}/'
+    subidas = {r[len(prefijo):]: sha for r, sha in blobs.items() if r.startswith(prefijo)}
+    if not subidas:
+        return
+    meta = load_local_meta()
+    estado = meta.get('archivo_frio') or {}
+    for nombre, sha in subidas.items():
+        estado.setdefault(nombre, {})['remote_sha'] = sha
+    meta['archivo_frio'] = estado
+    save_local_meta(meta)
+
+
+def descargar_archivo_frio():
+    """Baja las particiones frías remotas que cambiaron. Devuelve (success, msg, n_actualizadas).
+
+    Si una partición local tiene cambios sin subir, se conserva y el remoto va a registros/."""
+    status, remotos = listar_remoto(REMOTE_ARCHIVE_DIR, GITHUB_BRANCH, timeout=6)
+    if status == 404:
+        return True, 'Sin archivo frío remoto', 0
+    if status != 200:
+        return False, 'Sin conexión' if status == 0 else f'Error HTTP {status}', 0
+    meta = load_local_meta()
+    estado = meta.get('archivo_frio') or {}
+    actualizadas = 0
+    for nombre, (sha, _size) in remotos.items():
+        if not NOMBRE_ARCHIVO_FRIO.match(nombre):
+            continue
+        e = estado.setdefault(nombre, {})
+        if sha == e.get('remote_sha'):
+            continue
+        path = os.path.join(ARCHIVE_DIR, nombre)
+        local_sha = ''
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                local_sha = git_blob_sha(f.read())
+        if local_sha == sha:
+            e['remote_sha'] = sha
+            continue
+        st, contenido, _h = descargar_remoto_texto(GITHUB_BRANCH, ruta=f'{REMOTE_ARCHIVE_DIR}/{nombre}')
+        if st != 200:
+            return False, f'Error HTTP {st} descargando {nombre}', actualizadas
+        if local_sha and local_sha != e.get('remote_sha'):
+            # Cambios locales sin subir (o sin base conocida): se conserva la copia local
+            save_remote_backup(contenido)
+            print(f"[ARCHIVO] conflicto en {nombre}: se conserva la copia local")
+            continue
+        _escribir_archivo_frio(nombre, contenido.encode('utf-8'))
+        e['remote_sha'] = sha
+        actualizadas += 1
+    meta = load_local_meta()
+    meta['archivo_frio'] = estado
+    save_local_meta(meta)
+    return True, 'Archivo frío sincronizado', actualizadas
+
+
 def ensure_registros_dir():
     os.makedirs(REGISTROS_DIR, exist_ok=True)
 
@@ -625,6 +1319,69 @@ def compute_hash(text: str) -> str:
         return ''
 
 
+# --- Snapshot binario pre-parseado para arranque en frío ---
+# Versión del formato; subirla invalida los snapshots existentes.
+SNAPSHOT_VERSION = 1
+
+
+def get_snapshot_path():
+    return os.path.join(BASE_PATH, 'lotes_local_snapshot.pickle')
+
+
+def guardar_snapshot_binario(content_hash: str, cabecera, lotes, indices):
+    """Escribe el snapshot binario (registros compactos + índices) asociado al hash del CSV.
+
+    Cada registro es (valores en orden de cabecera, variedades como tuplas (nombre, cantidad)).
+    Si alguna fila no encaja en la cabecera (columnas sobrantes) no se guarda snapshot."""
+    try:
+        registros = []
+        for lote in lotes:
+            if None in lote:
+                return False
+            valores = tuple(lote.get(c) for c in cabecera)
+            variedades = tuple((v['name'], v['count']) for v in lote.get('Variedades', []))
+            registros.append((valores, variedades))
+        payload = {
+            'version': SNAPSHOT_VERSION,
+            'hash': content_hash,
+            'cabecera': tuple(cabecera),
+            'registros': registros,
+            'indices': indices,
+        }
+        path = get_snapshot_path()
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            pickle.dump(payload, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+        return True
+    except Exception as e:
+        print(f"[SNAPSHOT] no se pudo guardar: {e}")
+        return False
+
+
+def cargar_snapshot_binario(content_hash: str):
+    """Carga el snapshot en una sola lectura si coincide versión y hash del CSV.
+    Devuelve {'lotes': [...], 'indices': {...}} o None para volver al parseo del CSV."""
+    path = get_snapshot_path()
+    if not content_hash or not os.path.exists(path):
+        return None
+    try:
+        with open(path, 'rb') as f:
+            payload = pickle.load(f)
+        if payload.get('version') != SNAPSHOT_VERSION or payload.get('hash') != content_hash:
+            return None
+        cabecera = payload['cabecera']
+        lotes = []
+        for valores, variedades in payload['registros']:
+            lote = dict(zip(cabecera, valores))
+            lote['Variedades'] = [{'name': n, 'count': c} for n, c in variedades]
+            lotes.append(lote)
+        return {'lotes': lotes, 'indices': payload['indices']}
+    except Exception as e:
+        print(f"[SNAPSHOT] snapshot inválido, se vuelve a parsear el CSV: {e}")
+        return None
+
+
 def save_remote_backup(content: str):
     """Guarda el contenido remoto como backup en registros para revisión manual."""
     ensure_registros_dir()
@@ -638,203 +1395,2594 @@ def save_remote_backup(content: str):
         return None
 
 
-def get_remote_csv_content():
-    """Obtiene el contenido remoto (sin escribir localmente). Devuelve (success, msg, content, hash)
-    Mejora: prueba ramas alternativas (p.ej. 'main' y 'master') y verifica existencia del repo para mensajes más claros."""
-    if not GITHUB_TOKEN:
-        return False, 'Sin token configurado', '', ''
+# --- Planificador de peticiones a GitHub (límite de API) ---
+# Todas las llamadas pasan por github_request, que lee X-RateLimit-* y Retry-After.
+# Las tareas de fondo (sondeo, cola de pendientes, verificación de arranque) se marcan con
+# en_segundo_plano y se difieren cuando queda poco presupuesto, reservándolo para las
+# sincronizaciones que inicia el usuario.
+RATE_LIMIT = {'limit': None, 'remaining': None, 'reset': 0, 'bloqueado_hasta': 0, 'diferidas': 0}
+RESERVA_USUARIO = 100
+_RATE_LOCK = threading.Lock()
+_PRIORIDAD = threading.local()
 
-    headers = {
-        'Authorization': f'token {GITHUB_TOKEN}',
-        'Accept': 'application/vnd.github.v3+json'
-    }
 
-    tried_branches = []
-    branches_to_try = []
-    # Priorizar la rama configurada, luego 'main' y 'master'
-    if GITHUB_BRANCH:
+class LimiteAPIDiferido(requests.exceptions.RequestException):
+    """La petición no se hizo (o fue rechazada) por el límite de la API de GitHub."""
+
+
+def en_segundo_plano(func, *args, **kwargs):
+    """Ejecuta func marcando sus peticiones a GitHub como de baja prioridad."""
+    _PRIORIDAD.fondo = True
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _PRIORIDAD.fondo = False
+
+
+def segundos_hasta_presupuesto() -> float:
+    """0 si hay presupuesto para tareas de fondo; si no, segundos hasta que se renueve."""
+    ahora = time.time()
+    with _RATE_LOCK:
+        espera = RATE_LIMIT['bloqueado_hasta'] - ahora
+        restantes = RATE_LIMIT['remaining']
+        if restantes is not None and restantes < RESERVA_USUARIO and RATE_LIMIT['reset'] > ahora:
+            espera = max(espera, RATE_LIMIT['reset'] - ahora)
+    return max(espera, 0)
+
+
+def presupuesto_bajo() -> bool:
+    return segundos_hasta_presupuesto() > 0
+
+
+def _hora(ts) -> str:
+    return datetime.fromtimestamp(ts).strftime('%H:%M')
+
+
+def _actualizar_rate_limit(resp):
+    h = resp.headers or {}
+    ahora = time.time()
+    with _RATE_LOCK:
+        try:
+            if 'X-RateLimit-Remaining' in h:
+                RATE_LIMIT['remaining'] = int(h['X-RateLimit-Remaining'])
+                RATE_LIMIT['limit'] = int(h.get('X-RateLimit-Limit', 0)) or RATE_LIMIT['limit']
+                RATE_LIMIT['reset'] = int(h.get('X-RateLimit-Reset', 0))
+        except Exception:
+            pass
+        if resp.status_code in (403, 429):
+            if h.get('Retry-After'):
+                try:
+                    RATE_LIMIT['bloqueado_hasta'] = ahora + int(h['Retry-After'])
+                except Exception:
+                    pass
+            elif RATE_LIMIT['remaining'] == 0:
+                RATE_LIMIT['bloqueado_hasta'] = RATE_LIMIT['reset']
+
+
+def github_request(method: str, url: str, **kwargs):
+    """Hace una petición a la API de GitHub respetando el límite de uso.
+
+    Lanza LimiteAPIDiferido si la API pidió esperar, si el presupuesto se agotó o si es
+    una tarea de fondo y el presupuesto está por debajo de la reserva del usuario."""
+    ahora = time.time()
+    fondo = getattr(_PRIORIDAD, 'fondo', False)
+    with _RATE_LOCK:
+        bloqueado_hasta = RATE_LIMIT['bloqueado_hasta']
+        restantes = RATE_LIMIT['remaining']
+        reset = RATE_LIMIT['reset']
+        if bloqueado_hasta > ahora:
+            raise LimiteAPIDiferido(f'Límite de API de GitHub, reintenta a las {_hora(bloqueado_hasta)}')
+        if restantes is not None and reset > ahora:
+            if restantes <= 0:
+                raise LimiteAPIDiferido(f'Límite de API agotado hasta las {_hora(reset)}')
+            if fondo and restantes < RESERVA_USUARIO:
+                RATE_LIMIT['diferidas'] += 1
+                raise LimiteAPIDiferido(f'Tarea de fondo diferida hasta las {_hora(reset)} (quedan {restantes})')
+    resp = requests.request(method, url, **kwargs)
+    _actualizar_rate_limit(resp)
+    if resp.status_code in (403, 429) and RATE_LIMIT['bloqueado_hasta'] > time.time():
+        resp.close()
+        raise LimiteAPIDiferido(f'Límite de API de GitHub, reintenta a las {_hora(RATE_LIMIT["bloqueado_hasta"])}')
+    return resp
+
+
+def resumen_rate_limit() -> str:
+    """Texto para diagnóstico con el presupuesto de API restante."""
+    with _RATE_LOCK:
+        rl = dict(RATE_LIMIT)
+    if rl['remaining'] is None:
+        return 'API GitHub: sin datos aún'
+    texto = f"API GitHub: {rl['remaining']}/{rl['limit'] or '?'} restantes"
+    if rl['reset']:
+        texto += f", se renueva a las {_hora(rl['reset'])}"
+    if rl['bloqueado_hasta'] > time.time():
+        texto += f" · bloqueado hasta {_hora(rl['bloqueado_hasta'])}"
+    if rl['diferidas']:
+        texto += f" · {rl['diferidas']} tareas de fondo diferidas"
+    return texto
+
+
+def github_headers(raw: bool = False):
+    """Headers para la API de GitHub. raw=True pide el archivo sin envoltorio JSON/base64."""
+    return {
+        'Authorization': f'token {GITHUB_TOKEN}',
+        'Accept': 'application/vnd.github.raw' if raw else 'application/vnd.github.v3+json'
+    }
+
+
+def git_blob_sha(data: bytes) -> str:
+    """SHA de blob de git (el mismo que reporta la API de contenidos) calculado localmente."""
+    h = hashlib.sha1()
+    h.update(b'blob %d\0' % len(data))
+    h.update(data)
+    return h.hexdigest()
+
+
+def listar_remoto(directorio: str, branch: str, timeout: int = 5, lanzar: bool = False):
+    """Lista los archivos de un directorio remoto (solo metadatos, sin contenido).
+
+    Devuelve (status, {nombre: (sha, size)}). 0 si hubo error de red (o lo propaga si lanzar=True)."""
+    url = f'https://api.github.com/repos/{GITHUB_REPO}/contents/{directorio}'.rstrip('/')
+    try:
+        resp = github_request('GET', url, headers=github_headers(), params={'ref': branch}, timeout=timeout)
+    except Exception:
+        if lanzar:
+            raise
+        return 0, {}
+    if resp.status_code != 200:
+        return resp.status_code, {}
+    try:
+        return 200, {e.get('name'): (e.get('sha', ''), e.get('size', 0))
+                     for e in resp.json() if e.get('type') == 'file'}
+    except Exception:
+        return 0, {}
+
+
+def probar_remoto(branch: str, timeout: int = 5, lanzar: bool = False, ruta: str = None):
+    """Consulta solo los metadatos del archivo remoto (listado del directorio padre, sin contenido).
+
+    Devuelve (status, sha, size). status 404 si el archivo o la rama no existen;
+    0 si hubo error de red (o lo propaga si lanzar=True)."""
+    directorio, _, nombre = (ruta or GITHUB_FILE_PATH).rpartition('/')
+    status, archivos = listar_remoto(directorio, branch, timeout=timeout, lanzar=lanzar)
+    if status != 200:
+        return status, '', 0
+    if nombre not in archivos:
+        return 404, '', 0
+    sha, size = archivos[nombre]
+    return 200, sha, size
+
+
+def sondear_remoto(etag: str = ''):
+    """GET condicional (If-None-Match) del listado remoto donde vive el CSV (o las particiones).
+
+    Un 304 no consume cuota de la API. Devuelve (status, etag, {nombre: sha} o None)."""
+    if DATA_LAYOUT == 'particionado':
+        directorio = PARTITION_DIR
+    else:
+        directorio = GITHUB_FILE_PATH.rpartition('/')[0]
+    url = f'https://api.github.com/repos/{GITHUB_REPO}/contents/{directorio}'.rstrip('/')
+    headers = github_headers()
+    if etag:
+        headers['If-None-Match'] = etag
+    try:
+        resp = github_request('GET', url, headers=headers, params={'ref': GITHUB_BRANCH}, timeout=5)
+    except Exception:
+        return 0, etag, None
+    if resp.status_code == 304:
+        return 304, etag, None
+    if resp.status_code != 200:
+        return resp.status_code, etag, None
+    try:
+        archivos = {e.get('name'): e.get('sha', '') for e in resp.json() if e.get('type') == 'file'}
+    except Exception:
+        return 0, etag, None
+    return 200, resp.headers.get('ETag', ''), archivos
+
+
+def hay_cambios_locales_pendientes() -> bool:
+    """True si el CSV local tiene (o puede tener) cambios que aún no están en el remoto.
+
+    Sin línea base en meta (arranque offline, primera descarga fallida) un CSV local con
+    contenido se considera modificado: el sondeo no debe sobrescribirlo."""
+    if pendientes_outbox():
+        return True
+    try:
+        with open(LOTES_CSV, 'r', encoding='utf-8') as f:
+            local_content = f.read()
+    except Exception:
+        return False
+    meta = load_local_meta()
+    if not meta.get('remote_hash'):
+        return bool(local_content.strip())
+    return not local_sin_cambios(local_content, meta)
+
+
+def remoto_cambio(archivos: dict) -> bool:
+    """Compara el listado sondeado con los SHA de la última sincronización."""
+    meta = load_local_meta()
+    if DATA_LAYOUT == 'particionado':
+        estado = meta.get('particiones') or {}
+        return any(sha != estado.get(nombre[:-4], {}).get('remote_sha')
+                   for nombre, sha in archivos.items() if nombre.endswith('.csv'))
+    nombre = GITHUB_FILE_PATH.rpartition('/')[2]
+    return archivos.get(nombre, '') != meta.get('remote_sha', '')
+
+
+def sondear_cambio(etag: str = ''):
+    """Sondeo barato del remoto según el transporte. Devuelve (status, etag, cambio)."""
+    transporte = obtener_transporte()
+    if usa_particiones(transporte) and transporte is not None:
+        status, versiones = transporte.listar(PARTITION_DIR)
+        estado = load_local_meta().get('particiones') or {}
+        return status, etag, status == 200 and any(
+            v != estado.get(nombre[:-4], {}).get('remote_version')
+            for nombre, v in versiones.items() if nombre.endswith('.csv'))
+    if transporte is not None:
+        status, version = transporte.version()
+        return status, etag, status == 200 and version != load_local_meta().get('remote_version')
+    status, etag, archivos = sondear_remoto(etag)
+    return status, etag, status == 200 and remoto_cambio(archivos)
+
+
+def sync_configurado() -> bool:
+    if obtener_transporte() is not None:
+        return True
+    return bool(GITHUB_TOKEN and GITHUB_REPO)
+
+
+def descargar_remoto_texto(branch: str, timeout: int = 10, ruta: str = None):
+    """Descarga en crudo el archivo remoto y lo devuelve como texto. Devuelve (status, content, hash).
+
+    Se lee en memoria (el llamador necesita el texto completo): sin temporal en disco que
+    compartir entre descargas concurrentes."""
+    url = f'https://api.github.com/repos/{GITHUB_REPO}/contents/{ruta or GITHUB_FILE_PATH}'
+    resp = github_request('GET', url, headers=github_headers(raw=True), params={'ref': branch},
+                          timeout=timeout)
+    if resp.status_code != 200:
+        return resp.status_code, '', ''
+    datos = resp.content
+    return 200, datos.decode('utf-8'), hashlib.sha256(datos).hexdigest()
+
+
+def get_remote_csv_content():
+    """Obtiene el contenido remoto (sin escribir localmente). Devuelve (success, msg, content, hash)
+    Mejora: prueba ramas alternativas (p.ej. 'main' y 'master') y verifica existencia del repo para mensajes más claros."""
+    if not GITHUB_TOKEN:
+        return False, 'Sin token configurado', '', ''
+
+    headers = {
+        'Authorization': f'token {GITHUB_TOKEN}',
+        'Accept': 'application/vnd.github.v3+json'
+    }
+
+    tried_branches = []
+    branches_to_try = []
+    # Priorizar la rama configurada, luego 'main' y 'master'
+    if GITHUB_BRANCH:
         branches_to_try.append(GITHUB_BRANCH)
     for b in ('main', 'master'):
         if b not in branches_to_try:
             branches_to_try.append(b)
 
-    url_base = f'https://api.github.com/repos/{GITHUB_REPO}/contents/{GITHUB_FILE_PATH}'
+    try:
+        for br in branches_to_try:
+            tried_branches.append(br)
+            try:
+                status, content, h = descargar_remoto_texto(br, timeout=6)
+            except requests.exceptions.Timeout:
+                return False, 'Timeout', '', ''
+
+            if status == 200:
+                # Actualizar branch para reflejar la rama efectiva
+                globals()['GITHUB_BRANCH'] = br
+                return True, 'OK', content, h
+            elif status == 401:
+                return False, 'Token inválido o sin permisos', '', ''
+            elif status == 404:
+                # intentar siguiente rama
+                continue
+            else:
+                return False, f'Error HTTP {status}', '', ''
+
+        # Si llegamos aquí, ninguna rama tuvo el archivo: verificar si el repo existe / hay acceso
+        repo_url = f'https://api.github.com/repos/{GITHUB_REPO}'
+        try:
+            r = github_request('GET', repo_url, headers=headers, timeout=5)
+            if r.status_code == 200:
+                return False, MensajeSync(f'Archivo {GITHUB_FILE_PATH} no encontrado (probadas ramas: {",".join(tried_branches)})', SYNC_NO_ENCONTRADO), '', ''
+            elif r.status_code == 401:
+                return False, 'Token inválido o sin permisos', '', ''
+            elif r.status_code == 404:
+                return False, MensajeSync('Repositorio no encontrado o sin acceso (verifica owner/repo)', SYNC_NO_ENCONTRADO), '', ''
+            else:
+                return False, f'Error HTTP {r.status_code}', '', ''
+        except requests.exceptions.Timeout:
+            return False, 'Timeout comprobando repo', '', ''
+        except Exception as e:
+            return False, f'Error: {str(e)[:50]}', '', ''
+
+    except Exception as e:
+        return False, f'Error: {str(e)[:50]}', '', ''
+
+
+def restore_latest_backup():
+    """Restaura el backup más reciente desde /registros al archivo local."""
+    ensure_registros_dir()
+    files = glob.glob(os.path.join(REGISTROS_DIR, "lotes_template_*.csv"))
+    if not files:
+        return False, 'No hay backups disponibles'
+    files.sort()
+    latest = files[-1]
+
+    def restaurar():
+        shutil.copy2(latest, LOTES_CSV)
+        invalidar_snapshot_lotes()
+        fix_csv_structure()
+
+    try:
+        escribir_csv_externo(restaurar)
+        return True, f'Restaurado backup {os.path.basename(latest)}'
+    except Exception as e:
+        return False, f'Error restaurando backup: {e}'
+
+
+# reactivate_uploads removed: reactivation via UI is intentionally disabled to avoid accidental remote changes.
+# To reactivate uploads the sentinel file `.no_auto_restore` must be removed manually by the user.
+
+
+def restore_remote_from_content(content: str):
+    """Crea o actualiza el archivo remoto en GitHub usando el contenido proporcionado.
+    Devuelve (success, msg)."""
+    if not GITHUB_TOKEN or not GITHUB_REPO:
+        return False, 'Token o repo no configurado'
+    url = f'https://api.github.com/repos/{GITHUB_REPO}/contents/{GITHUB_FILE_PATH}'
+    headers = {
+        'Authorization': f'token {GITHUB_TOKEN}',
+        'Accept': 'application/vnd.github.v3+json'
+    }
+    try:
+        # Verificar existencia para obtener SHA (solo metadatos)
+        try:
+            status, sha, _size = probar_remoto(GITHUB_BRANCH, lanzar=True)
+        except Exception as ex:
+            return False, f'Error comprobando remoto: {ex}'
+        if status != 200:
+            sha = None
+        # Preparar payload
+        encoded = base64.b64encode(content.encode('utf-8')).decode('utf-8')
+        fecha_hora = datetime.now().strftime("%Y-%m-%d %H:%M")
+        data = {'message': f"Restauración {fecha_hora}", 'content': encoded, 'branch': GITHUB_BRANCH}
+        if sha:
+            data['sha'] = sha
+        # Ejecutar PUT
+        put = github_request('PUT', url, headers=headers, json=data, timeout=15)
+        if put.status_code in (200, 201):
+            return True, 'Remoto restaurado'
+        else:
+            return False, f'Error {put.status_code} al restaurar remoto'
+    except Exception as ex:
+        return False, f'Error: {ex}'
+
+
+def subir_csv_github_from_content(content: str, allow_create: bool = False, preparada: dict = None):
+    """Helper que sube contenido dado al archivo remoto. allow_create permite crear el archivo si no existe.
+    preparada: resultado de preparar_subida(content) si el llamador ya lo calculó."""
+    # Similar a subir_csv_github pero con contenido en memoria
+    if not GITHUB_TOKEN:
+        return False, 'Sin token'
+    if not GITHUB_REPO or "/" not in GITHUB_REPO:
+        return False, 'Repo no configurado'
+    if not CURRENT_USER:
+        return False, 'Falta usuario configurado (⚙️ Usuario)'
+
+    url = f'https://api.github.com/repos/{GITHUB_REPO}/contents/{GITHUB_FILE_PATH}'
+    headers = {
+        'Authorization': f'token {GITHUB_TOKEN}',
+        'Accept': 'application/vnd.github.v3+json'
+    }
+    # Evitar subir si el usuario borró datos locales y no reactivó manualmente
+    try:
+        if globals().get('LOCAL_DATA_CLEARED'):
+            print("[NETWORK] subir_csv_github_from_content: upload bloqueado porque se borraron datos locales recientemente (requiere reactivar subidas)")
+            return False, MensajeSync('Subidas bloqueadas tras borrar datos locales. Reactiva subidas en Config para continuar.', SYNC_BLOQUEADO)
+    except Exception:
+        pass
+    # Comprobar si existe remotamente (solo metadatos)
+    try:
+        status, remote_sha, _size = probar_remoto(GITHUB_BRANCH, lanzar=True)
+    except Exception as ex:
+        return False, f'Error comprobando remoto: {ex}'
+    if status == 404 and not allow_create:
+        return False, MensajeSync('Archivo remoto no encontrado; no se crea sin permiso explícito', SYNC_NO_ENCONTRADO)
+
+    # Verificar que haya datos útiles
+    if preparada is None:
+        preparada = preparar_subida(content)
+    if preparada['filas'] is None:
+        return False, 'Contenido no válido'
+    if preparada['filas'] == 0:
+        return False, MensajeSync('Contenido vacío: no se sube', SYNC_LOCAL_VACIO)
+
+    # Construir payload y PUT (manejo de sha si existe)
+    try:
+        data = {'message': f'Restore {datetime.now().strftime("%Y-%m-%d %H:%M")}', 'content': preparada['b64'], 'branch': GITHUB_BRANCH}
+        if status == 200:
+            data['sha'] = remote_sha
+        # Guardar backup remoto previo si existe
+        try:
+            if status == 200:
+                st, remote_content, _h = descargar_remoto_texto(GITHUB_BRANCH)
+                rb_prev = save_remote_backup(remote_content) if st == 200 else None
+                print(f"[NETWORK] subir_csv_github_from_content: backup remoto previo creado {rb_prev}")
+        except Exception:
+            pass
+        put = github_request('PUT', url, headers=headers, json=data, timeout=15)
+        if put.status_code in (200,201):
+            return True, 'Remoto restaurado'
+        else:
+            return False, f'Error {put.status_code} al subir'
+    except Exception as ex:
+        return False, f'Error: {ex}'
+
+
+# --- Motor Git Data (blobs/trees/commits/refs) ---
+# La API de contenidos rechaza archivos grandes y hace un commit por archivo. Con Git Data
+# el CSV y sus archivos auxiliares van en un único commit atómico: si la rama avanzó
+# mientras tanto, la actualización de la ref (sin force) falla y no se pisa nada.
+CONTENTS_API_MAX_BYTES = 1024 * 1024
+
+
+def usar_git_data(preparada: dict, extras: dict = None) -> bool:
+    """Decide si la subida debe ir por la API Git Data."""
+    return bool(extras) or SYNC_ENGINE == 'git' or len(preparada['bytes']) > CONTENTS_API_MAX_BYTES
+
+
+def commit_git_data(archivos: dict, mensaje: str, branch: str = None):
+    """Crea un commit con varios archivos {ruta: bytes} sobre la rama y mueve la ref.
+
+    Solo crea blobs para archivos cuyo SHA no coincide con el último subido (meta['git_blobs']),
+    y reutiliza el árbol del último commit propio si la ref no se movió.
+    Devuelve (success, msg, {ruta: blob_sha})."""
+    branch = branch or GITHUB_BRANCH
+    api = f'https://api.github.com/repos/{GITHUB_REPO}/git'
+    headers = github_headers()
+    meta = load_local_meta()
+    conocidos = meta.get('git_blobs') or {}
+    try:
+        r = github_request('GET', f'{api}/ref/heads/{branch}', headers=headers, timeout=6)
+        if r.status_code != 200:
+            return False, f'Error HTTP {r.status_code} leyendo rama {branch}', {}
+        parent = r.json().get('object', {}).get('sha', '')
+
+        cabeza = meta.get('git_head') or {}
+        if cabeza.get('commit') == parent and cabeza.get('tree'):
+            base_tree = cabeza['tree']
+        else:
+            r = github_request('GET', f'{api}/commits/{parent}', headers=headers, timeout=6)
+            if r.status_code != 200:
+                return False, f'Error HTTP {r.status_code} leyendo commit', {}
+            base_tree = r.json().get('tree', {}).get('sha', '')
+
+        blobs = {}
+        entradas = []
+        for ruta, contenido in archivos.items():
+            sha = git_blob_sha(contenido)
+            if conocidos.get(ruta) != sha:
+                r = github_request('POST', f'{api}/blobs', headers=headers, timeout=30, json={
+                    'content': base64.b64encode(contenido).decode('utf-8'),
+                    'encoding': 'base64',
+                })
+                if r.status_code != 201:
+                    return False, f'Error {r.status_code} creando blob {ruta}', {}
+                sha = r.json().get('sha', sha)
+            blobs[ruta] = sha
+            entradas.append({'path': ruta, 'mode': '100644', 'type': 'blob', 'sha': sha})
+
+        r = github_request('POST', f'{api}/trees', headers=headers, timeout=15,
+                          json={'base_tree': base_tree, 'tree': entradas})
+        if r.status_code != 201:
+            return False, f'Error {r.status_code} creando árbol', {}
+        tree = r.json().get('sha', '')
+
+        r = github_request('POST', f'{api}/commits', headers=headers, timeout=15,
+                          json={'message': mensaje, 'tree': tree, 'parents': [parent]})
+        if r.status_code != 201:
+            return False, f'Error {r.status_code} creando commit', {}
+        commit = r.json().get('sha', '')
+
+        r = github_request('PATCH', f'{api}/refs/heads/{branch}', headers=headers, timeout=10,
+                           json={'sha': commit, 'force': False})
+        if r.status_code == 422:
+            return False, MensajeSync('Conflicto remoto detectado', SYNC_CONFLICTO), {}
+        if r.status_code != 200:
+            return False, f'Error {r.status_code} actualizando rama', {}
+
+        meta = load_local_meta()
+        conocidos = meta.get('git_blobs') or {}
+        conocidos.update(blobs)
+        meta['git_blobs'] = conocidos
+        meta['git_head'] = {'commit': commit, 'tree': tree}
+        save_local_meta(meta)
+        return True, f'Commit {commit[:7]} ({len(archivos)} archivos)', blobs
+    except Exception as e:
+        print(f"[NETWORK] commit_git_data: exception {e}")
+        return False, f'Error: {str(e)[:50]}', {}
+
+
+# --- Transportes de sincronización ---
+# GitHub es el transporte por defecto (funciones *_github de arriba). Los alternativos
+# implementan version()/leer()/escribir() y comparten la misma lógica de conflictos por
+# hash/meta (aplicar_csv_remoto y subir_con_transporte): meta['remote_version'] guarda
+# la versión (mtime/tamaño o ETag) del último remoto sincronizado.
+class TransporteCarpeta:
+    """Carpeta compartida (NAS/SMB montado). Escritura con lock + temporal + rename atómico."""
+    nombre = 'carpeta'
+    particiones = True
+    LOCK_CADUCO = 60   # segundos tras los cuales un lock huérfano se descarta
+
+    def __init__(self, carpeta: str, ruta: str = None):
+        self.carpeta = carpeta
+        self.ruta = os.path.join(carpeta, ruta or os.path.basename(GITHUB_FILE_PATH))
+        self.lock = self.ruta + '.lock'
+
+    def para(self, ruta: str):
+        """Mismo transporte sobre otro archivo (p. ej. 'archivo/lotes_archivo_2024.csv')."""
+        return TransporteCarpeta(self.carpeta, ruta)
+
+    @staticmethod
+    def _version_de(st):
+        return f'{st.st_mtime_ns}-{st.st_size}'
+
+    def version(self):
+        try:
+            return 200, self._version_de(os.stat(self.ruta))
+        except FileNotFoundError:
+            return (404, '') if os.path.isdir(self.carpeta) else (0, '')
+        except Exception:
+            return 0, ''
+
+    def listar(self, directorio: str):
+        """Archivos de un subdirectorio: (status, {nombre: version})."""
+        ruta = os.path.join(self.carpeta, directorio)
+        if not os.path.isdir(self.carpeta):
+            return 0, {}
+        if not os.path.isdir(ruta):
+            return 404, {}
+        try:
+            return 200, {e.name: self._version_de(e.stat()) for e in os.scandir(ruta) if e.is_file()}
+        except Exception:
+            return 0, {}
+
+    def leer(self):
+        """Devuelve (status, bytes, version)."""
+        try:
+            with open(self.ruta, 'rb') as f:
+                datos = f.read()
+            return 200, datos, self.version()[1]
+        except FileNotFoundError:
+            return 404, b'', ''
+        except Exception:
+            return 0, b'', ''
+
+    def _tomar_lock(self, espera: float = 5.0) -> bool:
+        limite = time.monotonic() + espera
+        while True:
+            try:
+                fd = os.open(self.lock, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                os.write(fd, f'{CURRENT_USER} {datetime.now().isoformat()}'.encode('utf-8'))
+                os.close(fd)
+                return True
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.lock) > self.LOCK_CADUCO:
+                        os.remove(self.lock)
+                        continue
+                except Exception:
+                    pass
+                if time.monotonic() > limite:
+                    return False
+                time.sleep(0.2)
+
+    def escribir(self, datos: bytes, version_esperada):
+        """Escribe si la versión remota sigue siendo version_esperada. Devuelve (ok, msg, version)."""
+        try:
+            os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+        except Exception as e:
+            return False, f'Error: {str(e)[:50]}', ''
+        if not self._tomar_lock():
+            return False, 'Carpeta compartida ocupada (lock)', ''
+        try:
+            actual = self.version()[1]
+            if version_esperada is not None and actual != version_esperada:
+                return False, MensajeSync('Conflicto remoto detectado', SYNC_CONFLICTO), actual
+            tmp = f'{self.ruta}.{os.getpid()}.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(datos)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.ruta)
+            return True, 'Sincronizado', self.version()[1]
+        except Exception as e:
+            return False, f'Error: {str(e)[:50]}', ''
+        finally:
+            try:
+                os.remove(self.lock)
+            except Exception:
+                pass
+
+
+class TransporteWebDAV:
+    """Servidor WebDAV. Las escrituras usan If-Match con el ETag conocido (412 = conflicto)."""
+    nombre = 'webdav'
+    particiones = True
+
+    def __init__(self, url: str, usuario: str = '', clave: str = '', ruta: str = None):
+        self.base = url.rstrip('/')
+        self.url = self.base + '/' + (ruta or os.path.basename(GITHUB_FILE_PATH))
+        self.usuario, self.clave = usuario, clave
+        self.auth = (usuario, clave) if usuario else None
+
+    def para(self, ruta: str):
+        """Mismo transporte sobre otro archivo (p. ej. 'archivo/lotes_archivo_2024.csv')."""
+        return TransporteWebDAV(self.base, self.usuario, self.clave, ruta)
+
+    def listar(self, directorio: str):
+        """Archivos de una colección (PROPFIND Depth 1): (status, {nombre: etag})."""
+        cuerpo = ('<?xml version="1.0" encoding="utf-8"?><propfind xmlns="DAV:"><prop>'
+                  '<getetag/></prop></propfind>')
+        try:
+            r = requests.request('PROPFIND', f'{self.base}/{directorio}/', data=cuerpo, auth=self.auth,
+                                 headers={'Depth': '1', 'Content-Type': 'application/xml'}, timeout=10)
+        except Exception:
+            return 0, {}
+        if r.status_code != 207:
+            return r.status_code, {}
+        archivos = {}
+        try:
+            raiz = ElementTree.fromstring(r.content)
+        except ElementTree.ParseError:
+            return 0, {}
+        for resp in raiz.iter('{DAV:}response'):
+            href = resp.findtext('{DAV:}href') or ''
+            nombre = unquote(href.rstrip('/').rsplit('/', 1)[-1])
+            if href.endswith('/') or not nombre:
+                continue
+            archivos[nombre] = resp.findtext('.//{DAV:}getetag') or ''
+        return 200, archivos
+
+    def version(self):
+        try:
+            r = requests.head(self.url, auth=self.auth, timeout=5)
+        except Exception:
+            return 0, ''
+        if r.status_code == 200:
+            return 200, r.headers.get('ETag', '')
+        return r.status_code, ''
+
+    def leer(self):
+        try:
+            r = requests.get(self.url, auth=self.auth, timeout=10)
+        except Exception:
+            return 0, b'', ''
+        if r.status_code != 200:
+            return r.status_code, b'', ''
+        return 200, r.content, r.headers.get('ETag', '')
+
+    def escribir(self, datos: bytes, version_esperada):
+        """version_esperada: ETag conocido, o None para crear solo si no existe.
+
+        Un ETag vacío (servidor que no los devuelve) no permite una escritura condicional:
+        se rechaza en lugar de sobrescribir a ciegas."""
+        if version_esperada == '':
+            return False, MensajeSync('El servidor WebDAV no devuelve ETag: no se puede escribir sin riesgo de pisar cambios', SYNC_BLOQUEADO), ''
+        headers = {'Content-Type': 'text/csv; charset=utf-8'}
+        if version_esperada:
+            headers['If-Match'] = version_esperada
+        else:
+            # Crear solo si no existe
+            headers['If-None-Match'] = '*'
+        try:
+            r = requests.put(self.url, data=datos, headers=headers, auth=self.auth, timeout=15)
+            if r.status_code == 409 and version_esperada is None:
+                # Falta la colección padre (p. ej. archivo/): crearla y reintentar
+                requests.request('MKCOL', self.url.rsplit('/', 1)[0] + '/', auth=self.auth, timeout=10)
+                r = requests.put(self.url, data=datos, headers=headers, auth=self.auth, timeout=15)
+        except Exception as e:
+            return False, f'Error: {str(e)[:50]}', ''
+        if r.status_code == 412:
+            return False, MensajeSync('Conflicto remoto detectado', SYNC_CONFLICTO), ''
+        if r.status_code not in (200, 201, 204):
+            return False, f'Error {r.status_code}', ''
+        etag = r.headers.get('ETag') or self.version()[1]
+        return True, 'Sincronizado', etag
+
+
+def usa_particiones(transporte=None) -> bool:
+    """True si la sincronización usa el layout particionado (con GitHub o un transporte que lo admite)."""
+    return DATA_LAYOUT == 'particionado' and getattr(transporte, 'particiones', True)
+
+
+def obtener_transporte():
+    """Transporte alternativo configurado, o None si se usa GitHub."""
+    if SYNC_TRANSPORT == 'carpeta' and SYNC_FOLDER:
+        return TransporteCarpeta(SYNC_FOLDER)
+    if SYNC_TRANSPORT == 'webdav' and WEBDAV_URL:
+        return TransporteWebDAV(WEBDAV_URL, WEBDAV_USER, WEBDAV_PASSWORD)
+    if SYNC_TRANSPORT == 'lan' and LAN_URL:
+        return TransporteLAN(LAN_URL, LAN_TOKEN)
+    return None
+
+
+def descargar_con_transporte(transporte):
+    """Equivalente de descargar_csv_github para un transporte alternativo. Devuelve (success, msg)."""
+    status, version = transporte.version()
+    if status == 0:
+        return False, 'Sin conexión'
+    if status == 404:
+        return False, MensajeSync(f'Archivo {os.path.basename(GITHUB_FILE_PATH)} no encontrado ({transporte.nombre})', SYNC_NO_ENCONTRADO)
+    if status != 200:
+        return False, f'Error {status}'
+    if version and version == load_local_meta().get('remote_version') and os.path.exists(LOTES_CSV):
+        return True, 'Sin cambios remotos'
+    status, datos, version = transporte.leer()
+    if status != 200:
+        return False, f'Error {status} leyendo remoto'
+    remote_content = datos.decode('utf-8')
+    ok, msg = aplicar_csv_remoto(remote_content, compute_hash(remote_content))
+    if ok:
+        meta = load_local_meta()
+        meta['remote_version'] = version
+        save_local_meta(meta)
+        # Archivar/desarchivar en otro equipo también cambia el CSV principal
+        sincronizar_frio_transporte(transporte)
+    return ok, msg
+
+
+def subir_con_transporte(transporte, force: bool = False, preparada: dict = None):
+    """Equivalente de subir_csv_github para un transporte alternativo. Devuelve (success, msg)."""
+    if preparada is None:
+        preparada = preparar_subida_local()
+        if preparada is None:
+            return False, 'Error lectura local'
+    if preparada['filas'] == 0 and not force:
+        return False, MensajeSync('Local vacío o sólo cabecera, usa force=True para forzar subida', SYNC_LOCAL_VACIO)
+    meta = load_local_meta()
+    status, version = transporte.version()
+    if status == 0:
+        return False, 'Sin conexión'
+    if status == 404 and not force:
+        return False, MensajeSync(f'Archivo {os.path.basename(GITHUB_FILE_PATH)} no encontrado ({transporte.nombre})', SYNC_NO_ENCONTRADO)
+    if status not in (200, 404):
+        return False, f'Error {status}'
+
+    if status == 200 and version != meta.get('remote_version'):
+        # El remoto cambió desde la última sincronización: mismo criterio que GitHub
+        st, datos, version = transporte.leer()
+        if st == 200:
+            remote_content = datos.decode('utf-8')
+            remote_hash = compute_hash(remote_content)
+            if (meta.get('remote_hash') and remote_hash != meta.get('remote_hash')
+                    and remote_hash != preparada['hash'] and not force):
+                rb = save_remote_backup(remote_content)
+                print(f"[SYNC] {transporte.nombre}: conflicto, backup remoto {rb}")
+                return False, MensajeSync('Conflicto remoto detectado', SYNC_CONFLICTO)
+
+    ok, msg, nueva = transporte.escribir(preparada['bytes'], version if status == 200 else None)
+    print(f"[SYNC] {transporte.nombre}: {msg}")
+    if not ok:
+        return False, msg
+    crear_backup()
+    meta = load_local_meta()
+    meta['local_hash'] = preparada['hash']
+    meta['remote_hash'] = preparada['hash']
+    meta['remote_version'] = nueva
+    save_local_meta(meta)
+    sincronizar_frio_transporte(transporte)
+    return True, 'Sincronizado'
+
+
+def sincronizar_frio_transporte(transporte):
+    """Sincroniza archivo/ con un transporte alternativo. Devuelve (success, msg, n_bajadas).
+
+    meta['archivo_frio_transporte'][nombre] = {'version', 'hash'} del último estado común.
+    Si cambiaron ambos lados (o no hay base y difieren) se conserva la copia local y el
+    remoto va a registros/."""
+    status, remotos = transporte.listar(REMOTE_ARCHIVE_DIR)
+    if status not in (200, 404):
+        print(f"[ARCHIVO] {transporte.nombre}: error {status} listando {REMOTE_ARCHIVE_DIR}/")
+        return False, f'Error {status}', 0
+    meta = load_local_meta()
+    estado = meta.get('archivo_frio_transporte') or {}
+    locales = {os.path.basename(p): p for p in archivos_frio()}
+    bajadas = conflictos = 0
+    ok, msg = True, 'Archivo frío sincronizado'
+    for nombre in sorted(set(remotos) | set(locales)):
+        if not NOMBRE_ARCHIVO_FRIO.match(nombre):
+            continue
+        e = estado.get(nombre, {})
+        local = None
+        if nombre in locales:
+            try:
+                with open(locales[nombre], 'rb') as f:
+                    local = f.read()
+            except Exception:
+                continue
+        h_local = hashlib.sha256(local).hexdigest() if local is not None else ''
+        cambio_local = local is not None and h_local != e.get('hash')
+        remota = remotos.get(nombre)
+        archivo = transporte.para(f'{REMOTE_ARCHIVE_DIR}/{nombre}')
+        if remota is not None and remota != e.get('version'):
+            st, datos, version = archivo.leer()
+            if st != 200:
+                ok, msg = False, f'Error {st} leyendo {nombre}'
+                break
+            h = hashlib.sha256(datos).hexdigest()
+            if h != h_local:
+                if cambio_local:
+                    save_remote_backup(datos.decode('utf-8'))
+                    print(f"[ARCHIVO] {transporte.nombre}: conflicto en {nombre}, se conserva la copia local")
+                    conflictos += 1
+                    continue
+                _escribir_archivo_frio(nombre, datos)
+                bajadas += 1
+            estado[nombre] = {'version': version, 'hash': h}
+        elif cambio_local:
+            subido, m, version = archivo.escribir(local, remota)
+            if not subido:
+                ok, msg = False, MensajeSync(f'{nombre}: {m}', codigo_sync(m))
+                break
+            estado[nombre] = {'version': version, 'hash': h_local}
+    meta = load_local_meta()
+    meta['archivo_frio_transporte'] = estado
+    save_local_meta(meta)
+    if ok and conflictos:
+        ok, msg = False, MensajeSync(f'Conflicto en {conflictos} partición(es) del archivo frío', SYNC_CONFLICTO)
+    print(f"[ARCHIVO] {transporte.nombre}: {msg} ({bajadas} bajadas)")
+    return ok, msg, bajadas
+
+
+def sincronizar_transporte(transporte, force: bool = False):
+    """Sincronización manual con un transporte alternativo: baja si cambió y sube lo local."""
+    if usa_particiones(transporte):
+        return sincronizar_particiones(force=force, transporte=transporte)
+    ok, msg = descargar_con_transporte(transporte)
+    if not ok and codigo_sync(msg) != SYNC_NO_ENCONTRADO and not (force and codigo_sync(msg) == SYNC_CONFLICTO):
+        return False, msg
+    ok, msg = subir_con_transporte(transporte, force=force)
+    if ok:
+        limpiar_outbox()
+    return ok, msg
+
+
+# --- Exportación en streaming ---
+# Las exportaciones leen el CSV fila a fila, filtran con un predicado y escriben por
+# bloques en un temporal que se renombra al terminar. El orden (sucursal, nº de lote) se
+# hace por tramos ordenados que se vuelcan a disco y se mezclan, con memoria acotada.
+EXPORT_HEADERS = ['ID', 'Sucursal', 'Lote', 'Etapa', 'Ubicación', 'Semana', 'Fecha', 'Variedades', 'Total Plantas', 'Notas']
+EXPORT_TRAMO = 5000   # lotes ordenados en memoria antes de volcar un tramo a disco
+EXPORT_BLOQUE = 500   # filas por escritura (y por aviso de progreso)
+
+
+def iterar_lotes(solo_activos: bool = True):
+    """Genera los lotes del CSV de a uno, sin cargar el archivo completo."""
+    ruta = _ruta_csv_lectura()
+    if ruta is None:
+        return
+    with open(ruta, newline='', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            lote = _fila_a_lote(row)
+            if solo_activos and es_archivado(lote):
+                continue
+            yield lote
+
+
+def filtro_listado(branch=None, stage=None, location=None):
+    """Predicado con los filtros del Listado ('Todas' o None = sin filtrar)."""
+    branch, stage, location = (None if v in (None, '', 'Todas') else v for v in (branch, stage, location))
+
+    def predicado(lote):
+        if branch and lote.get('Branch') != branch:
+            return False
+        if stage and lote.get('Stage') != stage:
+            return False
+        if location and lote.get('Location') != location:
+            return False
+        return True
+    return predicado
+
+
+def clave_orden_lote(lote):
+    """Orden de exportación: sucursal y número de lote."""
+    try:
+        return (lote.get('Branch', ''), int(lote.get('LoteNum', 0)))
+    except:
+        return (lote.get('Branch', ''), 0)
+
+
+def _leer_tramo(f):
+    f.seek(0)
+    while True:
+        try:
+            yield pickle.load(f)
+        except EOFError:
+            return
+
+
+def ordenar_lotes_streaming(lotes, clave=clave_orden_lote, tramo: int = EXPORT_TRAMO):
+    """Ordena un flujo de lotes (estable) sin tenerlo entero en memoria si supera un tramo."""
+    tramos, actual = [], []
+    try:
+        for n, lote in enumerate(lotes):
+            actual.append((clave(lote), n, lote))
+            if len(actual) >= tramo:
+                actual.sort(key=lambda t: t[:2])
+                f = tempfile.TemporaryFile()
+                for item in actual:
+                    pickle.dump(item, f, protocol=pickle.HIGHEST_PROTOCOL)
+                tramos.append(f)
+                actual = []
+        actual.sort(key=lambda t: t[:2])
+        if not tramos:
+            for item in actual:
+                yield item[2]
+            return
+        for item in heapq.merge(*[_leer_tramo(f) for f in tramos], iter(actual), key=lambda t: t[:2]):
+            yield item[2]
+    finally:
+        for f in tramos:
+            f.close()
+
+
+def fila_export(lote):
+    """Fila de exportación CSV de un lote."""
+    variedades = lote.get('Variedades', [])
+    return [
+        lote.get('ID', ''),
+        lote.get('Branch', ''),
+        lote.get('LoteNum', ''),
+        lote.get('Stage', ''),
+        lote.get('Location', ''),
+        lote.get('Semana', ''),
+        lote.get('DateCreated', ''),
+        ', '.join(f"{v['name']}({v['count']})" for v in variedades),
+        sum(v['count'] for v in variedades),
+        lote.get('Notes', ''),
+    ]
+
+
+def exportar_csv_streaming(destino, predicado=None, progreso=None, lotes=None):
+    """Exporta a CSV escribiendo por bloques en destino + '.part' y renombrando al final.
+
+    lotes: iterable de lotes (por defecto iterar_lotes()). progreso(n) recibe las filas
+    escritas. Devuelve el número de lotes exportados; con 0 no se crea el archivo."""
+    fuente = iterar_lotes() if lotes is None else lotes
+    if predicado is not None:
+        fuente = filter(predicado, fuente)
+    tmp = destino + '.part'
+    n = 0
+    try:
+        with open(tmp, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(EXPORT_HEADERS)
+            bloque = []
+            for lote in ordenar_lotes_streaming(fuente):
+                bloque.append(fila_export(lote))
+                n += 1
+                if len(bloque) >= EXPORT_BLOQUE:
+                    writer.writerows(bloque)
+                    bloque = []
+                    if progreso:
+                        progreso(n)
+            writer.writerows(bloque)
+        if n:
+            os.replace(tmp, destino)
+        else:
+            os.remove(tmp)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except Exception:
+            pass
+        raise
+    if progreso:
+        progreso(n)
+    return n
+
+
+EXCEL_HEADERS = ['ID', 'Sucursal', 'Lote', 'Etapa', 'Ubicación', 'Semana', 'Fecha', 'Variedades', 'Total', 'Notas']
+
+
+def _entero(valor):
+    valor = str(valor or '')
+    return int(valor) if valor.isdigit() else 0
+
+
+def _hoja_excel(wb, titulo, encabezados):
+    """Crea una hoja en modo solo-escritura con anchos fijos y encabezado en negrita."""
+    ws = wb.create_sheet(title=titulo)
+    ws.column_dimensions['A'].width = 12
+    ws.column_dimensions['H'].width = 30
+    ws.column_dimensions['J'].width = 25
+    fila = []
+    for h in encabezados:
+        cell = WriteOnlyCell(ws, value=h)
+        cell.font = Font(bold=True)
+        fila.append(cell)
+    ws.append(fila)
+    return ws
+
+
+def exportar_excel_streaming(destino, predicado=None, progreso=None, lotes=None):
+    """Exporta a XLSX con openpyxl en modo solo-escritura: una hoja por sucursal y un resumen.
+
+    Mismo contrato que exportar_csv_streaming: progreso(n), devuelve nº de lotes (0 = sin archivo)."""
+    fuente = iterar_lotes() if lotes is None else lotes
+    if predicado is not None:
+        fuente = filter(predicado, fuente)
+    tmp = destino + '.part'
+    wb = Workbook(write_only=True)
+    resumen = _hoja_excel(wb, 'Resumen', ['Sucursal', 'Lotes', 'Plantas'])
+    totales = {}   # sucursal -> [lotes, plantas]
+    hoja, sucursal_hoja = None, None
+    n = 0
+    try:
+        for lote in ordenar_lotes_streaming(fuente):
+            sucursal = lote.get('Branch', '') or 'Sin sucursal'
+            if hoja is None or sucursal != sucursal_hoja:
+                titulo = ''.join(c for c in sucursal if c not in '[]:*?/\\')[:31] or 'Sin sucursal'
+                hoja, sucursal_hoja = _hoja_excel(wb, titulo, EXCEL_HEADERS), sucursal
+            variedades = lote.get('Variedades', [])
+            total = sum(v['count'] for v in variedades)
+            hoja.append([
+                lote.get('ID', ''),
+                lote.get('Branch', ''),
+                _entero(lote.get('LoteNum', '')),
+                lote.get('Stage', ''),
+                lote.get('Location', ''),
+                _entero(lote.get('Semana', '')),
+                lote.get('DateCreated', ''),
+                ', '.join(f"{v['name']}({v['count']})" for v in variedades),
+                total,
+                lote.get('Notes', ''),
+            ])
+            t = totales.setdefault(sucursal, [0, 0])
+            t[0] += 1
+            t[1] += total
+            n += 1
+            if progreso and n % EXPORT_BLOQUE == 0:
+                progreso(n)
+        if not n:
+            return 0
+        for sucursal, (k, plantas) in totales.items():
+            resumen.append([sucursal, k, plantas])
+        total_cells = [WriteOnlyCell(resumen, value=v) for v in
+                       ('TOTAL', n, sum(t[1] for t in totales.values()))]
+        for cell in total_cells:
+            cell.font = Font(bold=True)
+        resumen.append(total_cells)
+        wb.save(tmp)
+        os.replace(tmp, destino)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except Exception:
+            pass
+        raise
+    if progreso:
+        progreso(n)
+    return n
+
+
+def _dibujar_lote_pdf(pdf, lote):
+    """Ficha de un lote: encabezado gris y lista de variedades."""
+    variedades = lote.get('Variedades', [])
+    total = sum(v['count'] for v in variedades)
+
+    # Verificar si hay espacio suficiente, sino nueva página
+    needed_height = 30 + (len(variedades) * 5)
+    if pdf.get_y() + needed_height > 270:
+        pdf.add_page()
+
+    # Encabezado del lote (fondo gris)
+    pdf.set_fill_color(230, 230, 230)
+    pdf.set_font('Helvetica', 'B', 11)
+    pdf.cell(0, 8, f"{lote.get('ID', '')}  |  {lote.get('Stage', '')}  |  {lote.get('Location', '')}  |  "
+                   f"Semana {lote.get('Semana', '')}  |  Total: {total} plantas",
+             new_x=XPos.LMARGIN, new_y=YPos.NEXT, fill=True, border=1)
+
+    # Lista de variedades
+    if variedades:
+        pdf.set_font('Helvetica', '', 9)
+        for v in sorted(variedades, key=lambda x: x['name']):
+            pdf.cell(10, 5, '', border=0)  # Indentación
+            pdf.cell(80, 5, f"- {v['name']}", border=0)
+            pdf.cell(30, 5, str(v['count']), new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='R')
+    else:
+        pdf.set_font('Helvetica', 'I', 9)
+        pdf.cell(10, 5, '', border=0)
+        pdf.cell(0, 5, 'Sin variedades', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+
+    pdf.ln(3)
+
+
+def _dibujar_titulo_pdf(pdf, generado, filtros):
+    pdf.set_font('Helvetica', 'B', 18)
+    pdf.cell(0, 12, 'Control de Lotes - Reporte', new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='C')
+    if generado:
+        pdf.set_font('Helvetica', '', 10)
+        pdf.cell(0, 8, f'Generado: {generado}', new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='C')
+    pdf.ln(5)
+    if filtros:
+        pdf.set_font('Helvetica', 'I', 9)
+        pdf.cell(0, 6, f'Filtros: {" | ".join(filtros)}', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    pdf.ln(5)
+
+
+def _dibujar_resumen_pdf(pdf, total_lotes, total_plantas):
+    pdf.ln(5)
+    pdf.set_draw_color(0, 0, 0)
+    pdf.set_font('Helvetica', 'B', 12)
+    pdf.cell(0, 10, f'TOTAL: {total_lotes} lotes  |  {total_plantas} plantas',
+             new_x=XPos.LMARGIN, new_y=YPos.NEXT, border=1, align='C')
+
+
+def _nuevo_pdf():
+    pdf = FPDF()
+    pdf.set_auto_page_break(auto=True, margin=15)
+    pdf.add_page()
+    return pdf
+
+
+def _dibujar_sucursal_pdf(pdf, sucursal, lotes, cancelar=None):
+    """Subtítulo de la sucursal y sus fichas. Devuelve False si se canceló a mitad."""
+    pdf.set_font('Helvetica', 'B', 14)
+    pdf.cell(0, 10, f'Sucursal: {sucursal}', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
+    for lote in lotes:
+        if cancelar and cancelar():
+            return False
+        _dibujar_lote_pdf(pdf, lote)
+    return True
+
+
+def _render_seccion_pdf(sucursal, lotes, titulo=None, resumen=None):
+    """Renderiza en un proceso aparte la sección de una sucursal. Devuelve los bytes del PDF."""
+    pdf = _nuevo_pdf()
+    if titulo:
+        _dibujar_titulo_pdf(pdf, *titulo)
+    _dibujar_sucursal_pdf(pdf, sucursal, lotes)
+    if resumen:
+        _dibujar_resumen_pdf(pdf, *resumen)
+    return bytes(pdf.output())
+
+
+def _procesos_disponibles() -> bool:
+    """Pool de procesos solo donde es fiable: escritorio sin empaquetar, y nunca dentro de un
+    worker del pool (un reporte PDF generado en un worker se dibuja en secuencia)."""
+    return (not hasattr(sys, 'getandroidapilevel') and not getattr(sys, 'frozen', False)
+            and multiprocessing.parent_process() is None)
+
+
+# Pool de procesos compartido por todo el proceso (sesiones web, exportaciones y reportes):
+# uno solo acota el total de procesos a os.cpu_count() aunque varias sesiones exporten a la
+# vez. Usa 'spawn': un fork desde un proceso con hilos (servidor, sondeo, subidas) puede
+# heredar locks tomados.
+_POOL_PROCESOS = {'pool': None}
+_POOL_PROCESOS_LOCK = threading.Lock()
+
+
+def pool_procesos() -> ProcessPoolExecutor:
+    """Pool de procesos compartido (se crea al primer uso y se recrea si un worker murió).
+
+    Los workers no heredan el estado del proceso principal (LOCAL_DATA_CLEARED, rutas,
+    config leída en main): los trabajos reciben los lotes ya leídos, nunca leen el CSV."""
+    with _POOL_PROCESOS_LOCK:
+        pool = _POOL_PROCESOS['pool']
+        if pool is None or getattr(pool, '_broken', False):
+            # Los workers solo exportan: que no carguen Flet al importar este módulo. Va en el
+            # entorno que heredan (un initializer llegaría tarde: desempaquetarlo ya importa
+            # el módulo); en este proceso Flet ya está cargado y la variable no cambia nada.
+            os.environ['LOTES_HEADLESS'] = '1'
+            pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1,
+                                       mp_context=multiprocessing.get_context('spawn'))
+            _POOL_PROCESOS['pool'] = pool
+        return pool
+
+
+def _pdf_en_paralelo() -> bool:
+    return PYPDF_AVAILABLE and _procesos_disponibles()
+
+
+def exportar_pdf(destino, predicado=None, filtros=None, progreso=None, cancelar=None, lotes=None,
+                 con_fecha=True):
+    """Exporta el reporte PDF con una sección por sucursal (cada una empieza en página nueva).
+
+    Con pypdf las secciones se renderizan en paralelo en el pool de procesos compartido y
+    se unen; si no, se dibujan en secuencia en el mismo documento. progreso(hechas, total)
+    cuenta secciones; cancelar() se consulta entre secciones/fichas (al cancelar se
+    descartan las secciones en cola sin esperar a las que ya se están dibujando).
+    Devuelve el número de lotes, 0 si no hay datos o None si se canceló (en ambos casos
+    no se crea el archivo). con_fecha=False omite la hora de generación del título (para
+    la caché de exportaciones, que se sirve días después)."""
+    fuente = iterar_lotes() if lotes is None else lotes
+    if predicado is not None:
+        fuente = filter(predicado, fuente)
+    secciones = [(sucursal, list(grupo)) for sucursal, grupo in
+                 itertools.groupby(ordenar_lotes_streaming(fuente), key=lambda l: l.get('Branch', ''))]
+    n = sum(len(g) for _, g in secciones)
+    if not n:
+        return 0
+    titulo = (datetime.now().strftime("%Y-%m-%d %H:%M") if con_fecha else '', list(filtros or []))
+    resumen = (n, sum(sum(v['count'] for v in l.get('Variedades', [])) for _, g in secciones for l in g))
+    tmp = destino + '.part'
+    try:
+        if _pdf_en_paralelo() and len(secciones) > 1:
+            partes = [None] * len(secciones)
+            pool = pool_procesos()
+            pendientes = {
+                pool.submit(_render_seccion_pdf, sucursal, grupo,
+                            titulo if i == 0 else None,
+                            resumen if i == len(secciones) - 1 else None): i
+                for i, (sucursal, grupo) in enumerate(secciones)
+            }
+            hechas = 0
+            try:
+                while pendientes:
+                    listos, _ = wait(pendientes, timeout=0.2, return_when=FIRST_COMPLETED)
+                    if cancelar and cancelar():
+                        return None
+                    for futuro in listos:
+                        partes[pendientes.pop(futuro)] = futuro.result()
+                        hechas += 1
+                        if progreso:
+                            progreso(hechas, len(secciones))
+            finally:
+                # Cancelado o con error: las secciones aún en cola no se dibujan
+                for futuro in pendientes:
+                    futuro.cancel()
+            writer = PdfWriter()
+            for parte in partes:
+                writer.append(PdfReader(io.BytesIO(parte)))
+            with open(tmp, 'wb') as f:
+                writer.write(f)
+        else:
+            pdf = _nuevo_pdf()
+            _dibujar_titulo_pdf(pdf, *titulo)
+            for i, (sucursal, grupo) in enumerate(secciones):
+                if i:
+                    pdf.add_page()
+                if not _dibujar_sucursal_pdf(pdf, sucursal, grupo, cancelar):
+                    return None
+                if progreso:
+                    progreso(i + 1, len(secciones))
+            _dibujar_resumen_pdf(pdf, *resumen)
+            pdf.output(tmp)
+        os.replace(tmp, destino)
+    finally:
+        if os.path.exists(tmp):
+            try:
+                os.remove(tmp)
+            except Exception:
+                pass
+    return n
+
+
+# --- Caché de exportaciones ---
+# Repetir una exportación con los mismos datos y filtros devuelve el archivo ya generado.
+# La clave combina el hash del CSV, los filtros y el formato; el índice guarda filas y
+# último uso para descartar por LRU cuando la carpeta supera EXPORT_CACHE_MAX_BYTES.
+# Lo cacheado no depende de la hora: los PDF de la caché no llevan "Generado: <fecha>".
+EXPORTS_DIR = os.path.join(REGISTROS_DIR, 'exports')
+EXPORT_CACHE_MAX_BYTES = 50 * 1024 * 1024
+EXPORT_CACHE_VERSION = 2   # subirla al cambiar el formato de algún exportador
+_EXPORT_CACHE_LOCK = threading.Lock()
+
+
+def hash_datos_export() -> str:
+    """Hash del CSV que leen los exportadores ('' si no hay datos).
+
+    Es el hash de contenido del snapshot: con el CSV sin cambios (mismo mtime/tamaño) no
+    se vuelve a leer el archivo."""
+    snap = _snapshot_actual()
+    return snap.get('hash', '') if snap is not None else ''
+
+
+def clave_export(data_hash: str, formato: str, filtros) -> str:
+    datos = json.dumps([EXPORT_CACHE_VERSION, data_hash, formato, list(filtros)], ensure_ascii=False)
+    return hashlib.sha256(datos.encode('utf-8')).hexdigest()[:32]
+
+
+def _indice_exports_path():
+    return os.path.join(EXPORTS_DIR, 'index.json')
+
+
+def _leer_indice_exports() -> dict:
+    try:
+        with open(_indice_exports_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _guardar_indice_exports(indice: dict):
+    tmp = _indice_exports_path() + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(indice, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, _indice_exports_path())
+
+
+def podar_cache_exports(indice: dict, max_bytes: int = EXPORT_CACHE_MAX_BYTES):
+    """Borra las entradas menos usadas hasta que la caché quepa en max_bytes."""
+    total = sum(e.get('bytes', 0) for e in indice.values())
+    for clave, entrada in sorted(indice.items(), key=lambda kv: kv[1].get('usado', 0)):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(os.path.join(EXPORTS_DIR, entrada['archivo']))
+        except Exception:
+            pass
+        total -= entrada.get('bytes', 0)
+        del indice[clave]
+
+
+def exportar_cacheado(formato: str, filtros, destino: str, exportar):
+    """Copia a destino la exportación cacheada o la genera con exportar(ruta) y la guarda.
+
+    exportar sigue el contrato de los exportadores (nº de lotes, 0 sin datos, None cancelado).
+    Devuelve (n, desde_cache)."""
+    os.makedirs(EXPORTS_DIR, exist_ok=True)
+    data_hash = hash_datos_export()
+    clave = clave_export(data_hash, formato, filtros)
+    archivo = f'{clave}.{formato}'
+    ruta = os.path.join(EXPORTS_DIR, archivo)
+    with _EXPORT_CACHE_LOCK:
+        indice = _leer_indice_exports()
+        entrada = indice.get(clave)
+        if entrada and os.path.exists(ruta):
+            shutil.copyfile(ruta, destino)
+            entrada['usado'] = time.time()
+            _guardar_indice_exports(indice)
+            print(f"[EXPORT] {formato} desde caché ({entrada.get('filas')} lotes)")
+            return entrada.get('filas', 0), True
+
+    # Se genera en un temporal propio: dos exportaciones iguales en paralelo no escriben
+    # el mismo archivo de la caché, y la entrada solo aparece completa (os.replace)
+    fd, tmp = tempfile.mkstemp(prefix=f'{clave}.', suffix=f'.{formato}', dir=EXPORTS_DIR)
+    os.close(fd)
+    try:
+        n = exportar(tmp)
+        if not n:
+            return n, False
+        shutil.copyfile(tmp, destino)
+        if hash_datos_export() != data_hash:
+            # Los datos cambiaron durante la exportación: no cachear un resultado de clave dudosa
+            return n, False
+        with _EXPORT_CACHE_LOCK:
+            os.replace(tmp, ruta)
+            indice = _leer_indice_exports()
+            indice[clave] = {'archivo': archivo, 'filas': n, 'bytes': os.path.getsize(ruta),
+                             'usado': time.time(), 'formato': formato, 'filtros': list(filtros)}
+            podar_cache_exports(indice)
+            _guardar_indice_exports(indice)
+        return n, False
+    finally:
+        if os.path.exists(tmp):
+            try:
+                os.remove(tmp)
+            except Exception:
+                pass
+
+
+# --- Reportes semanales programados ---
+# Avance semanal y luego reportes CSV/XLSX/PDF por sucursal generados en paralelo, en
+# registros/reports/<semana ISO>_<fecha>/ con un manifest.json. ultimo.json recuerda el
+# hash de los datos del último reporte para no repetir el trabajo si nada cambió, y en
+# 'fallido' la última corrida con error de la semana: el reintento reusa su carpeta.
+REPORTS_DIR = os.path.join(REGISTROS_DIR, 'reports')
+REPORT_FORMATOS = ('csv', 'xlsx', 'pdf')
+_REPORTES_LOCK = threading.Lock()
+
+
+def semana_reporte(fecha=None) -> str:
+    return (fecha or datetime.now()).strftime('%G-W%V')
+
+
+def _exportador(formato):
+    return {'csv': exportar_csv_streaming, 'xlsx': exportar_excel_streaming, 'pdf': exportar_pdf}[formato]
+
+
+def _formato_disponible(formato) -> bool:
+    return {'xlsx': OPENPYXL_AVAILABLE, 'pdf': FPDF_AVAILABLE}.get(formato, True)
+
+
+def _generar_reporte(formato, sucursal, destino, lotes):
+    """Genera el reporte de una sucursal con sus lotes (trabajo del pool). Devuelve (n, sha256)."""
+    n = _exportador(formato)(destino, lotes=lotes)
+    if not n:
+        return 0, ''
+    with open(destino, 'rb') as f:
+        return n, hashlib.sha256(f.read()).hexdigest()
+
+
+def _ultimo_reporte_path():
+    return os.path.join(REPORTS_DIR, 'ultimo.json')
+
+
+def leer_ultimo_reporte() -> dict:
+    try:
+        with open(_ultimo_reporte_path(), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+
+def _guardar_json(ruta, datos):
+    tmp = ruta + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(datos, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, ruta)
+
+
+def _registrar_fallo_reporte(msg: str, carpeta: str = ''):
+    """Anota en ultimo.json la corrida fallida de esta semana (el reintento reusa la carpeta)."""
+    ultimo = leer_ultimo_reporte()
+    previo = ultimo.get('fallido') or {}
+    misma_semana = previo.get('semana') == semana_reporte()
+    ultimo['fallido'] = {
+        'semana': semana_reporte(),
+        'carpeta': carpeta or (previo.get('carpeta', '') if misma_semana else ''),
+        'error': msg,
+        'intentos': (int(previo.get('intentos', 0)) if misma_semana else 0) + 1,
+        'fecha': datetime.now().isoformat(timespec='seconds'),
+    }
+    _guardar_json(_ultimo_reporte_path(), ultimo)
+    return False, msg, ultimo['fallido']['carpeta']
+
+
+def generar_reportes_semanales(avanzar=True, subir=True, formatos=REPORT_FORMATOS, forzar=False, progreso=None,
+                               ponerse_al_dia=False):
+    """Avance semanal (una escritura y una subida) y reportes por sucursal en paralelo.
+
+    Con subida y sync configurado, primero baja el remoto: si otro equipo ya avanzó la
+    semana no se avanza dos veces, y si no se puede sincronizar la corrida queda como
+    fallida (sin avanzar) para reintentarse. progreso(hechos, total) cuenta reportes.
+    Devuelve (success, msg, carpeta)."""
+    if not _REPORTES_LOCK.acquire(blocking=False):
+        return False, 'Reportes en curso', ''
+    try:
+        os.makedirs(REPORTS_DIR, exist_ok=True)
+        avance, msg_subida = 0, ''
+        if avanzar:
+            if subir and sync_configurado():
+                ok, msg = descargar_csv_github()
+                if not ok:
+                    return _registrar_fallo_reporte(f'Avance pendiente, no se pudo sincronizar: {msg}')
+            try:
+                cambios, subida = SERVICIO_LOTES.mutar(
+                    lambda lotes: calcular_avance_semanal(lotes, ponerse_al_dia=ponerse_al_dia), subir=subir)
+            except ErrorEscrituraCSV as e:
+                return _registrar_fallo_reporte(str(e))
+            avance = len(cambios or [])
+            if subida is not None:
+                msg_subida = f"; subida: {subida.result()[1]}"
+
+        data_hash = hash_datos_export()
+        ultimo = leer_ultimo_reporte()
+        if not forzar and ultimo.get('hash') == data_hash and os.path.isdir(ultimo.get('carpeta', '')):
+            ultimo['semana'] = semana_reporte()
+            ultimo.pop('fallido', None)
+            _guardar_json(_ultimo_reporte_path(), ultimo)
+            return True, f'Sin cambios desde el último reporte{msg_subida}', ultimo['carpeta']
+
+        formatos = [f for f in formatos if _formato_disponible(f)]
+        # Los lotes se leen aquí y viajan con cada trabajo: un worker del pool no ve el
+        # estado de este proceso (p.e. el archivo de trabajo tras borrar los datos locales)
+        por_sucursal = {}
+        for lote in iterar_lotes():
+            if lote.get('Branch', ''):
+                por_sucursal.setdefault(lote['Branch'], []).append(lote)
+        ahora = datetime.now()
+        fallido = ultimo.get('fallido') or {}
+        if fallido.get('semana') == semana_reporte(ahora) and os.path.isdir(fallido.get('carpeta', '')):
+            # Reintento de una corrida fallida de esta semana: misma carpeta
+            carpeta = fallido['carpeta']
+        else:
+            carpeta = os.path.join(REPORTS_DIR, f"{semana_reporte(ahora)}_{ahora.strftime('%Y%m%d_%H%M%S')}")
+        os.makedirs(carpeta, exist_ok=True)
+        trabajos = [(f, suc, os.path.join(carpeta, f'lotes_{suc}.{f}'), por_sucursal[suc])
+                    for suc in sorted(por_sucursal) for f in formatos]
+
+        archivos, errores = [], []
+        if trabajos:
+            # El pool de procesos es el compartido (no se cierra aquí); el de hilos es propio
+            if _procesos_disponibles():
+                pool, propio = pool_procesos(), None
+            else:
+                pool = propio = ThreadPoolExecutor(max_workers=min(len(trabajos), os.cpu_count() or 1))
+            try:
+                futuros = {pool.submit(_generar_reporte, *t): t for t in trabajos}
+                for hechos, futuro in enumerate(as_completed(futuros), 1):
+                    formato, sucursal, destino, _lotes = futuros[futuro]
+                    try:
+                        n, sha = futuro.result()
+                    except Exception as e:
+                        errores.append(f'{sucursal}.{formato}: {str(e)[:50]}')
+                        n = 0
+                    if n:
+                        archivos.append({'archivo': os.path.basename(destino), 'sucursal': sucursal,
+                                         'formato': formato, 'lotes': n,
+                                         'bytes': os.path.getsize(destino), 'sha256': sha})
+                    if progreso:
+                        progreso(hechos, len(trabajos))
+            finally:
+                if propio is not None:
+                    propio.shutdown()
+        archivos.sort(key=lambda a: (a['sucursal'], a['formato']))
+        _guardar_json(os.path.join(carpeta, 'manifest.json'), {
+            'generado': ahora.isoformat(timespec='seconds'),
+            'semana': semana_reporte(ahora),
+            'hash_datos': data_hash,
+            'lotes_avanzados': avance,
+            'archivos': archivos,
+            'errores': errores,
+        })
+        if errores:
+            return _registrar_fallo_reporte(f'{len(errores)} reporte(s) con error: {errores[0]}', carpeta)
+        _guardar_json(_ultimo_reporte_path(), {'hash': data_hash, 'carpeta': carpeta,
+                                               'semana': semana_reporte(ahora),
+                                               'fecha': ahora.isoformat(timespec='seconds')})
+        print(f"[REPORTES] {len(archivos)} reportes en {carpeta}")
+        return True, f'{len(archivos)} reportes ({avance} lotes avanzados){msg_subida}', carpeta
+    finally:
+        _REPORTES_LOCK.release()
+
+
+# --- Servicio de datos compartido entre sesiones ---
+# Servida como app web, cada supervisor tiene su propio main(page) pero todas las sesiones
+# comparten proceso y CSV. El servicio serializa las mutaciones (leer-modificar-guardar
+# bajo _ESCRITURA_LOCK), avisa a las demás sesiones por pubsub con el antes/después para
+# que apliquen el diff, y un único hilo agrupa las subidas de ráfagas de ediciones.
+TOPICO_LOTES = 'lotes'
+SUBIDA_AGRUPAR_SEG = 1.5
+# Intervalo adaptativo del sondeo remoto: rápido tras ediciones locales, lento en reposo
+POLL_MIN, POLL_MAX = 20, 300
+
+
+class ErrorEscrituraCSV(Exception):
+    """guardar_csv falló dentro de ServicioLotes.mutar (los cambios no se guardaron)."""
+
+
+class ServicioLotes:
+    def __init__(self):
+        self._pubsubs = []
+        self._cond = threading.Condition()
+        self._espera = []      # Futures de las mutaciones que entran en la próxima subida
+        self._hilo = None
+        self._tareas = False   # sondeo/flusher/reportes ya lanzados en este proceso
+
+    def conectar(self, page, al_recibir):
+        """Suscribe la sesión a los eventos del servicio. al_recibir(topic, evento)."""
+        try:
+            page.pubsub.subscribe_topic(TOPICO_LOTES, al_recibir)
+        except Exception as e:
+            print(f"[SERVICIO] pubsub no disponible: {e}")
+            return
+        with self._cond:
+            self._pubsubs.append(page.pubsub)
+
+    def desconectar(self, page):
+        with self._cond:
+            if page.pubsub in self._pubsubs:
+                self._pubsubs.remove(page.pubsub)
+        try:
+            page.pubsub.unsubscribe_topic(TOPICO_LOTES)
+        except Exception:
+            pass
+
+    def publicar(self, evento: dict):
+        """Envía el evento a todas las sesiones (basta el pubsub de una sesión viva)."""
+        for pubsub in list(self._pubsubs):
+            try:
+                pubsub.send_all_on_topic(TOPICO_LOTES, evento)
+                return
+            except Exception:
+                with self._cond:
+                    if pubsub in self._pubsubs:
+                        self._pubsubs.remove(pubsub)
+
+    def mutar(self, aplicar, sesion=None, subir=True):
+        """Aplica aplicar(lotes) sobre una lectura fresca y guarda, todo bajo el lock de escritura.
+
+        aplicar modifica la lista en sitio y devuelve un resultado; si es falso no se guarda.
+        Devuelve (resultado, subida) con subida = Future de (success, msg) o None.
+        Lanza ErrorEscrituraCSV si no se pudo guardar."""
+        with _ESCRITURA_LOCK:
+            lotes = leer_csv()
+            antes = [_copiar_lote(l) for l in lotes]
+            resultado = aplicar(lotes)
+            if not resultado:
+                return resultado, None
+            if not guardar_csv(lotes):
+                raise ErrorEscrituraCSV('Error guardando CSV')
+            despues = leer_csv()
+        self.publicar({'tipo': 'cambio', 'sesion': sesion, 'antes': antes, 'despues': despues})
+        return resultado, (self.programar_subida() if subir else None)
+
+    def programar_subida(self) -> Future:
+        """Encola una subida; las pedidas dentro de SUBIDA_AGRUPAR_SEG salen en un solo commit."""
+        futuro = Future()
+        with self._cond:
+            self._espera.append(futuro)
+            if self._hilo is None or not self._hilo.is_alive():
+                self._hilo = threading.Thread(target=self._subidor, daemon=True, name='lotes-subidas')
+                self._hilo.start()
+            self._cond.notify()
+        return futuro
+
+    def _subidor(self):
+        while True:
+            with self._cond:
+                while not self._espera:
+                    self._cond.wait()
+            time.sleep(SUBIDA_AGRUPAR_SEG)
+            with self._cond:
+                futuros, self._espera = self._espera, []
+            try:
+                success, msg = subir_csv_github()
+            except Exception as e:
+                success, msg = False, f'Error: {str(e)[:50]}'
+            for futuro in futuros:
+                futuro.set_result((success, msg))
+            self.publicar({'tipo': 'subida', 'ok': success, 'msg': msg})
+
+    def iniciar_tareas(self, reportes=False):
+        """Lanza una sola vez por proceso el sondeo remoto, el flusher de pendientes y (con
+        reportes) los reportes programados. Las sesiones solo reciben sus eventos por pubsub."""
+        with self._cond:
+            if self._tareas:
+                return
+            self._tareas = True
+        tareas = [self._sondeo_remoto, self._flusher_outbox]
+        if reportes:
+            tareas.append(self._reportes_programados)
+        for tarea in tareas:
+            threading.Thread(target=tarea, daemon=True, name=f'lotes{tarea.__name__}').start()
+
+    def _estado(self, ok, msg):
+        self.publicar({'tipo': 'estado', 'ok': ok, 'msg': msg})
+
+    def _sondeo_remoto(self):
+        """Sondea el remoto con GET condicional y baja los cambios si no hay ediciones pendientes.
+
+        La descarga publica el diff a las sesiones (escribir_csv_externo)."""
+        etag, intervalo, mtime_local = '', 60, None
+        time.sleep(intervalo)
+        while True:
+            try:
+                # Una edición local reciente acelera el sondeo
+                try:
+                    mtime = os.path.getmtime(LOTES_CSV)
+                except Exception:
+                    mtime = None
+                if mtime_local is not None and mtime != mtime_local:
+                    intervalo = POLL_MIN
+                mtime_local = mtime
+
+                if sync_configurado() and not os.path.exists(NO_AUTO_RESTORE_FILE):
+                    status, nuevo_etag, cambio = en_segundo_plano(sondear_cambio, etag)
+                    if status == 200:
+                        etag = nuevo_etag
+                    if cambio:
+                        intervalo = POLL_MIN
+                        if DATA_LAYOUT == 'particionado' or not hay_cambios_locales_pendientes():
+                            ok, msg = en_segundo_plano(descargar_csv_github)
+                            print(f"[POLL] cambio remoto -> {msg}")
+                            if not ok:
+                                self._estado(False, msg)
+                            mtime_local = None
+                        else:
+                            self._estado(False, "Hay cambios remotos; sincroniza tus cambios pendientes")
+                    else:
+                        # Sin cambios (304) o sin conexión: espaciar el sondeo
+                        intervalo = min(int(intervalo * 1.5), POLL_MAX)
+                    if presupuesto_bajo():
+                        intervalo = POLL_MAX
+            except Exception as ex:
+                print(f"[POLL] error: {ex}")
+            time.sleep(intervalo)
+
+    def _flusher_outbox(self):
+        """Reintenta en background las subidas pendientes, con backoff exponencial."""
+        proximo_intento = 0.0
+        mostrados = None
+        while True:
+            time.sleep(5)
+            try:
+                n = pendientes_outbox()
+                if n != mostrados:
+                    mostrados = n
+                    self.publicar({'tipo': 'pendientes', 'n': n})
+                if not n or not sync_configurado() or time.monotonic() < proximo_intento:
+                    continue
+                ok, msg = en_segundo_plano(vaciar_outbox)
+                if ok:
+                    proximo_intento = 0.0
+                    self._estado(True, f"Pendientes sincronizados ({n})")
+                elif not _error_reintentable(msg):
+                    # Conflicto: no insistir en automático, requiere sincronización manual
+                    proximo_intento = time.monotonic() + OUTBOX_BACKOFF_MAX
+                    self._estado(False, msg)
+                else:
+                    # Con poco presupuesto de API, esperar a que se renueve y subir todo junto
+                    espera = max(espera_outbox(leer_outbox().get('intentos', 0)), segundos_hasta_presupuesto())
+                    proximo_intento = time.monotonic() + espera
+            except Exception as ex:
+                print(f"[OUTBOX] error en flusher: {ex}")
+
+    def _reportes_programados(self):
+        """Con "reportes_auto": avance y reportes por sucursal una vez por semana ISO."""
+        time.sleep(60)
+        while True:
+            try:
+                if REPORTES_AUTO and leer_ultimo_reporte().get('semana') != semana_reporte():
+                    ok, msg, carpeta = generar_reportes_semanales()
+                    print(f"[REPORTES] programado: {msg}")
+                    if ok:
+                        self._estado(True, f"Reportes semanales: {msg}")
+            except Exception as ex:
+                print(f"[REPORTES] error en modo programado: {ex}")
+            time.sleep(3600)
+
+
+SERVICIO_LOTES = ServicioLotes()
+
+
+# --- Sincronización LAN (servidor de escritorio + transporte cliente) ---
+# Un escritorio con "lan_server": true expone su CSV por HTTP en la red local. Cada
+# versión se identifica por el hash del contenido y cada fila por version_fila (hash de
+# su firma). Los clientes (sync_transport = "lan") suben deltas por fila: el servidor las
+# aplica si las filas tocadas no cambiaron desde la base del cliente, aunque otras sí, y
+# deja la subida a GitHub en su cola de pendientes para hacer un solo commit.
+_LAN_SERVIDOR = {'server': None, 'al_cambiar': None}
+LAN_MAX_BYTES = 20 * 1024 * 1024   # tope del cuerpo de PUT /lotes y POST /delta
+
+
+class CuerpoDemasiadoGrande(Exception):
+    pass
+
+
+def version_fila(lote) -> str:
+    return hashlib.sha1(repr(firma_lote(lote)).encode('utf-8')).hexdigest()[:16]
+
+
+def _contenido_lan():
+    """(bytes, hash) del CSV local que sirve el servidor LAN."""
+    try:
+        with open(ruta_csv_escritura(), 'rb') as f:
+            datos = f.read()
+    except Exception:
+        datos = b''
+    return datos, hashlib.sha256(datos).hexdigest()
+
+
+def _archivo_frio_lan(ruta: str):
+    """Nombre de la partición fría de una ruta '/archivo/<nombre>', o None si no es válida."""
+    prefijo = f'/{REMOTE_ARCHIVE_DIR}/'
+    if not ruta.startswith(prefijo):
+        return None
+    nombre = unquote(ruta[len(prefijo):])
+    return nombre if NOMBRE_ARCHIVO_FRIO.match(nombre) else None
+
+
+def _contenido_frio_lan(nombre: str):
+    """(bytes, hash) de una partición fría local; (None, '') si no existe."""
+    try:
+        with open(os.path.join(ARCHIVE_DIR, nombre), 'rb') as f:
+            datos = f.read()
+    except FileNotFoundError:
+        return None, ''
+    return datos, hashlib.sha256(datos).hexdigest()
+
+
+def _notificar_cambio_lan():
+    callback = _LAN_SERVIDOR.get('al_cambiar')
+    if callback:
+        try:
+            callback()
+        except Exception as e:
+            print(f"[LAN] error notificando cambio: {e}")
+
+
+def aplicar_delta_lan(base: str, cambios: dict):
+    """Aplica un delta de filas recibido de un cliente. Devuelve (status_http, respuesta)."""
+    code, respuesta = escribir_csv_externo(lambda: _aplicar_delta_lan(cambios))
+    if code != 200:
+        return code, respuesta
+    _datos, h = _contenido_lan()
+    registrar_pendiente('Cambios recibidos por LAN')
+    _notificar_cambio_lan()
+    print(f"[LAN] delta aplicado (base {base[:8]}) -> {h[:8]}")
+    return 200, {'hash': h}
+
+
+def _aplicar_delta_lan(cambios: dict):
+    """Cuerpo de aplicar_delta_lan, bajo el lock de escritura (escribir_csv_externo)."""
+    actuales = leer_csv()
+    indice = indexar_lotes(actuales)
+    posicion = {id(l): i for i, l in enumerate(actuales)}
+    conflictos = []
+    reemplazos, borrar = {}, set()
+    for m in cambios.get('modificados', []):
+        clave = tuple(m.get('clave', []))
+        actual = indice.get(clave)
+        if actual is None or version_fila(actual) != m.get('version'):
+            conflictos.append(list(clave))
+        else:
+            reemplazos[posicion[id(actual)]] = m.get('fila', {})
+    for m in cambios.get('eliminados', []):
+        clave = tuple(m.get('clave', []))
+        actual = indice.get(clave)
+        if actual is None:
+            continue
+        if version_fila(actual) != m.get('version'):
+            conflictos.append(list(clave))
+        else:
+            borrar.add(posicion[id(actual)])
+    if conflictos:
+        return 409, {'error': 'Conflicto', 'claves': conflictos}
+
+    firmas = {version_fila(l) for l in actuales}
+    nuevos = []
+    for i, lote in enumerate(actuales):
+        if i in borrar:
+            continue
+        nuevos.append(reemplazos.get(i, lote))
+    for fila in cambios.get('agregados', []):
+        if version_fila(fila) not in firmas:
+            nuevos.append(fila)
+    if not guardar_csv(nuevos):
+        return 500, {'error': 'Error escribiendo CSV'}
+    return 200, None
+
+
+class _ManejadorLAN(BaseHTTPRequestHandler):
+    """Endpoints: GET /version, GET /lotes, PUT /lotes (If-Match), POST /delta,
+    GET /archivo (listado), GET/PUT /archivo/<partición> (If-Match o If-None-Match: *)."""
+
+    def _autorizado(self):
+        # Sin token configurado no se atiende a nadie (iniciar_servidor_lan ya lo exige)
+        recibido = self.headers.get('X-Lotes-Token', '')
+        if not LAN_TOKEN or not hmac.compare_digest(recibido.encode('utf-8'), LAN_TOKEN.encode('utf-8')):
+            self._responder(401, {'error': 'Token LAN inválido'})
+            return False
+        return True
+
+    def _responder(self, code, cuerpo=None, datos: bytes = None, etag: str = None):
+        if datos is None:
+            datos = json.dumps(cuerpo or {}, ensure_ascii=False).encode('utf-8')
+            tipo = 'application/json'
+        else:
+            tipo = 'text/csv; charset=utf-8'
+        self.send_response(code)
+        self.send_header('Content-Type', tipo)
+        self.send_header('Content-Length', str(len(datos)))
+        if etag:
+            self.send_header('ETag', f'"{etag}"')
+        self.end_headers()
+        if code != 304:
+            self.wfile.write(datos)
+
+    def _leer_cuerpo(self) -> bytes:
+        try:
+            largo = int(self.headers.get('Content-Length', 0) or 0)
+        except ValueError:
+            largo = -1
+        if largo < 0 or largo > LAN_MAX_BYTES:
+            raise CuerpoDemasiadoGrande(largo)
+        return self.rfile.read(largo)
+
+    def do_GET(self):
+        if not self._autorizado():
+            return
+        ruta = urlparse(self.path).path
+        datos, h = _contenido_lan()
+        if ruta == '/version':
+            self._responder(200, {'hash': h, 'tamaño': len(datos)})
+        elif ruta == '/lotes':
+            if self.headers.get('If-None-Match', '').strip('"') == h:
+                self._responder(304, datos=b'', etag=h)
+            else:
+                self._responder(200, datos=datos, etag=h)
+        elif ruta == f'/{REMOTE_ARCHIVE_DIR}':
+            self._responder(200, {os.path.basename(p): _contenido_frio_lan(os.path.basename(p))[1]
+                                  for p in archivos_frio()})
+        elif _archivo_frio_lan(ruta):
+            frio, hf = _contenido_frio_lan(_archivo_frio_lan(ruta))
+            if frio is None:
+                self._responder(404, {'error': 'No encontrado'})
+            else:
+                self._responder(200, datos=frio, etag=hf)
+        else:
+            self._responder(404, {'error': 'No encontrado'})
+
+    def _put_archivo(self, nombre: str):
+        esperado = self.headers.get('If-Match', '').strip('"')
+        crear = self.headers.get('If-None-Match', '').strip() == '*'
+        if not esperado and not crear:
+            self._responder(428, {'error': 'Falta If-Match'})
+            return
+        try:
+            nuevo = self._leer_cuerpo()
+        except CuerpoDemasiadoGrande:
+            self._responder(413, {'error': 'Cuerpo demasiado grande'})
+            return
+        with _ESCRITURA_LOCK:
+            actual, h = _contenido_frio_lan(nombre)
+            if (crear and actual is not None) or (esperado and esperado != h):
+                self._responder(412, {'error': 'Conflicto', 'hash': h})
+                return
+            _escribir_archivo_frio(nombre, nuevo)
+        registrar_pendiente('Archivo frío recibido por LAN')
+        self._responder(200, {'hash': hashlib.sha256(nuevo).hexdigest()})
+
+    def do_PUT(self):
+        if not self._autorizado():
+            return
+        ruta = urlparse(self.path).path
+        if _archivo_frio_lan(ruta):
+            self._put_archivo(_archivo_frio_lan(ruta))
+            return
+        if ruta != '/lotes':
+            self._responder(404, {'error': 'No encontrado'})
+            return
+        esperado = self.headers.get('If-Match', '').strip('"')
+        if not esperado:
+            # Sin precondición sería una sobrescritura a ciegas
+            self._responder(428, {'error': 'Falta If-Match'})
+            return
+        try:
+            nuevo = self._leer_cuerpo()
+        except CuerpoDemasiadoGrande:
+            self._responder(413, {'error': 'Cuerpo demasiado grande'})
+            return
+        try:
+            lotes = _parsear_csv(nuevo.decode('utf-8'))[1]
+        except Exception:
+            self._responder(400, {'error': 'CSV inválido'})
+            return
+
+        def escribir():
+            # La precondición se comprueba bajo el mismo lock que la escritura
+            _datos, h = _contenido_lan()
+            if esperado != h:
+                return 412, {'error': 'Conflicto', 'hash': h}
+            if not guardar_csv(lotes):
+                return 500, {'error': 'Error escribiendo CSV'}
+            return 200, {'hash': _contenido_lan()[1]}
+
+        code, respuesta = escribir_csv_externo(escribir)
+        if code == 200:
+            registrar_pendiente('Cambios recibidos por LAN')
+            _notificar_cambio_lan()
+        self._responder(code, respuesta)
+
+    def do_POST(self):
+        if not self._autorizado():
+            return
+        if urlparse(self.path).path != '/delta':
+            self._responder(404, {'error': 'No encontrado'})
+            return
+        try:
+            pedido = json.loads(self._leer_cuerpo().decode('utf-8'))
+        except CuerpoDemasiadoGrande:
+            self._responder(413, {'error': 'Cuerpo demasiado grande'})
+            return
+        except Exception:
+            self._responder(400, {'error': 'JSON inválido'})
+            return
+        code, respuesta = aplicar_delta_lan(pedido.get('base', ''), pedido.get('cambios', {}))
+        self._responder(code, respuesta)
+
+    def log_message(self, formato, *args):
+        print(f"[LAN] {self.address_string()} {formato % args}")
+
+
+def iniciar_servidor_lan(puerto: int = None, al_cambiar=None):
+    """Arranca (una vez por proceso) el servidor LAN en un hilo daemon. Devuelve (success, msg).
+
+    Exige lan_token: el servidor escucha en todas las interfaces y acepta escrituras."""
+    if not LAN_TOKEN:
+        return False, 'Servidor LAN no iniciado: configura lan_token'
+    if al_cambiar is not None:
+        _LAN_SERVIDOR['al_cambiar'] = al_cambiar
+    if _LAN_SERVIDOR['server'] is not None:
+        return True, 'Servidor LAN ya activo'
+    puerto = puerto or LAN_PORT
+    try:
+        server = ThreadingHTTPServer(('0.0.0.0', puerto), _ManejadorLAN)
+    except Exception as e:
+        return False, f'No se pudo abrir el puerto {puerto}: {e}'
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name='lotes-lan').start()
+    _LAN_SERVIDOR['server'] = server
+    print(f"[LAN] servidor de sincronización en el puerto {puerto}")
+    return True, f'Servidor LAN en el puerto {puerto}'
+
+
+def detener_servidor_lan():
+    server = _LAN_SERVIDOR.get('server')
+    if server is not None:
+        server.shutdown()
+        _LAN_SERVIDOR['server'] = None
+
+
+def get_lan_base_path():
+    """Copia local del último contenido recibido/confirmado por el servidor LAN (base de los deltas)."""
+    return os.path.join(BASE_PATH, 'lotes_lan_base.csv')
+
+
+class TransporteLAN:
+    """Cliente del servidor LAN de escritorio. Sube deltas por fila cuando tiene la base.
+
+    El servidor guarda la unión en un solo CSV y combina por fila: el layout particionado no
+    aplica (particiones = False) y se sincroniza siempre el archivo completo."""
+    nombre = 'lan'
+    particiones = False
+
+    def __init__(self, url: str, token: str = ''):
+        self.url = url.rstrip('/')
+        self.headers = {'X-Lotes-Token': token} if token else {}
+
+    def para(self, ruta: str):
+        """Acceso a otro archivo del servidor (solo particiones frías: 'archivo/<nombre>')."""
+        return _ArchivoLAN(self.url, self.headers, ruta)
+
+    def listar(self, directorio: str):
+        """Archivos de un directorio del servidor: (status, {nombre: sha256})."""
+        try:
+            r = requests.get(f'{self.url}/{directorio}', headers=self.headers, timeout=5)
+        except Exception:
+            return 0, {}
+        if r.status_code != 200:
+            return r.status_code, {}
+        return 200, r.json()
+
+    def version(self):
+        try:
+            r = requests.get(f'{self.url}/version', headers=self.headers, timeout=3)
+        except Exception:
+            return 0, ''
+        if r.status_code != 200:
+            return r.status_code, ''
+        return 200, r.json().get('hash', '')
 
-    try:
-        for br in branches_to_try:
-            tried_branches.append(br)
-            try:
-                resp = requests.get(url_base, headers=headers, params={'ref': br}, timeout=6)
-            except requests.exceptions.Timeout:
-                return False, 'Timeout', '', ''
+    def _guardar_base(self, datos: bytes):
+        try:
+            with open(get_lan_base_path(), 'wb') as f:
+                f.write(datos)
+        except Exception:
+            pass
 
-            if resp.status_code == 200:
-                content = base64.b64decode(resp.json().get('content', '')).decode('utf-8')
-                h = compute_hash(content)
-                # Actualizar branch para reflejar la rama efectiva
-                globals()['GITHUB_BRANCH'] = br
-                return True, 'OK', content, h
-            elif resp.status_code == 401:
-                return False, 'Token inválido o sin permisos', '', ''
-            elif resp.status_code == 404:
-                # intentar siguiente rama
-                continue
-            else:
-                return False, f'Error HTTP {resp.status_code}', '', ''
+    def _base(self, version_esperada):
+        """Lotes de la base si corresponde a version_esperada; si no, None."""
+        try:
+            with open(get_lan_base_path(), 'rb') as f:
+                datos = f.read()
+        except Exception:
+            return None
+        if not version_esperada or hashlib.sha256(datos).hexdigest() != version_esperada:
+            return None
+        return _parsear_csv(datos.decode('utf-8'))[1]
 
-        # Si llegamos aquí, ninguna rama tuvo el archivo: verificar si el repo existe / hay acceso
-        repo_url = f'https://api.github.com/repos/{GITHUB_REPO}'
+    def leer(self):
         try:
-            r = requests.get(repo_url, headers=headers, timeout=5)
-            if r.status_code == 200:
-                return False, f'Archivo {GITHUB_FILE_PATH} no encontrado (probadas ramas: {",".join(tried_branches)})', '', ''
-            elif r.status_code == 401:
-                return False, 'Token inválido o sin permisos', '', ''
-            elif r.status_code == 404:
-                return False, 'Repositorio no encontrado o sin acceso (verifica owner/repo)', '', ''
+            r = requests.get(f'{self.url}/lotes', headers=self.headers, timeout=10)
+        except Exception:
+            return 0, b'', ''
+        if r.status_code != 200:
+            return r.status_code, b'', ''
+        self._guardar_base(r.content)
+        return 200, r.content, hashlib.sha256(r.content).hexdigest()
+
+    def escribir(self, datos: bytes, version_esperada):
+        mio = hashlib.sha256(datos).hexdigest()
+        base = self._base(version_esperada)
+        try:
+            if base is not None:
+                nuevos = _parsear_csv(datos.decode('utf-8'))[1]
+                b, n = indexar_lotes(base), indexar_lotes(nuevos)
+                d = diff_lotes(base, nuevos)
+                cambios = {
+                    'agregados': [n[k] for k in d['agregados']],
+                    'eliminados': [{'clave': list(k), 'version': version_fila(b[k])} for k in d['eliminados']],
+                    'modificados': [{'clave': list(k), 'version': version_fila(b[k]), 'fila': n[k]}
+                                    for k in d['modificados']],
+                }
+                r = requests.post(f'{self.url}/delta', headers=self.headers, timeout=10,
+                                  json={'base': version_esperada, 'cambios': cambios})
             else:
-                return False, f'Error HTTP {r.status_code}', '', ''
-        except requests.exceptions.Timeout:
-            return False, 'Timeout comprobando repo', '', ''
+                headers = dict(self.headers)
+                if version_esperada:
+                    headers['If-Match'] = f'"{version_esperada}"'
+                r = requests.put(f'{self.url}/lotes', data=datos, headers=headers, timeout=10)
         except Exception as e:
-            return False, f'Error: {str(e)[:50]}', '', ''
-
+            return False, f'Error: {str(e)[:50]}', ''
+        if r.status_code in (409, 412, 428):
+            return False, MensajeSync('Conflicto remoto detectado', SYNC_CONFLICTO), ''
+        if r.status_code != 200:
+            return False, f'Error {r.status_code}', ''
+        nueva = r.json().get('hash', '')
+        if nueva == mio:
+            self._guardar_base(datos)
+            return True, 'Sincronizado', nueva
+        # El servidor combinó cambios de otros clientes: versión desconocida para forzar
+        # que el próximo sondeo baje el contenido combinado.
+        return True, 'Sincronizado (combinado en servidor)', ''
+
+
+class _ArchivoLAN:
+    """Un archivo del servidor LAN fuera del CSV principal; versión = sha256 del contenido."""
+    nombre = 'lan'
+
+    def __init__(self, url: str, headers: dict, ruta: str):
+        self.url = f'{url}/{ruta}'
+        self.headers = headers
+
+    def leer(self):
+        try:
+            r = requests.get(self.url, headers=self.headers, timeout=10)
+        except Exception:
+            return 0, b'', ''
+        if r.status_code != 200:
+            return r.status_code, b'', ''
+        return 200, r.content, hashlib.sha256(r.content).hexdigest()
+
+    def escribir(self, datos: bytes, version_esperada):
+        headers = dict(self.headers)
+        if version_esperada:
+            headers['If-Match'] = f'"{version_esperada}"'
+        else:
+            headers['If-None-Match'] = '*'
+        try:
+            r = requests.put(self.url, data=datos, headers=headers, timeout=10)
+        except Exception as e:
+            return False, f'Error: {str(e)[:50]}', ''
+        if r.status_code in (412, 428):
+            return False, MensajeSync('Conflicto remoto detectado', SYNC_CONFLICTO), ''
+        if r.status_code != 200:
+            return False, f'Error {r.status_code}', ''
+        return True, 'Sincronizado', r.json().get('hash', '')
+
+
+# --- Layout particionado por sucursal ---
+# En el repo: PARTITION_DIR/<sucursal>.csv + PARTITION_DIR/manifest.json. Localmente se
+# sigue usando un único CSV (la unión), así leer_csv no cambia. En meta['particiones']
+# se guarda por partición el hash local, el hash remoto de referencia y el SHA del blob
+# (o 'remote_version' con un transporte alternativo que admite particiones): solo se
+# suben/bajan las particiones tocadas y un conflicto afecta a una sola sucursal.
+PARTITION_DIR = "lotes"
+PARTITION_MANIFEST = "manifest.json"
+
+
+def nombre_particion(branch: str) -> str:
+    nombre = (branch or '').strip().replace('/', '_')
+    return nombre or 'SIN_SUCURSAL'
+
+
+def ruta_particion(nombre: str) -> str:
+    return f'{PARTITION_DIR}/{nombre}.csv'
+
+
+def _escribir_filas(cabecera, filas) -> str:
+    buf = io.StringIO()
+    writer = csv.writer(buf, quoting=csv.QUOTE_MINIMAL, lineterminator='\n')
+    writer.writerow(cabecera)
+    writer.writerows(filas)
+    return buf.getvalue()
+
+
+def dividir_particiones(texto: str):
+    """Divide el CSV en una partición por sucursal. Devuelve (cabecera, {nombre: texto})."""
+    reader = csv.reader(io.StringIO(texto, newline=None))
+    cabecera = next(reader, None) or list(CSV_FIELDNAMES)
+    idx = cabecera.index('Branch') if 'Branch' in cabecera else None
+    filas = {n: [] for n in BRANCH}
+    for fila in reader:
+        if not any((c or '').strip() for c in fila):
+            continue
+        n = nombre_particion(fila[idx] if idx is not None and len(fila) > idx else '')
+        filas.setdefault(n, []).append(fila)
+    return cabecera, {n: _escribir_filas(cabecera, fs) for n, fs in filas.items()}
+
+
+def unir_particiones(partes: dict) -> str:
+    """Une las particiones en un solo CSV (sucursales de BRANCH primero, en su orden)."""
+    orden = [n for n in BRANCH if n in partes] + sorted(n for n in partes if n not in BRANCH)
+    cabecera = None
+    filas = []
+    for n in orden:
+        reader = csv.reader(io.StringIO(partes[n], newline=None))
+        cab = next(reader, None)
+        if not cab:
+            continue
+        if cabecera is None:
+            cabecera = cab
+        for fila in reader:
+            if cab != cabecera:
+                valores = dict(zip(cab, fila))
+                fila = [valores.get(c, '') for c in cabecera]
+            filas.append(fila)
+    return _escribir_filas(cabecera or CSV_FIELDNAMES, filas)
+
+
+def _contar_filas(texto: str) -> int:
+    return max(sum(1 for _ in csv.reader(io.StringIO(texto, newline=None))) - 1, 0)
+
+
+def _crear_manifest(partes: dict) -> bytes:
+    manifest = {
+        'version': 1,
+        'actualizado': datetime.now().isoformat(timespec='seconds'),
+        'usuario': CURRENT_USER,
+        'particiones': {
+            n: {'archivo': ruta_particion(n), 'hash': compute_hash(t), 'filas': _contar_filas(t)}
+            for n, t in partes.items()
+        },
+    }
+    return json.dumps(manifest, ensure_ascii=False, indent=2, sort_keys=True).encode('utf-8')
+
+
+def _listar_particiones(transporte):
+    """Listado remoto de PARTITION_DIR: (status, {archivo: sha o versión})."""
+    if transporte is not None:
+        return transporte.listar(PARTITION_DIR)
+    status, remotos = listar_remoto(PARTITION_DIR, GITHUB_BRANCH, timeout=6)
+    return status, {a: sha for a, (sha, _size) in remotos.items()}
+
+
+def _leer_particion_remota(transporte, n: str):
+    """(status, contenido, hash, version) de una partición remota."""
+    if transporte is None:
+        st, contenido, h = descargar_remoto_texto(GITHUB_BRANCH, ruta=ruta_particion(n))
+        return st, contenido, h, ''
+    st, datos, version = transporte.para(ruta_particion(n)).leer()
+    if st != 200:
+        return st, '', '', ''
+    contenido = datos.decode('utf-8')
+    return 200, contenido, compute_hash(contenido), version
+
+
+def _escribir_particiones_transporte(transporte, archivos: dict, remotos: dict):
+    """Escribe cada partición con la versión listada como precondición. Devuelve (ok, msg, versiones)."""
+    versiones = {}
+    for ruta, datos in archivos.items():
+        ok, msg, version = transporte.para(ruta).escribir(datos, remotos.get(ruta.rsplit('/', 1)[-1]))
+        if not ok:
+            return False, MensajeSync(f'{ruta}: {msg}', codigo_sync(msg)), versiones
+        versiones[ruta] = version
+    return True, 'Sincronizado', versiones
+
+
+def subir_particiones(force: bool = False, transporte=None):
+    """Sube solo las particiones que cambiaron desde la última sincronización (con GitHub en
+    un solo commit; con un transporte, una escritura condicional por partición).
+    Devuelve (success, msg)."""
+    try:
+        with open(LOTES_CSV, 'r', encoding='utf-8') as f:
+            texto = f.read()
     except Exception as e:
-        return False, f'Error: {str(e)[:50]}', '', ''
+        print(f"[NETWORK] subir_particiones: error leyendo local: {e}")
+        return False, 'Error lectura local'
+    cabecera, partes = dividir_particiones(texto)
+    if not force and not any(_contar_filas(t) for t in partes.values()):
+        return False, MensajeSync('Local vacío o sólo cabecera, usa force=True para forzar subida', SYNC_LOCAL_VACIO)
 
+    meta = load_local_meta()
+    estado = meta.get('particiones') or {}
+    # Sucursales que ya no tienen filas: se suben vacías (solo cabecera)
+    for n in estado:
+        if n not in partes:
+            partes[n] = _escribir_filas(cabecera, [])
+    cambiadas = [n for n, t in partes.items() if compute_hash(t) != estado.get(n, {}).get('remote_hash')]
+    frio = archivos_frio_pendientes()
+    if not cambiadas and not frio:
+        return True, 'Sin cambios'
+
+    status, remotos = _listar_particiones(transporte)
+    if status == 0:
+        return False, 'Sin conexión'
+    if status not in (200, 404):
+        return False, f'Error HTTP {status}'
+
+    # Conflicto solo si la MISMA partición cambió en el remoto desde la línea base
+    clave = 'remote_sha' if transporte is None else 'remote_version'
+    conflictos = []
+    for n in cambiadas:
+        remoto = remotos.get(f'{n}.csv', '')
+        if not remoto or remoto == estado.get(n, {}).get(clave, ''):
+            continue
+        if transporte is None:
+            if remoto != git_blob_sha(partes[n].encode('utf-8')):
+                conflictos.append(n)
+        elif _leer_particion_remota(transporte, n)[2] != compute_hash(partes[n]):
+            conflictos.append(n)
+    if conflictos and not force:
+        for n in conflictos:
+            try:
+                st, contenido, _h, _v = _leer_particion_remota(transporte, n)
+                if st == 200:
+                    rb = save_remote_backup(contenido)
+                    print(f"[NETWORK] subir_particiones: backup remoto {n} guardado {rb}")
+            except Exception:
+                pass
+        return False, MensajeSync(f'Conflicto remoto detectado en {", ".join(conflictos)}', SYNC_CONFLICTO)
 
-def restore_latest_backup():
-    """Restaura el backup más reciente desde /registros al archivo local."""
-    ensure_registros_dir()
-    files = glob.glob(os.path.join(REGISTROS_DIR, "lotes_template_*.csv"))
-    if not files:
-        return False, 'No hay backups disponibles'
-    files.sort()
-    latest = files[-1]
+    archivos = {ruta_particion(n): partes[n].encode('utf-8') for n in cambiadas}
+    if cambiadas:
+        archivos[f'{PARTITION_DIR}/{PARTITION_MANIFEST}'] = _crear_manifest(partes)
+    if transporte is None:
+        archivos.update(frio)
+        fecha_hora = datetime.now().strftime("%Y-%m-%d %H:%M")
+        ok, msg, blobs = commit_git_data(archivos, f"Actualización {fecha_hora} {CURRENT_USER} ({', '.join(cambiadas) or 'archivo'})")
+    else:
+        # Aun con force se escribe sobre la versión recién listada (sin pisar escrituras concurrentes)
+        ok, msg, blobs = _escribir_particiones_transporte(transporte, archivos, remotos)
+    print(f"[NETWORK] subir_particiones: {msg}")
+    if not ok:
+        return False, msg
+    if transporte is None:
+        marcar_frio_subido(blobs)
+    else:
+        sincronizar_frio_transporte(transporte)
+
+    crear_backup()
+    meta = load_local_meta()
+    estado = meta.get('particiones') or {}
+    for n, t in partes.items():
+        e = estado.setdefault(n, {})
+        e['local_hash'] = compute_hash(t)
+        if n in cambiadas:
+            e['remote_hash'] = e['local_hash']
+            e[clave] = blobs.get(ruta_particion(n), '')
+    meta['particiones'] = estado
+    meta['local_hash'] = compute_hash(texto)
+    save_local_meta(meta)
+    return True, f'Sincronizado ({", ".join(cambiadas) or "archivo"})'
+
+
+def _leer_texto_local() -> str:
     try:
-        shutil.copy2(latest, LOTES_CSV)
-        fix_csv_structure()
-        return True, f'Restaurado backup {os.path.basename(latest)}'
-    except Exception as e:
-        return False, f'Error restaurando backup: {e}'
+        with open(LOTES_CSV, 'r', encoding='utf-8') as f:
+            return f.read()
+    except Exception:
+        return ''
 
 
-# reactivate_uploads removed: reactivation via UI is intentionally disabled to avoid accidental remote changes.
-# To reactivate uploads the sentinel file `.no_auto_restore` must be removed manually by the user.
+def descargar_particiones(transporte=None):
+    """Descarga solo las particiones remotas cuyo SHA cambió y las combina en el CSV local.
 
+    Una partición editada localmente que también cambió en el remoto se deja como está
+    (conflicto, con backup del remoto); el resto se aplica igual. Sin línea base (primera
+    sincronización) una partición local con filas distinta de la remota también es conflicto.
+    Las particiones borradas en el remoto se borran localmente si no tenían ediciones.
+    transporte: alternativo que admite particiones (None = GitHub). Devuelve (success, msg)."""
+    status, remotos = _listar_particiones(transporte)
+    if status == 404:
+        return False, MensajeSync(f'Layout particionado no encontrado en {PARTITION_DIR}/ (sincroniza para crearlo)', SYNC_NO_ENCONTRADO)
+    if status == 401:
+        return False, 'Token inválido o sin permisos'
+    if status != 200:
+        return False, 'Sin conexión' if status == 0 else f'Error HTTP {status}'
+
+    _cab, partes = dividir_particiones(_leer_texto_local())
+    meta = load_local_meta()
+    estado = meta.get('particiones') or {}
+    clave = 'remote_sha' if transporte is None else 'remote_version'
+
+    # 1) Descargas, sin lock: las ediciones locales siguen funcionando mientras tanto
+    descargadas = {}
+    for archivo, sha in remotos.items():
+        if not archivo.endswith('.csv'):
+            continue
+        n = archivo[:-4]
+        e = estado.setdefault(n, {})
+        if sha == e.get(clave):
+            continue
+        local_t = partes.get(n, '')
+        if transporte is None and local_t and git_blob_sha(local_t.encode('utf-8')) == sha:
+            # Ya tenemos ese contenido: solo actualizar la línea base
+            e['local_hash'] = e['remote_hash'] = compute_hash(local_t)
+            e['remote_sha'] = sha
+            continue
+        st, contenido, h, version = _leer_particion_remota(transporte, n)
+        if st != 200:
+            return False, f'Error HTTP {st} descargando {n}'
+        descargadas[n] = (version or sha, contenido, h)
+    # Sincronizadas alguna vez pero ya no están en el remoto
+    borradas = [n for n, e in estado.items() if e.get(clave) and f'{n}.csv' not in remotos]
+
+    # 2) Combinación y escritura bajo el lock, sobre una lectura fresca del CSV local
+    def aplicar():
+        texto = _leer_texto_local()
+        _cab, partes = dividir_particiones(texto)
+        aplicadas, conflictos = [], []
+        for n, (sha, contenido, h) in descargadas.items():
+            e = estado[n]
+            local_t = partes.get(n, '')
+            # Sin línea base se compara directamente con el contenido remoto
+            referencia = e.get('remote_hash') or h
+            local_modificada = _contar_filas(local_t) and compute_hash(local_t) != referencia
+            if local_modificada:
+                rb = save_remote_backup(contenido)
+                print(f"[NETWORK] descargar_particiones: conflicto en {n}, backup remoto {rb}")
+                conflictos.append(n)
+                continue
+            partes[n] = contenido
+            aplicadas.append(n)
+            e['local_hash'] = e['remote_hash'] = h
+            e[clave] = sha
+        for n in borradas:
+            local_t = partes.get(n, '')
+            if _contar_filas(local_t) and compute_hash(local_t) != estado[n].get('remote_hash'):
+                print(f"[NETWORK] descargar_particiones: {n} borrada en el remoto y editada localmente")
+                conflictos.append(n)
+                continue
+            partes.pop(n, None)
+            estado.pop(n, None)
+            aplicadas.append(n)
+
+        if aplicadas:
+            if texto:
+                b = crear_backup()
+                if b:
+                    print(f"[NETWORK] descargar_particiones: backup local creado {b}")
+            with open(LOTES_CSV, 'w', encoding='utf-8', newline='') as f:
+                f.write(unir_particiones(partes))
+            invalidar_snapshot_lotes()
+            fix_csv_structure()
+
+        meta = load_local_meta()
+        meta['particiones'] = estado
+        meta['local_hash'] = compute_hash(_leer_texto_local())
+        save_local_meta(meta)
+        return aplicadas, conflictos
 
-def restore_remote_from_content(content: str):
-    """Crea o actualiza el archivo remoto en GitHub usando el contenido proporcionado.
-    Devuelve (success, msg)."""
-    if not GITHUB_TOKEN or not GITHUB_REPO:
-        return False, 'Token o repo no configurado'
-    url = f'https://api.github.com/repos/{GITHUB_REPO}/contents/{GITHUB_FILE_PATH}'
-    headers = {
-        'Authorization': f'token {GITHUB_TOKEN}',
-        'Accept': 'application/vnd.github.v3+json'
-    }
     try:
-        # Verificar existencia para obtener SHA
-        try:
-            resp = requests.get(url, headers=headers, params={'ref': GITHUB_BRANCH}, timeout=5)
-        except Exception as ex:
-            return False, f'Error comprobando remoto: {ex}'
-        sha = None
-        if resp.status_code == 200:
-            sha = resp.json().get('sha', '')
-        # Preparar payload
-        encoded = base64.b64encode(content.encode('utf-8')).decode('utf-8')
-        fecha_hora = datetime.now().strftime("%Y-%m-%d %H:%M")
-        data = {'message': f"Restauración {fecha_hora}", 'content': encoded, 'branch': GITHUB_BRANCH}
-        if sha:
-            data['sha'] = sha
-        # Ejecutar PUT
-        put = requests.put(url, headers=headers, json=data, timeout=15)
-        if put.status_code in (200, 201):
-            return True, 'Remoto restaurado'
-        else:
-            return False, f'Error {put.status_code} al restaurar remoto'
+        aplicadas, conflictos = escribir_csv_externo(aplicar)
     except Exception as ex:
-        return False, f'Error: {ex}'
+        return False, f'Error escritura: {ex}'
 
+    if conflictos:
+        return False, MensajeSync(f'Conflicto local/remoto en {", ".join(conflictos)}, backups guardados', SYNC_CONFLICTO)
+    if aplicadas:
+        if transporte is not None:
+            sincronizar_frio_transporte(transporte)
+        origen = 'GitHub' if transporte is None else transporte.nombre
+        return True, f'Sincronizado con {origen} ({", ".join(aplicadas)})'
+    return True, 'Sin cambios remotos'
 
-def subir_csv_github_from_content(content: str, allow_create: bool = False):
-    """Helper que sube contenido dado al archivo remoto. allow_create permite crear el archivo si no existe."""
-    # Similar a subir_csv_github pero con contenido en memoria
-    if not GITHUB_TOKEN:
-        return False, 'Sin token'
-    if not GITHUB_REPO or "/" not in GITHUB_REPO:
-        return False, 'Repo no configurado'
-    if not CURRENT_USER:
-        return False, 'Falta usuario configurado (⚙️ Usuario)'
 
-    url = f'https://api.github.com/repos/{GITHUB_REPO}/contents/{GITHUB_FILE_PATH}'
-    headers = {
-        'Authorization': f'token {GITHUB_TOKEN}',
-        'Accept': 'application/vnd.github.v3+json'
-    }
-    # Evitar subir si el usuario borró datos locales y no reactivó manualmente
-    try:
-        if globals().get('LOCAL_DATA_CLEARED'):
-            print("[NETWORK] subir_csv_github_from_content: upload bloqueado porque se borraron datos locales recientemente (requiere reactivar subidas)")
-            return False, 'Subidas bloqueadas tras borrar datos locales. Reactiva subidas en Config para continuar.'
-    except Exception:
-        pass
-    # Comprobar si existe remotamente
-    try:
-        resp = requests.get(url, headers=headers, params={'ref': GITHUB_BRANCH}, timeout=6)
-    except Exception as ex:
-        return False, f'Error comprobando remoto: {ex}'
-    if resp.status_code == 404 and not allow_create:
-        return False, 'Archivo remoto no encontrado; no se crea sin permiso explícito'
+def sincronizar_particiones(force: bool = False, transporte=None):
+    """Sincronización completa en layout particionado: baja lo que cambió y sube lo tocado."""
+    ok, msg = descargar_particiones(transporte)
+    if not ok:
+        inicializar = codigo_sync(msg) == SYNC_NO_ENCONTRADO
+        if not inicializar and not (force and codigo_sync(msg) == SYNC_CONFLICTO):
+            return False, msg
+    ok, msg = subir_particiones(force=force, transporte=transporte)
+    if ok:
+        limpiar_outbox()
+    return ok, msg
 
-    # Verificar que haya datos útiles
-    try:
-        import io
-        reader = csv.reader(io.StringIO(content))
-        rows = list(reader)
-        data_rows = [r for r in rows[1:] if any((c or '').strip() for c in r)] if len(rows) > 1 else []
-        if not data_rows:
-            return False, 'Contenido vacío: no se sube'
-    except Exception:
-        return False, 'Contenido no válido'
 
-    # Construir payload y PUT (manejo de sha si existe)
+# --- Migraciones de esquema del CSV ---
+# Cada migración tiene una validación barata sobre las filas crudas (listas) y una
+# corrección sobre los lotes. fix_csv_structure solo reescribe el CSV si alguna
+# validación falla, y deja en el meta la versión de esquema y el hash del contenido
+# ya validado: en los arranques/descargas siguientes con el mismo contenido no se
+# vuelve a leer ni escribir nada.
+CSV_SCHEMA_VERSION = 2
+
+
+def _parece_fecha(valor) -> bool:
+    valor = (valor or '').strip()
+    return bool(valor) and '-' in valor and valor[0].isdigit()
+
+
+def _valida_semana_sin_fecha(cabecera, filas):
+    """v1: la columna 'Semana' no debe contener fechas."""
+    if 'Semana' not in cabecera:
+        return True
+    idx = cabecera.index('Semana')
+    return not any(len(fila) > idx and _parece_fecha(fila[idx]) for fila in filas)
+
+
+def _migrar_fecha_en_semana(lotes):
+    """Corrige el caso donde la fecha quedó en la columna 'Semana'."""
+    for row in lotes:
+        sem_val = row.get('Semana', '')
+        if isinstance(sem_val, str) and _parece_fecha(sem_val):
+            row['DateCreated'] = sem_val.strip()
+            row['Semana'] = ''
+
+
+def _valida_cabecera_canonica(cabecera, filas):
+    """v2: columnas en el orden canónico (incluye 'Archivado' y 'ÚltimaActualización')."""
+    return cabecera == CSV_FIELDNAMES
+
+
+def _migrar_cabecera_canonica(lotes):
+    """Deja cada fila con exactamente las columnas canónicas (faltantes vacías, sobrantes fuera)."""
+    for row in lotes:
+        for col in list(row):
+            if col not in CSV_FIELDNAMES and col != 'Variedades':
+                del row[col]
+        for col in CSV_FIELDNAMES:
+            if row.get(col) is None:
+                row[col] = ''
+
+
+# (versión, nombre, validación, corrección)
+MIGRACIONES_CSV = [
+    (1, 'fecha_en_semana', _valida_semana_sin_fecha, _migrar_fecha_en_semana),
+    (2, 'cabecera_canonica', _valida_cabecera_canonica, _migrar_cabecera_canonica),
+]
+
+
+def migraciones_pendientes(texto):
+    """Devuelve las migraciones cuya validación falla para el contenido dado."""
     try:
-        encoded_content = base64.b64encode(content.encode('utf-8')).decode('utf-8')
-        data = {'message': f'Restore {datetime.now().strftime("%Y-%m-%d %H:%M")}', 'content': encoded_content, 'branch': GITHUB_BRANCH}
-        if resp.status_code == 200:
-            data['sha'] = resp.json().get('sha', '')
-        # Guardar backup remoto previo si existe
-        try:
-            if resp.status_code == 200:
-                remote_content = base64.b64decode(resp.json().get('content', '')).decode('utf-8')
-                rb_prev = save_remote_backup(remote_content)
-                print(f"[NETWORK] subir_csv_github_from_content: backup remoto previo creado {rb_prev}")
-        except Exception:
-            pass
-        put = requests.put(url, headers=headers, json=data, timeout=15)
-        if put.status_code in (200,201):
-            return True, 'Remoto restaurado'
-        else:
-            return False, f'Error {put.status_code} al subir'
-    except Exception as ex:
-        return False, f'Error: {ex}'
+        reader = csv.reader(io.StringIO(texto, newline=None))
+        cabecera = next(reader, [])
+        filas = list(reader)
+    except Exception:
+        return list(MIGRACIONES_CSV)
+    if not cabecera:
+        return []
+    return [m for m in MIGRACIONES_CSV if not m[2](cabecera, filas)]
 
 
 def fix_csv_structure():
-    """Normaliza la estructura del CSV local: asegura columnas correctas y mueve fechas mal colocadas."""
+    """Normaliza la estructura del CSV local una sola vez por contenido.
+
+    Devuelve True si fue necesario reescribir el archivo.
+    """
+    with _ESCRITURA_LOCK:
+        return _fix_csv_structure()
+
+
+def _fix_csv_structure():
     try:
-        lotes = leer_csv()
-        # Corregir caso donde la fecha quedó en la columna 'Semana'
-        for row in lotes:
-            sem_val = row.get('Semana', '')
-            if sem_val and isinstance(sem_val, str) and '-' in sem_val and sem_val.strip()[0].isdigit():
-                row['DateCreated'] = sem_val.strip()
-                row['Semana'] = ''
-        guardar_csv(lotes)
+        path = _ruta_csv_lectura()
+        if not path:
+            return False
+        with open(path, 'r', encoding='utf-8') as f:
+            texto = f.read()
+        h = compute_hash(texto)
+        meta = load_local_meta()
+        if meta.get('schema_version') == CSV_SCHEMA_VERSION and meta.get('schema_hash') == h:
+            return False
+
+        pendientes = migraciones_pendientes(texto)
+        reescrito = False
+        if pendientes:
+            lotes = leer_csv()
+            for version, nombre, _valida, migrar in pendientes:
+                migrar(lotes)
+                print(f"[SCHEMA] Migración v{version} ({nombre}) aplicada")
+            if guardar_csv(lotes):
+                reescrito = True
+                target = ruta_csv_escritura()
+                with open(target, 'r', encoding='utf-8') as f:
+                    h = compute_hash(f.read())
+
+        meta = load_local_meta()
+        meta['schema_version'] = CSV_SCHEMA_VERSION
+        meta['schema_hash'] = h
+        save_local_meta(meta)
+        return reescrito
     except Exception:
-        pass
+        return False
 
 
 def startup_restore():
@@ -853,7 +4001,7 @@ def startup_restore():
         return True, 'Sincronizado con GitHub'
     else:
         # Si la falla fue un conflicto, no hacemos restauración automática
-        if isinstance(msg, str) and 'Conflicto' in msg:
+        if codigo_sync(msg) == SYNC_CONFLICTO:
             return False, msg
         # Si no hay conexión o error, intentar usar backup local
         ok, info = restore_latest_backup()
@@ -863,6 +4011,130 @@ def startup_restore():
             return False, msg
 
 
+def startup_sync_check():
+    """Segunda etapa del arranque (en background, con la UI ya pintada desde el snapshot local).
+
+    Compara el remoto con el CSV local y solo reescribe si el remoto es distinto.
+    Devuelve (estado, msg) con estado en 'igual', 'actualizado', 'conflicto', 'offline'
+    o 'deshabilitado'. A diferencia de startup_restore, si no hay conexión se conservan
+    los datos locales ya mostrados; el backup solo se usa si no hay CSV local."""
+    try:
+        if os.path.exists(NO_AUTO_RESTORE_FILE):
+            return 'deshabilitado', 'Auto-restore deshabilitado por acción del usuario'
+    except Exception:
+        pass
+
+    transporte = obtener_transporte()
+    if DATA_LAYOUT == 'particionado' or transporte is not None:
+        ok, msg = descargar_csv_github()
+        if ok:
+            return ('igual' if msg == 'Sin cambios remotos' else 'actualizado'), msg
+        if codigo_sync(msg) == SYNC_CONFLICTO:
+            return 'conflicto', msg
+        return 'offline', msg
+
+    # Sondeo barato: si el SHA remoto coincide con el del CSV local, no hace falta descargar
+    local_content = ''
+    try:
+        with open(LOTES_CSV, 'r', encoding='utf-8') as f:
+            local_content = f.read()
+    except Exception:
+        local_content = ''
+    if local_content and GITHUB_TOKEN and GITHUB_REPO:
+        status, remote_sha, _size = probar_remoto(GITHUB_BRANCH)
+        local_bytes = local_content.encode('utf-8')
+        if status == 200 and remote_sha == git_blob_sha(local_bytes):
+            local_hash = compute_hash(local_content)
+            meta = load_local_meta()
+            if meta.get('remote_hash') != local_hash or meta.get('remote_sha') != remote_sha:
+                meta['local_hash'] = local_hash
+                meta['remote_hash'] = local_hash
+                meta['remote_sha'] = remote_sha
+                save_local_meta(meta)
+            return 'igual', 'Sincronizado con GitHub'
+        meta = load_local_meta()
+        if status == 200 and remote_sha == meta.get('remote_sha') and local_sin_cambios(local_content, meta):
+            # El remoto es el ya descargado y el local solo se migró desde él
+            return 'igual', 'Sincronizado con GitHub'
+
+    ok, msg, remote_content, remote_hash = get_remote_csv_content()
+    if not ok:
+        try:
+            sin_local = not os.path.exists(LOTES_CSV) or os.path.getsize(LOTES_CSV) == 0
+        except Exception:
+            sin_local = True
+        if sin_local:
+            ok2, info = restore_latest_backup()
+            if ok2:
+                return 'actualizado', f'Offline: {info}'
+        return 'offline', msg
+
+    meta = load_local_meta()
+    if local_content and remote_hash == meta.get('remote_hash') and local_sin_cambios(local_content, meta):
+        # Remoto sin cambios y local igual o solo migrado desde él: nada que bajar ni que subir
+        return 'igual', 'Sincronizado con GitHub'
+
+    if local_content and compute_hash(local_content) == remote_hash:
+        # Sin cambios remotos: no reescribir el CSV, solo asegurar la línea base en meta
+        meta = load_local_meta()
+        if meta.get('remote_hash') != remote_hash or meta.get('local_hash') != remote_hash:
+            meta['local_hash'] = remote_hash
+            meta['remote_hash'] = remote_hash
+            meta['remote_sha'] = git_blob_sha(local_content.encode('utf-8'))
+            save_local_meta(meta)
+        return 'igual', 'Sincronizado con GitHub'
+
+    if local_content and remote_hash == load_local_meta().get('remote_hash'):
+        # El remoto no cambió desde la última sincronización: lo local está adelantado
+        # (cambios sin subir). No es conflicto; el flusher de pendientes lo sube.
+        if not pendientes_outbox():
+            registrar_pendiente('Cambios locales sin subir')
+        return 'igual', 'Cambios locales pendientes de subir'
+
+    ok, msg = aplicar_csv_remoto(remote_content, remote_hash)
+    if ok:
+        return 'actualizado', 'Sincronizado con GitHub'
+    if codigo_sync(msg) == SYNC_CONFLICTO:
+        return 'conflicto', msg
+    return 'offline', msg
+
+
+def indexar_lotes(lotes):
+    """Indexa lotes por clave estable (Branch, LoteNum, Location, n).
+
+    n distingue filas repetidas con la misma ubicación (p.ej. colisiones en PT)."""
+    indice = {}
+    vistos = {}
+    for lote in lotes:
+        base = (lote.get('Branch', ''), lote.get('LoteNum', ''), lote.get('Location', ''))
+        n = vistos.get(base, 0)
+        vistos[base] = n + 1
+        indice[base + (n,)] = lote
+    return indice
+
+
+def firma_lote(lote):
+    """Tupla comparable con el contenido visible de un lote (campos + variedades)."""
+    campos = tuple(sorted(
+        (k, v) for k, v in lote.items()
+        if isinstance(k, str) and k != 'Variedades'
+        and not k.startswith('Variedad_') and not k.startswith('Cantidad_')
+    ))
+    variedades = tuple((v.get('name', ''), v.get('count', 0)) for v in lote.get('Variedades', []))
+    return campos + variedades
+
+
+def diff_lotes(antes, despues):
+    """Compara dos listas de lotes. Devuelve dict con claves 'agregados', 'eliminados' y 'modificados'."""
+    a = indexar_lotes(antes)
+    d = indexar_lotes(despues)
+    return {
+        'agregados': [k for k in d if k not in a],
+        'eliminados': [k for k in a if k not in d],
+        'modificados': [k for k in d if k in a and firma_lote(a[k]) != firma_lote(d[k])],
+    }
+
+
 def find_lote_by_id(lote_id, lotes=None, archived=None):
     """Busca un lote por su ID, considerando ubicación si está presente.
 
@@ -898,6 +4170,96 @@ def find_lote_by_id(lote_id, lotes=None, archived=None):
     return None, None
 
 
+# "nombre, cantidad" con ',', ';' o tabulador; también "nombre x5" o "nombre 5"
+_LINEA_VARIEDAD = re.compile(r'^(?P<nombre>.+?)\s*(?:[,;\t]\s*|\s+x?)(?P<cantidad>-?\d+)\s*$', re.IGNORECASE)
+# Palabras de un encabezado de CSV pegado ("Variedad,Cantidad", "name;count")
+_CABECERA_VARIEDADES = re.compile(r'\b(variedad(es)?|cantidad(es)?|nombre|name|count|variety)\b', re.IGNORECASE)
+
+
+def buscar_variedad_exacta(nombre):
+    """Nombre de VARIETIES igual a nombre sin distinguir mayúsculas ni espacios; None si no hay."""
+    por_minusculas = {v.lower(): v for v in VARIETIES}
+    return por_minusculas.get(' '.join(nombre.split()).lower())
+
+
+def buscar_variedad(nombre):
+    """Nombre de VARIETIES que corresponde a nombre (sin distinguir mayúsculas o aproximado); None si no hay."""
+    exacta = buscar_variedad_exacta(nombre)
+    if exacta is not None:
+        return exacta
+    por_minusculas = {v.lower(): v for v in VARIETIES}
+    clave = ' '.join(nombre.split()).lower()
+    parecidas = get_close_matches(clave, list(por_minusculas), n=1, cutoff=0.6)
+    return por_minusculas[parecidas[0]] if parecidas else None
+
+
+def parsear_variedades(texto):
+    """Interpreta texto pegado (una variedad por línea: nombre, cantidad).
+
+    Sin cantidad se asume 1; los nombres repetidos se suman. Devuelve (items, errores) con
+    items = [{'name', 'count', 'original'}] en orden de aparición y errores = ['línea: motivo']."""
+    items = {}
+    errores = []
+    for linea in texto.splitlines():
+        linea = linea.strip().strip(',;')
+        if not linea:
+            continue
+        m = _LINEA_VARIEDAD.match(linea)
+        if not m and not errores and not items and _CABECERA_VARIEDADES.search(linea):
+            # Encabezado de CSV ("Variedad,Cantidad"): solo como primera línea
+            continue
+        nombre, cantidad = (m.group('nombre').strip(' ,;"\''), int(m.group('cantidad'))) if m else (linea.strip('"\''), 1)
+        if not m and any(c.isdigit() for c in linea) and buscar_variedad_exacta(nombre) is None:
+            # Hay un número que no se pudo leer como cantidad ("Runtz, 5 plantas"): no asumir 1
+            errores.append(f"{linea}: cantidad no reconocida")
+            continue
+        if cantidad <= 0:
+            errores.append(f"{linea}: cantidad inválida")
+            continue
+        variedad = buscar_variedad(nombre)
+        if variedad is None:
+            errores.append(f"{linea}: variedad no reconocida")
+            continue
+        if variedad in items:
+            items[variedad]['count'] += cantidad
+        else:
+            items[variedad] = {'name': variedad, 'count': cantidad, 'original': nombre}
+    return list(items.values()), errores
+
+
+def agregar_variedades(lote, items):
+    """Suma items (ver parsear_variedades) a las variedades del lote, en sitio.
+
+    Respeta MAX_VARIEDADES_LOTE: las variedades nuevas que no caben se devuelven aparte.
+    Devuelve (agregadas, sin_lugar) como listas de nombres."""
+    vars_list = lote.get('Variedades', [])
+    existentes = {v['name']: v for v in vars_list}
+    agregadas, sin_lugar = [], []
+    for item in items:
+        if item['name'] in existentes:
+            existentes[item['name']]['count'] += item['count']
+        elif len(vars_list) < MAX_VARIEDADES_LOTE:
+            nueva = {'name': item['name'], 'count': item['count']}
+            vars_list.append(nueva)
+            existentes[item['name']] = nueva
+        else:
+            sin_lugar.append(item['name'])
+            continue
+        agregadas.append(item['name'])
+    lote['Variedades'] = vars_list
+    return agregadas, sin_lugar
+
+
+def calcular_avance_semanal(lotes, hoy=None, ponerse_al_dia=False):
+    """Avanza +1 semana (y su etapa) los lotes activos cuya última actualización es de otra semana ISO.
+
+    Con ponerse_al_dia avanza todas las semanas ISO transcurridas desde la última actualización.
+    Modifica lotes en sitio y devuelve la lista de cambios (ver lotes_semanas.calcular_avance)."""
+    cambios = calcular_avance(lotes, hoy, omitir=es_archivado, ponerse_al_dia=ponerse_al_dia)
+    aplicar_avance(lotes, cambios, hoy)
+    return cambios
+
+
 def es_archivado(lote):
     """Indica si un lote está marcado como archivado."""
     return str(lote.get('Archivado', '')).strip().lower() in ('1', 'sí', 'si', 'true')
@@ -936,12 +4298,10 @@ def build_lote_text(lote):
     return "\n".join(lineas)
 
 
-def get_lote_ids_sorted(include_archived=False):
-    """Retorna lista de IDs de lotes ordenados (excluye archivados por defecto)."""
-    lotes = leer_csv()
-    if not include_archived:
-        lotes = [l for l in lotes if not es_archivado(l)]
+def etiquetas_lotes(lotes):
+    """Pares (ID mostrado, lote) ordenados por sucursal y número.
 
+    El ID lleva la ubicación entre paréntesis cuando hay splits ("L1-FSM (CUARTO 1)")."""
     def lote_key(lote):
         try:
             return (lote.get('Branch', ''), int(lote.get('LoteNum', 0)))
@@ -955,20 +4315,60 @@ def get_lote_ids_sorted(include_archived=False):
         cid = f"L{lote.get('LoteNum')}-{lote.get('Branch')}"
         counts[cid] = counts.get(cid, 0) + 1
     
-    ids = []
+    pares = []
     for lote in lotes_sorted:
         cid = f"L{lote.get('LoteNum')}-{lote.get('Branch')}"
         if counts.get(cid, 0) > 1:
             label = f"{cid} ({lote.get('Location', '')})"
         else:
             label = cid
-        ids.append(label)
-    return ids
+        pares.append((label, lote))
+    return pares
+
+
+def get_lote_ids_sorted(include_archived=False, lotes=None):
+    """Retorna lista de IDs de lotes ordenados (excluye archivados por defecto)."""
+    if lotes is None:
+        lotes = leer_csv() if include_archived else leer_lotes_activos()
+    elif not include_archived:
+        lotes = [l for l in lotes if not es_archivado(l)]
+    return [label for label, _ in etiquetas_lotes(lotes)]
+
+
+def editar_lotes_masivo(lotes, lote_ids, stage=None, location=None, semana=None, archivar=False):
+    """Aplica los mismos cambios a varios lotes activos, en sitio (una sola mutación).
+
+    lote_ids son IDs mostrados (ver etiquetas_lotes). Semana 20 o 21 fuerza PT/SECADO como en
+    la edición individual. Devuelve la lista de IDs modificados."""
+    modificados = []
+    hoy = datetime.now().strftime('%Y-%m-%d')
+    # Resolver todas las filas antes de modificar: un cambio de ubicación altera los IDs con split
+    filas = [(lote_id, find_lote_by_id(lote_id, lotes, archived=False)[1]) for lote_id in lote_ids]
+    for lote_id, lote in filas:
+        if lote is None:
+            continue
+        antes = dict(lote)
+        if stage:
+            lote['Stage'] = stage
+        if location:
+            lote['Location'] = location
+        if semana:
+            lote['Semana'] = str(semana)
+            if str(semana) in ('20', '21'):
+                lote['Location'] = 'PT'
+                lote['Stage'] = 'SECADO'
+        if archivar:
+            lote['Archivado'] = '1'
+            lote['ÚltimaActualización'] = hoy
+        if lote != antes:
+            modificados.append(lote_id)
+    return modificados
 
 
 # ========== APLICACIÓN FLET ==========
 
-def main(page: ft.Page):
+def main(page: "ft.Page"):
+    t_inicio = time.perf_counter()
     page.title = "Control de Lotes"
     page.theme_mode = ft.ThemeMode.LIGHT
     page.padding = 10
@@ -1003,155 +4403,230 @@ def main(page: ft.Page):
         except Exception:
             # Fallback: establecer mensaje simple
             if status_text and status_text.current:
-                status_text.current.value = config_msg or "No conectado"
-                if connection_status and connection_status.current:
-                    connection_status.current.bgcolor = ft.Colors.RED_400
-        page.update()
-        
-
-    # Lanzar la inicialización asíncrona al cargar la página
-    def on_page_load(e):
-        async def startup():
-            # Mostrar UI inmediatamente para evitar pantallas intermedias y que el usuario vea algo rápido
-            try:
-                content_area.content = ft.Container(tab_crear, padding=15)
-                if status_text and status_text.current:
-                    status_text.current.value = "Cargando..."
-                page.update()
-            except Exception:
-                pass
-
-            # Lanzar inicialización en background (no bloqueante)
-            config_task = None
-            try:
-                config_task = asyncio.create_task(init_config())
-            except Exception as ex:
-                print(f"[STARTUP] no se pudo lanzar init_config en background: {ex}")
-
-            # Deferir restauración/descarga a tarea en background para que no bloquee la UI
-            async def background_restore():
-                # Esperar a que la config (token/repo, sobre todo en Android vía
-                # SharedPreferences async) termine de cargar antes de intentar el pull.
-                # Antes había un sleep(0.4) fijo que en Android a veces perdía la carrera
-                # contra la carga de config, dejando GITHUB_TOKEN vacío y el pull fallaba
-                # en silencio (causa de los problemas "a veces" con la sincronización).
-                if config_task is not None:
-                    try:
-                        await asyncio.wait_for(asyncio.shield(config_task), timeout=5)
-                    except Exception:
-                        pass
-                else:
-                    await asyncio.sleep(0.4)
-                try:
-                    if status_text and status_text.current:
-                        status_text.current.value = "Restaurando datos..."
-                        page.update()
-
-                    # Intentar preferir remoto (ambos: Android y Desktop) pero sin bloquear la UI
-                    try:
-                        ok, info = await asyncio.wait_for(asyncio.to_thread(startup_restore), timeout=8)
-                        if ok:
-                            show_snackbar(info)
-                            try:
-                                update_status(True, info)
-                            except Exception:
-                                pass
-                            # Refrescar datos y UI ahora que se restauró remoto
-                            try:
-                                refresh_lotes_list_radios()
-                                refresh_edit_lotes_popup()
-                            except Exception:
-                                pass
-                        else:
-                            # Si el usuario deshabilitó auto-restore, no intentar restaurar backups
-                            if isinstance(info, str) and info.startswith('Auto-restore'):
-                                show_snackbar(info)
-                                try:
-                                    update_status(False, info)
-                                except Exception:
-                                    pass
-                            # Si hubo un conflicto, startup_restore retornó mensaje con 'Conflicto'
-                            elif isinstance(info, str) and 'Conflicto' in info:
-                                # Mostrar diálogo para que el usuario elija restaurar remoto o mantener local
-                                def cerrar_conf(e):
-                                    dlg_conf.open = False
-                                    page.update()
-
-                                def mantener_local(e):
-                                    dlg_conf.open = False
-                                    page.update()
-                                    show_snackbar('Manteniendo datos locales')
-                                    try:
-                                        update_status(False, 'Conflicto: revisar backups')
-                                    except Exception:
-                                        pass
-
-                                dlg_conf = ft.AlertDialog(
-                                    modal=True,
-                                    title=ft.Text('Conflicto de inicio'),
-                                    content=ft.Text('Se detectó una diferencia entre remoto y local al iniciar. Se mantendrán los datos locales para evitar sobrescribir remoto.'),
-                                    actions=[
-                                        ft.TextButton('OK', on_click=cerrar_conf),
-                                        ft.TextButton('Mantener local', on_click=mantener_local),
-                                    ],
-                                    actions_alignment=ft.MainAxisAlignment.END,
-                                )
-                                page.overlay.append(dlg_conf)
-                                dlg_conf.open = True
-                                page.update()
-                            else:
-                                # No hay conexión o error; intentar fallback a backup
-                                show_snackbar(info, error=True)
-                                try:
-                                    ok2, info2 = await asyncio.to_thread(restore_latest_backup)
-                                    if ok2:
-                                        show_snackbar(f"Offline: {info2}")
-                                        try:
-                                            update_status(False, f"Offline: {info2}")
-                                        except Exception:
-                                            pass
-                                except Exception:
-                                    pass
-                    except asyncio.TimeoutError:
-                        print("[STARTUP] background startup_restore timeout")
-                        # Intentar fallback a backup
-                        try:
-                            ok3, info3 = await asyncio.to_thread(restore_latest_backup)
-                            if ok3:
-                                show_snackbar(f"Offline: {info3}")
-                                try:
-                                    update_status(False, f"Offline: {info3}")
-                                except Exception:
-                                    pass
-                        except Exception:
-                            pass
-                    except Exception as ex2:
-                        print(f"[STARTUP] error en background_restore: {ex2}")
-                except Exception:
-                    pass
+                status_text.current.value = config_msg or "No conectado"
+                if connection_status and connection_status.current:
+                    connection_status.current.bgcolor = ft.Colors.RED_400
+        page.update()
+        
+
+    # Arranque por etapas:
+    #   0) main() pinta las listas desde el snapshot local (sin red ni config)
+    #   1) init_config en background (una sola tarea compartida)
+    #   2) verificación remota en background; si el remoto es más nuevo se aplica
+    #      solo el diff a la UI
+    startup_state = {"config_task": None, "started": False}
 
+    def ensure_config_task():
+        """Lanza init_config una única vez y devuelve la tarea."""
+        if startup_state["config_task"] is None:
             try:
-                asyncio.create_task(background_restore())
+                startup_state["config_task"] = asyncio.create_task(init_config())
             except Exception as ex:
-                print(f"[STARTUP] no se pudo lanzar background_restore: {ex}")
+                print(f"[STARTUP] no se pudo lanzar init_config en background: {ex}")
+        return startup_state["config_task"]
+
+    def mostrar_conflicto_inicio():
+        """Diálogo para avisar que al iniciar el remoto y el local difieren."""
+        def cerrar_conf(e):
+            dlg_conf.open = False
+            page.update()
+
+        def mantener_local(e):
+            dlg_conf.open = False
+            page.update()
+            show_snackbar('Manteniendo datos locales')
+            try:
+                update_status(False, 'Conflicto: revisar backups')
+            except Exception:
+                pass
+
+        dlg_conf = ft.AlertDialog(
+            modal=True,
+            title=ft.Text('Conflicto de inicio'),
+            content=ft.Text('Se detectó una diferencia entre remoto y local al iniciar. Se mantendrán los datos locales para evitar sobrescribir remoto.'),
+            actions=[
+                ft.TextButton('OK', on_click=cerrar_conf),
+                ft.TextButton('Mantener local', on_click=mantener_local),
+            ],
+            actions_alignment=ft.MainAxisAlignment.END,
+        )
+        page.overlay.append(dlg_conf)
+        dlg_conf.open = True
+        page.update()
 
-            # Refrescar lista y estado localmente (sin bloquear)
+    def aplicar_diff_ui(antes, despues):
+        """Refresca solo lo que cambió entre dos lecturas del CSV. Devuelve nº de lotes afectados."""
+        cambios = diff_lotes(antes, despues)
+        afectados = sum(len(v) for v in cambios.values())
+        if not afectados:
+            return 0
+        # Listado: las tarjetas se reutilizan por clave, solo se reconstruyen las que cambiaron
+        try:
+            refresh_lotes_list()
+        except Exception:
+            pass
+        # Edición masiva: las casillas muestran etapa/ubicación/semana
+        try:
+            refresh_masivo_list()
+        except Exception:
+            pass
+        # Selectores: solo si cambió el conjunto de etiquetas
+        if get_lote_ids_sorted(lotes=antes) != get_lote_ids_sorted(lotes=despues):
             try:
                 refresh_lotes_list_radios()
             except Exception:
                 pass
             try:
-                check_and_update_connection_status()
+                refresh_edit_lotes_popup()
             except Exception:
                 pass
+        else:
+            # Recargar el panel de variedades solo si el lote seleccionado cambió
+            sel = current_lote_id.get("value")
+            if sel:
+                _, lote_sel = find_lote_by_id(sel, antes)
+                claves_sel = {k for k, l in indexar_lotes(antes).items() if l is lote_sel}
+                if claves_sel & set(cambios['modificados']):
+                    try:
+                        load_lote_data(sel)
+                    except Exception:
+                        pass
+        try:
+            refresh_archivados_list()
+        except Exception:
+            pass
+        return afectados
+
+    # Sesión dentro del servicio compartido: los cambios de otras sesiones llegan por pubsub
+    sesion_id = getattr(page, 'session_id', None) or str(id(page))
+
+    def on_evento_lotes(topic, evento):
+        try:
+            if evento.get('tipo') == 'cambio' and evento.get('sesion') != sesion_id:
+                n = aplicar_diff_ui(evento['antes'], evento['despues'])
+                if n:
+                    origen = "desde remoto" if evento.get('sesion') is None else "por otra sesión"
+                    update_status(True, f"Actualizado {origen} ({n} lotes)")
+            elif evento.get('tipo') == 'subida':
+                update_status(evento.get('ok'), "Sincronizado" if evento.get('ok') else evento.get('msg', ''))
+            elif evento.get('tipo') == 'estado':
+                update_status(evento.get('ok'), evento.get('msg', ''))
+            elif evento.get('tipo') == 'pendientes':
+                actualizar_pendientes_ui()
+            page.update()
+        except Exception as ex:
+            print(f"[SERVICIO] error aplicando evento: {ex}")
+
+    SERVICIO_LOTES.conectar(page, on_evento_lotes)
+    try:
+        page.on_disconnect = lambda e: SERVICIO_LOTES.desconectar(page)
+    except Exception:
+        pass
 
-            # Mostrar diálogo si falta usuario
+    async def background_remote_check():
+        """Etapas 1 y 2: esperar config y comparar con el remoto sin bloquear la UI."""
+        config_task = ensure_config_task()
+        # Esperar a que la config (token/repo, sobre todo en Android vía SharedPreferences
+        # async) termine de cargar antes de intentar el pull.
+        if config_task is not None:
             try:
-                if not (CURRENT_USER and CURRENT_USER.strip()):
-                    mostrar_dialogo_usuario()
+                await asyncio.wait_for(asyncio.shield(config_task), timeout=5)
             except Exception:
                 pass
-        asyncio.create_task(startup())
+        else:
+            await asyncio.sleep(0.4)
+
+        # Mostrar diálogo si falta usuario (ya con la config cargada)
+        try:
+            if not (CURRENT_USER and CURRENT_USER.strip()):
+                mostrar_dialogo_usuario()
+        except Exception:
+            pass
+
+        # Servidor LAN opcional (solo escritorio): los cambios recibidos se pintan como diff
+        if LAN_SERVER and not hasattr(sys, 'getandroidapilevel'):
+            lan_estado = {"lotes": leer_csv()}
+
+            async def _refrescar_por_lan():
+                despues = leer_csv()
+                n = aplicar_diff_ui(lan_estado["lotes"], despues)
+                lan_estado["lotes"] = despues
+                if n:
+                    update_status(True, f"Actualizado por LAN ({n} lotes)")
+
+            def _al_cambiar_lan():
+                try:
+                    page.run_task(_refrescar_por_lan)
+                except Exception as ex:
+                    print(f"[LAN] no se pudo refrescar la UI: {ex}")
+
+            ok, msg = iniciar_servidor_lan(LAN_PORT, _al_cambiar_lan)
+            print(f"[LAN] {msg}")
+
+        if not GITHUB_TOKEN:
+            # init_config ya dejó el motivo en la barra de estado
+            return
+
+        t0 = time.perf_counter()
+        try:
+            if status_text and status_text.current:
+                status_text.current.value = "Comprobando remoto..."
+                page.update()
+        except Exception:
+            pass
+        antes = leer_csv()
+        try:
+            estado, info = await asyncio.wait_for(asyncio.to_thread(en_segundo_plano, startup_sync_check), timeout=8)
+        except asyncio.TimeoutError:
+            print("[STARTUP] verificación remota: timeout")
+            estado, info = 'offline', 'Timeout comprobando remoto'
+        except Exception as ex:
+            print(f"[STARTUP] error en verificación remota: {ex}")
+            estado, info = 'offline', f'Error: {str(ex)[:50]}'
+        STARTUP_METRICS['verificacion_remota_ms'] = (time.perf_counter() - t0) * 1000
+        STARTUP_METRICS['estado_remoto'] = estado
+        print(f"[STARTUP] verificación remota: {estado} en {STARTUP_METRICS['verificacion_remota_ms']:.0f} ms")
+
+        try:
+            if estado == 'igual':
+                update_status(True, info)
+            elif estado == 'actualizado':
+                n = aplicar_diff_ui(antes, leer_csv())
+                show_snackbar(f"{info} ({n} lotes actualizados)" if n else info)
+                update_status(True, info)
+            elif estado == 'deshabilitado':
+                show_snackbar(info)
+                update_status(False, info)
+            elif estado == 'conflicto':
+                mostrar_conflicto_inicio()
+            else:
+                # Sin conexión: se siguen mostrando los datos locales ya pintados
+                update_status(False, f"Offline (datos locales): {info}")
+        except Exception as ex:
+            print(f"[STARTUP] error aplicando resultado remoto: {ex}")
+
+    def start_background_stages():
+        """Lanza las etapas en background una sola vez (desde on_load o desde el final de main)."""
+        if startup_state["started"]:
+            return
+        startup_state["started"] = True
+        try:
+            page.run_task(background_remote_check)
+        except Exception:
+            try:
+                asyncio.create_task(background_remote_check())
+            except Exception as ex:
+                print(f"[STARTUP] no se pudo lanzar la verificación remota: {ex}")
+        # Sondeo, pendientes y reportes: una sola vez por proceso, compartidos por las sesiones
+        SERVICIO_LOTES.iniciar_tareas(reportes=not hasattr(sys, 'getandroidapilevel'))
+
+    def on_page_load(e):
+        try:
+            content_area.content = ft.Container(tab_crear, padding=15)
+            page.update()
+        except Exception:
+            pass
+        start_background_stages()
 
     page.on_load = on_page_load
     
@@ -1217,6 +4692,7 @@ def main(page: ft.Page):
     # Estado - usando controles directos en lugar de Ref
     connection_status = ft.Ref[ft.Container]()
     status_text = ft.Ref[ft.Text]()
+    pending_text = ft.Ref[ft.Text]()
     
     # Controles directos para variedades (más confiable que Ref)
     lote_info_label = ft.Text(value="Selecciona un lote", size=12, color=ft.Colors.GREY_700)
@@ -1272,11 +4748,20 @@ def main(page: ft.Page):
             return
         copiar_lote(lote)
 
+    def actualizar_pendientes_ui():
+        """Muestra en la barra de estado cuántos cambios esperan ser subidos."""
+        if not pending_text.current:
+            return
+        n = pendientes_outbox()
+        pending_text.current.value = f"⏳ {n} pendiente{'s' if n != 1 else ''}" if n else ""
+        pending_text.current.visible = bool(n)
+
     def update_status(connected: bool, message: str):
         if connection_status.current:
             connection_status.current.bgcolor = ft.Colors.GREEN if connected else ft.Colors.RED
         if status_text.current:
             status_text.current.value = message
+        actualizar_pendientes_ui()
         page.update()
 
     def check_and_update_connection_status():
@@ -1321,11 +4806,30 @@ def main(page: ft.Page):
                 show_snackbar('Subidas bloqueadas tras borrar datos locales. Eliminar manualmente .no_auto_restore para reactivar si estás seguro.', error=True)
                 update_status(False, 'Subidas bloqueadas')
                 return
+            transporte = obtener_transporte()
+            if DATA_LAYOUT == 'particionado' or transporte is not None:
+                # Transporte alternativo o layout particionado: bajar lo que cambió y subir lo local
+                if usa_particiones(transporte):
+                    ok, msg = await asyncio.to_thread(sincronizar_particiones, transporte=transporte)
+                else:
+                    ok, msg = await asyncio.to_thread(sincronizar_transporte, transporte)
+                update_status(ok, msg)
+                if ok:
+                    show_snackbar('Sincronizado exitosamente')
+                else:
+                    show_snackbar(f"Error sincronizando: {msg}", error=True)
+                try:
+                    refresh_lotes_list()
+                    refresh_lotes_list_radios()
+                except Exception:
+                    pass
+                return
+
             # Obtener remoto
             ok, msg, remote_content, remote_hash = await asyncio.to_thread(get_remote_csv_content)
 
             # Si no hay remoto (archivo no encontrado), NO crear automáticamente en auto-sync
-            if not ok and isinstance(msg, str) and ('Archivo' in msg or 'Repositorio' in msg):
+            if not ok and codigo_sync(msg) == SYNC_NO_ENCONTRADO:
                 if not manual:
                     show_snackbar(f"No se encontró el archivo remoto: {msg}", error=True)
                     update_status(False, msg)
@@ -1336,17 +4840,12 @@ def main(page: ft.Page):
                     update_status(False, msg)
                     return
 
-            # Leer local
-            local_content = ''
-            try:
-                with open(LOTES_CSV, 'r', encoding='utf-8') as f:
-                    local_content = f.read()
-            except Exception:
-                local_content = ''
-            local_hash = compute_hash(local_content) if local_content else ''
+            # Leer y preparar local una sola vez para todo el intento
+            preparada = await asyncio.to_thread(preparar_subida_local)
+            local_hash = preparada['hash'] if preparada and preparada['content'] else ''
 
             # Si hay diferencia
-            if remote_hash and remote_content and remote_content != local_content:
+            if remote_hash and remote_content and remote_hash != local_hash:
                 if not manual:
                     # En auto-sync, no sobrescribimos automáticamente: retornar conflicto
                     show_snackbar('Conflicto remoto: no sincronizado', error=True)
@@ -1362,7 +4861,7 @@ def main(page: ft.Page):
                     dlg.open = False
                     page.update()
                     async def do_force():
-                        success, msg2 = await asyncio.to_thread(lambda: subir_csv_github(force=True))
+                        success, msg2 = await asyncio.to_thread(lambda: subir_csv_github(force=True, preparada=preparada))
                         update_status(success, msg2)
                         if not success:
                             show_snackbar(f'Error sincronizando: {msg2}', error=True)
@@ -1387,17 +4886,7 @@ def main(page: ft.Page):
 
             # No hay diferencia/conflicto -> proceder a subir en background
             # Verificar que el CSV local tenga datos antes de subir
-            try:
-                import io
-                with open(LOTES_CSV, 'r', encoding='utf-8') as f:
-                    txt = f.read()
-                reader = csv.reader(io.StringIO(txt))
-                rows = list(reader)
-                data_rows = [r for r in rows[1:] if any((c or '').strip() for c in r)] if len(rows) > 1 else []
-            except Exception:
-                data_rows = None
-
-            if data_rows == []:
+            if preparada is not None and preparada['filas'] == 0:
                 # Mostrar diálogo para confirmar forzar subida de CSV vacío
                 def cancelar_force(e):
                     dlg_force.open = False
@@ -1407,7 +4896,7 @@ def main(page: ft.Page):
                     dlg_force.open = False
                     page.update()
                     async def do_force_upload():
-                        success, msg = await asyncio.to_thread(lambda: subir_csv_github(force=True))
+                        success, msg = await asyncio.to_thread(lambda: subir_csv_github(force=True, preparada=preparada))
                         update_status(success, msg)
                         if not success:
                             show_snackbar(f"Error sincronizando: {msg}", error=True)
@@ -1429,7 +4918,7 @@ def main(page: ft.Page):
                 dlg_force.open = True
                 page.update()
             else:
-                success, msg = await asyncio.to_thread(subir_csv_github)
+                success, msg = await asyncio.to_thread(lambda: subir_csv_github(preparada=preparada))
                 update_status(success, msg)
                 if not success:
                     show_snackbar(f"Error sincronizando: {msg}", error=True)
@@ -1437,104 +4926,120 @@ def main(page: ft.Page):
                     show_snackbar('Sincronizado exitosamente')
 
         asyncio.create_task(do_sync())
+
+    def mutar_o_avisar(aplicar):
+        """SERVICIO_LOTES.mutar de esta sesión; si no se pudo guardar lo avisa y devuelve (False, None)."""
+        try:
+            return SERVICIO_LOTES.mutar(aplicar, sesion_id)
+        except ErrorEscrituraCSV as ex:
+            show_snackbar(f"❌ {ex}", error=True)
+            return False, None
+
+    async def esperar_subida(subida, mensaje_ok=None, al_terminar=None):
+        """Espera la subida agrupada del servicio que incluye el cambio de esta sesión."""
+        success, msg = await asyncio.wrap_future(subida)
+        if not success:
+            show_snackbar(f"⚠️ No sincronizado: {msg}", error=True)
+            update_status(False, msg)
+        else:
+            if mensaje_ok:
+                page.snack_bar = ft.SnackBar(ft.Text(mensaje_ok))
+                page.snack_bar.open = True
+            update_status(True, "Sincronizado")
+        if al_terminar:
+            try:
+                al_terminar()
+            except Exception as ex:
+                print(f"[SERVICIO] error refrescando tras subida: {ex}")
+        page.update()
     
     def create_lote(branch, lote_num, stage, location, semana, notes):
-        lotes = leer_csv()
-        lotes_rama = [l for l in lotes if l.get('Branch') == branch]
-        
-        if lote_num == 'AUTO':
-            try:
-                existing = [int(l.get('LoteNum')) for l in lotes_rama if l.get('LoteNum', '').isdigit()]
-                n = max(existing) + 1 if existing else 1
-            except:
-                n = len(lotes_rama) + 1
-        else:
-            n = int(lote_num.lstrip('L'))
-        
-        entry = {
-            'ID': f"L{n}-{branch}",
-            'Branch': branch,
-            'LoteNum': str(n),
-            'Stage': stage,
-            'Location': location,
-            'Semana': str(semana),
-            'DateCreated': datetime.now().strftime('%Y-%m-%d'),
-            'Notes': notes or '',
-            'Variedades': []
-        }
-        # Evitar crear duplicado exacto (mismo Branch + LoteNum + Location)
-        for l in lotes:
-            if l.get('Branch') == branch and l.get('LoteNum') == str(n) and l.get('Location') == location:
-                # Ya existe un lote con mismo número y ubicación
-                return None
+        def aplicar(lotes):
+            lotes_rama = [l for l in lotes if l.get('Branch') == branch]
 
-        lotes.append(entry)
-        guardar_csv(lotes)
-        async def do_upload():
-            success, msg = await asyncio.to_thread(subir_csv_github)
-            if not success:
-                show_snackbar(f"⚠️ No sincronizado: {msg}", error=True)
-                update_status(False, msg)
+            if lote_num == 'AUTO':
+                try:
+                    # Los números de lotes en el archivo frío tampoco se reutilizan
+                    usados = lotes_rama + [l for l in leer_archivo_frio() if l.get('Branch') == branch]
+                    existing = [int(l.get('LoteNum')) for l in usados if l.get('LoteNum', '').isdigit()]
+                    n = max(existing) + 1 if existing else 1
+                except:
+                    n = len(lotes_rama) + 1
             else:
-                update_status(True, "Sincronizado")
-        asyncio.create_task(do_upload())
-        return f"L{n}-{branch}"
+                n = int(lote_num.lstrip('L'))
+
+            entry = {
+                'ID': f"L{n}-{branch}",
+                'Branch': branch,
+                'LoteNum': str(n),
+                'Stage': stage,
+                'Location': location,
+                'Semana': str(semana),
+                'DateCreated': datetime.now().strftime('%Y-%m-%d'),
+                'Notes': notes or '',
+                'Variedades': []
+            }
+            # Evitar crear duplicado exacto (mismo Branch + LoteNum + Location)
+            for l in lotes:
+                if l.get('Branch') == branch and l.get('LoteNum') == str(n) and l.get('Location') == location:
+                    # Ya existe un lote con mismo número y ubicación
+                    return None
+
+            lotes.append(entry)
+            return f"L{n}-{branch}"
+
+        nuevo_id, subida = mutar_o_avisar(aplicar)
+        if subida:
+            asyncio.create_task(esperar_subida(subida))
+        return nuevo_id
     
     def add_variety_to_lote(lote_id, variety_name, qty):
-        lotes = leer_csv()
-        idx, lote = find_lote_by_id(lote_id, lotes)
-        
-        if lote is None:
-            return False
-        
-        vars_list = lote.get('Variedades', [])
-        found = False
-        for v in vars_list:
-            if v['name'] == variety_name:
-                v['count'] += qty
-                found = True
-                break
-        
-        if not found:
-            if len(vars_list) >= 20:
+        def aplicar(lotes):
+            idx, lote = find_lote_by_id(lote_id, lotes)
+
+            if lote is None:
                 return False
-            vars_list.append({'name': variety_name, 'count': qty})
-        
-        lote['Variedades'] = vars_list
-        guardar_csv(lotes)
-        async def do_upload():
-            success, msg = await asyncio.to_thread(subir_csv_github)
-            if not success:
-                show_snackbar(f"⚠️ No sincronizado: {msg}", error=True)
-                update_status(False, msg)
-            else:
-                update_status(True, "Sincronizado")
-        asyncio.create_task(do_upload())
-        return True
+
+            vars_list = lote.get('Variedades', [])
+            found = False
+            for v in vars_list:
+                if v['name'] == variety_name:
+                    v['count'] += qty
+                    found = True
+                    break
+
+            if not found:
+                if len(vars_list) >= MAX_VARIEDADES_LOTE:
+                    return False
+                vars_list.append({'name': variety_name, 'count': qty})
+
+            lote['Variedades'] = vars_list
+            return True
+
+        ok, subida = mutar_o_avisar(aplicar)
+        if subida:
+            asyncio.create_task(esperar_subida(subida))
+        return ok
     
     def remove_variety_from_lote(lote_id, variety_name):
-        lotes = leer_csv()
-        idx, lote = find_lote_by_id(lote_id, lotes)
-        
-        if lote is None:
+        def aplicar(lotes):
+            idx, lote = find_lote_by_id(lote_id, lotes)
+
+            if lote is None:
+                return False
+
+            vars_list = lote.get('Variedades', [])
+            for i, v in enumerate(vars_list):
+                if v['name'] == variety_name:
+                    del vars_list[i]
+                    lote['Variedades'] = vars_list
+                    return True
             return False
-        
-        vars_list = lote.get('Variedades', [])
-        for i, v in enumerate(vars_list):
-            if v['name'] == variety_name:
-                del vars_list[i]
-                lote['Variedades'] = vars_list
-                guardar_csv(lotes)
-                async def do_upload():
-                    success, msg = await asyncio.to_thread(subir_csv_github)
-                    if not success:
-                        show_snackbar(f"⚠️ No sincronizado: {msg}", error=True)
-                        update_status(False, msg)
-                    else:
-                        update_status(True, "Sincronizado")
-                asyncio.create_task(do_upload())
-                return True
-        return False
+
+        ok, subida = mutar_o_avisar(aplicar)
+        if subida:
+            asyncio.create_task(esperar_subida(subida))
+        return ok
     
     # ========== UI COMPONENTS ==========
     
@@ -1549,6 +5054,7 @@ def main(page: ft.Page):
                 bgcolor=ft.Colors.GREY,
             ),
             ft.Text(ref=status_text, value="Iniciando...", size=12),
+            ft.Text(ref=pending_text, value="", size=11, color=ft.Colors.ORANGE_800, visible=False),
             ft.Container(expand=True),
             ft.Text(f"v{VERSION}", size=10, color=ft.Colors.GREY),
         ]),
@@ -1663,6 +5169,9 @@ def main(page: ft.Page):
             semana_dd.value,
             notes_field.value
         )
+        if lote_id is False:
+            # Error de escritura, ya avisado por mutar_o_avisar
+            return
         if not lote_id:
             page.snack_bar = ft.SnackBar(ft.Text("❌ No se creó el lote: ya existe uno igual (mismo número y ubicación)."), bgcolor=ft.Colors.RED_400)
             page.snack_bar.open = True
@@ -1762,6 +5271,96 @@ def main(page: ft.Page):
         page.snack_bar.open = True
         page.update()
     
+    def on_importar_variedades(e):
+        """Agrega varias variedades pegadas como texto/CSV en una sola mutación (una escritura, una subida)."""
+        lote_id = current_lote_id["value"]
+        if not lote_id:
+            show_snackbar("Selecciona un lote primero", error=True)
+            return
+
+        texto_field = ft.TextField(
+            label="Una variedad por línea: nombre, cantidad",
+            multiline=True,
+            min_lines=6,
+            max_lines=12,
+            width=360,
+        )
+        vista_previa = ft.Text("", size=12)
+
+        def simular():
+            """Parsea el texto y simula el agregado sobre una copia del lote actual."""
+            items, errores = parsear_variedades(texto_field.value or "")
+            _, lote = find_lote_by_id(lote_id, leer_csv())
+            copia = {'Variedades': [dict(v) for v in (lote or {}).get('Variedades', [])]}
+            agregadas, sin_lugar = agregar_variedades(copia, items)
+            return items, errores, agregadas, sin_lugar
+
+        def on_texto_change(ev):
+            items, errores, agregadas, sin_lugar = simular()
+            lineas = []
+            for item in items:
+                if item['name'] in sin_lugar:
+                    continue
+                corregido = "" if item['original'].lower() == item['name'].lower() else f" (← {item['original']})"
+                lineas.append(f"✅ {item['name']} x{item['count']}{corregido}")
+            if sin_lugar:
+                lineas.append(f"⚠️ Sin lugar (máx. {MAX_VARIEDADES_LOTE} variedades): {', '.join(sin_lugar)}")
+            lineas.extend(f"❌ {err}" for err in errores)
+            vista_previa.value = "\n".join(lineas)
+            importar_btn.disabled = not agregadas
+            page.update()
+
+        def cerrar(ev):
+            dlg.open = False
+            page.update()
+
+        def confirmar(ev):
+            dlg.open = False
+            page.update()
+            items, _ = parsear_variedades(texto_field.value or "")
+            resultado = {}
+
+            def aplicar(lotes):
+                _, lote = find_lote_by_id(lote_id, lotes)
+                if lote is None:
+                    return False
+                resultado['agregadas'], resultado['sin_lugar'] = agregar_variedades(lote, items)
+                return bool(resultado['agregadas'])
+
+            try:
+                ok, subida = SERVICIO_LOTES.mutar(aplicar, sesion_id)
+            except ErrorEscrituraCSV as ex:
+                show_snackbar(f"❌ {ex}", error=True)
+                return
+            if not ok:
+                show_snackbar("No se agregó ninguna variedad", error=True)
+                return
+            mensaje = f"✅ {len(resultado['agregadas'])} variedades agregadas"
+            if resultado['sin_lugar']:
+                mensaje += f" ({len(resultado['sin_lugar'])} sin lugar)"
+            load_lote_data(lote_id)
+            asyncio.create_task(esperar_subida(subida, mensaje))
+
+        texto_field.on_change = on_texto_change
+        importar_btn = ft.TextButton("Importar", on_click=confirmar, disabled=True,
+                                     style=ft.ButtonStyle(color=ft.Colors.BLUE))
+        dlg = ft.AlertDialog(
+            modal=True,
+            title=ft.Text(f"Importar variedades en {lote_id}"),
+            content=ft.Column([
+                texto_field,
+                ft.Column([vista_previa], scroll=ft.ScrollMode.AUTO, height=160),
+            ], tight=True, width=360),
+            actions=[
+                ft.TextButton("Cancelar", on_click=cerrar),
+                importar_btn,
+            ],
+            actions_alignment=ft.MainAxisAlignment.END,
+        )
+        page.overlay.append(dlg)
+        dlg.open = True
+        page.update()
+    
     # Usar PopupMenuButton que SÍ tiene on_click funcional
     lote_selector_text = ft.Text("Seleccionar lote...", size=14)
     lotes_popup_menu = ft.PopupMenuButton(
@@ -1830,28 +5429,11 @@ def main(page: ft.Page):
         if not current_lote_id["value"]:
             return
         
-        lotes = leer_csv()
-        idx, lote = find_lote_by_id(current_lote_id["value"], lotes)
-        
-        if lote is None:
-            return
-        
-        vars_list = lote.get('Variedades', [])
-        for i, v in enumerate(vars_list):
-            if v['name'] == variedad_name:
-                del vars_list[i]
-                lote['Variedades'] = vars_list
-                guardar_csv(lotes)
-                async def do_upload():
-                    success, msg = await asyncio.to_thread(subir_csv_github)
-                    if not success:
-                        show_snackbar(f"⚠️ No sincronizado: {msg}", error=True)
-                    else:
-                        page.snack_bar = ft.SnackBar(ft.Text(f"Eliminado: {variedad_name}"))
-                        page.snack_bar.open = True
-                    load_lote_data(current_lote_id["value"])
-                asyncio.create_task(do_upload())
-                return
+        if remove_variety_from_lote(current_lote_id["value"], variedad_name):
+            load_lote_data(current_lote_id["value"])
+            page.snack_bar = ft.SnackBar(ft.Text(f"Eliminado: {variedad_name}"))
+            page.snack_bar.open = True
+            page.update()
     
     def confirmar_eliminar(variedad_name):
         """Muestra diálogo de confirmación antes de eliminar."""
@@ -1961,19 +5543,26 @@ def main(page: ft.Page):
         ], vertical_alignment=ft.CrossAxisAlignment.CENTER),
         ft.Divider(),
         ft.Row([variety_dd, qty_field], wrap=True),
-        ft.FilledButton(
-            "Agregar variedad",
-            icon=ft.Icons.ADD_CIRCLE,
-            on_click=on_add_variety,
-            style=ft.ButtonStyle(bgcolor=ft.Colors.BLUE, color=ft.Colors.WHITE),
-        ),
+        ft.Row([
+            ft.FilledButton(
+                "Agregar variedad",
+                icon=ft.Icons.ADD_CIRCLE,
+                on_click=on_add_variety,
+                style=ft.ButtonStyle(bgcolor=ft.Colors.BLUE, color=ft.Colors.WHITE),
+            ),
+            ft.OutlinedButton(
+                "Importar lista",
+                icon=ft.Icons.PLAYLIST_ADD,
+                on_click=on_importar_variedades,
+            ),
+        ], wrap=True, spacing=8),
     ], spacing=10, scroll=ft.ScrollMode.AUTO)
     
     # ========== TAB 3: GRÁFICOS ==========
     
     def build_stage_chart():
         """Construye visualización de distribución por etapa usando barras."""
-        lotes = [l for l in leer_csv() if not es_archivado(l)]
+        lotes = leer_lotes_activos()
         por_etapa = {}
         
         for lote in lotes:
@@ -2022,7 +5611,7 @@ def main(page: ft.Page):
     
     def build_location_chart():
         """Construye visualización por ubicación."""
-        lotes = [l for l in leer_csv() if not es_archivado(l)]
+        lotes = leer_lotes_activos()
         por_ubicacion = {}
         
         for lote in lotes:
@@ -2058,7 +5647,7 @@ def main(page: ft.Page):
     
     def build_branch_chart():
         """Construye visualización por sucursal y etapa."""
-        lotes = [l for l in leer_csv() if not es_archivado(l)]
+        lotes = leer_lotes_activos()
         data = {}
         
         for lote in lotes:
@@ -2157,33 +5746,9 @@ def main(page: ft.Page):
     lotes_listview = ft.Ref[ft.ListView]()
     
     # Funciones de exportación
-    def get_export_data():
-        """Obtiene los datos filtrados para exportar"""
-        lotes = [l for l in leer_csv() if not es_archivado(l)]
+    export_progress_text = ft.Text("", size=12, color=ft.Colors.GREY_600)
+    export_cancel_btn = ft.TextButton("Cancelar", visible=False, on_click=lambda e: on_cancelar_export(e))
 
-        # Aplicar filtros actuales
-        branch_filter = filter_branch_dd.value if filter_branch_dd.value != "Todas" else None
-        stage_filter = filter_stage_dd.value if filter_stage_dd.value != "Todas" else None
-        location_filter = filter_location_dd.value if filter_location_dd.value != "Todas" else None
-        
-        filtered = []
-        for lote in lotes:
-            if branch_filter and lote.get('Branch') != branch_filter:
-                continue
-            if stage_filter and lote.get('Stage') != stage_filter:
-                continue
-            if location_filter and lote.get('Location') != location_filter:
-                continue
-            filtered.append(lote)
-        
-        def lote_key(lote):
-            try:
-                return (lote.get('Branch', ''), int(lote.get('LoteNum', 0)))
-            except:
-                return (lote.get('Branch', ''), 0)
-        
-        return sorted(filtered, key=lote_key)
-    
     def get_downloads_folder():
         """Obtiene la carpeta de Descargas según el sistema operativo."""
         if sys.platform == 'android':
@@ -2223,200 +5788,144 @@ def main(page: ft.Page):
         dlg.open = True
         page.update()
     
+    def filtros_export():
+        """Predicado con los filtros actuales del Listado."""
+        return filtro_listado(*clave_filtros_export())
+
+    def clave_filtros_export():
+        """Tupla (sucursal, etapa, ubicación) de los filtros actuales, para la caché de exportaciones."""
+        return (filter_branch_dd.value, filter_stage_dd.value, filter_location_dd.value)
+
+    def progreso_export(texto):
+        """Muestra el avance de una exportación en la fila de botones (vacío = ocultar)."""
+        export_progress_text.value = texto
+        try:
+            page.update()
+        except Exception:
+            pass
+
     def export_to_csv(e=None):
-        """Exportar a CSV"""
-        lotes = get_export_data()
-        if not lotes:
-            show_snackbar("No hay datos para exportar", error=True)
-            return
-        
+        """Exportar a CSV (en background, escribiendo fila a fila)"""
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"lotes_export_{timestamp}.csv"
         
         # Usar carpeta de Descargas
         export_dir = get_downloads_folder()
         filepath = os.path.join(export_dir, filename)
-        
-        try:
-            with open(filepath, 'w', newline='', encoding='utf-8') as f:
-                writer = csv.writer(f)
-                # Encabezados
-                writer.writerow(['ID', 'Sucursal', 'Lote', 'Etapa', 'Ubicación', 'Semana', 'Fecha', 'Variedades', 'Total Plantas', 'Notas'])
-                
-                for lote in lotes:
-                    variedades = lote.get('Variedades', [])
-                    vars_str = ', '.join([f"{v['name']}({v['count']})" for v in variedades])
-                    total = sum(v['count'] for v in variedades)
-                    
-                    writer.writerow([
-                        lote.get('ID', ''),
-                        lote.get('Branch', ''),
-                        lote.get('LoteNum', ''),
-                        lote.get('Stage', ''),
-                        lote.get('Location', ''),
-                        lote.get('Semana', ''),
-                        lote.get('DateCreated', ''),
-                        vars_str,
-                        total,
-                        lote.get('Notes', '')
-                    ])
-            
+        predicado = filtros_export()
+        filtros = clave_filtros_export()
+
+        async def do_export():
+            progreso_export("Exportando CSV...")
+            try:
+                n, _ = await asyncio.to_thread(
+                    exportar_cacheado, 'csv', filtros, filepath,
+                    lambda ruta: exportar_csv_streaming(
+                        ruta, predicado, lambda k: progreso_export(f"Exportando CSV... {k} lotes")))
+            except Exception as ex:
+                progreso_export("")
+                show_snackbar(f"Error al exportar CSV: {ex}", error=True)
+                return
+            progreso_export("")
+            if not n:
+                show_snackbar("No hay datos para exportar", error=True)
+                return
             show_export_success(filepath, "CSV")
-        except Exception as ex:
-            show_snackbar(f"Error al exportar CSV: {ex}", error=True)
+
+        asyncio.create_task(do_export())
     
     def export_to_excel(e=None):
-        """Exportar a Excel (XLSX)"""
+        """Exportar a Excel (XLSX) en background: una hoja por sucursal más un resumen"""
         if not OPENPYXL_AVAILABLE:
             show_snackbar("⚠️ openpyxl no disponible. Instalar: pip install openpyxl", error=True)
             return
         
-        lotes = get_export_data()
-        if not lotes:
-            show_snackbar("No hay datos para exportar", error=True)
-            return
-        
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"lotes_export_{timestamp}.xlsx"
         
         # Usar carpeta de Descargas
-        export_dir = get_downloads_folder()
-        filepath = os.path.join(export_dir, filename)
-        
-        try:
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Lotes"
-            
-            # Encabezados con formato
-            headers = ['ID', 'Sucursal', 'Lote', 'Etapa', 'Ubicación', 'Semana', 'Fecha', 'Variedades', 'Total', 'Notas']
-            for col, header in enumerate(headers, 1):
-                cell = ws.cell(row=1, column=col, value=header)
-                cell.font = Font(bold=True)
-            
-            # Datos
-            for row_num, lote in enumerate(lotes, 2):
-                variedades = lote.get('Variedades', [])
-                vars_str = ', '.join([f"{v['name']}({v['count']})" for v in variedades])
-                total = sum(v['count'] for v in variedades)
-                
-                ws.cell(row=row_num, column=1, value=lote.get('ID', ''))
-                ws.cell(row=row_num, column=2, value=lote.get('Branch', ''))
-                ws.cell(row=row_num, column=3, value=int(lote.get('LoteNum', 0)) if lote.get('LoteNum', '').isdigit() else 0)
-                ws.cell(row=row_num, column=4, value=lote.get('Stage', ''))
-                ws.cell(row=row_num, column=5, value=lote.get('Location', ''))
-                ws.cell(row=row_num, column=6, value=int(lote.get('Semana', 0)) if lote.get('Semana', '').isdigit() else 0)
-                ws.cell(row=row_num, column=7, value=lote.get('DateCreated', ''))
-                ws.cell(row=row_num, column=8, value=vars_str)
-                ws.cell(row=row_num, column=9, value=total)
-                ws.cell(row=row_num, column=10, value=lote.get('Notes', ''))
-            
-            # Ajustar ancho de columnas
-            ws.column_dimensions['A'].width = 12
-            ws.column_dimensions['H'].width = 30
-            ws.column_dimensions['J'].width = 25
-            
-            wb.save(filepath)
+        export_dir = get_downloads_folder()
+        filepath = os.path.join(export_dir, filename)
+        predicado = filtros_export()
+        filtros = clave_filtros_export()
+
+        async def do_export():
+            progreso_export("Exportando Excel...")
+            try:
+                n, _ = await asyncio.to_thread(
+                    exportar_cacheado, 'xlsx', filtros, filepath,
+                    lambda ruta: exportar_excel_streaming(
+                        ruta, predicado, lambda k: progreso_export(f"Exportando Excel... {k} lotes")))
+            except Exception as ex:
+                progreso_export("")
+                show_snackbar(f"Error al exportar Excel: {ex}", error=True)
+                return
+            progreso_export("")
+            if not n:
+                show_snackbar("No hay datos para exportar", error=True)
+                return
             show_export_success(filepath, "Excel")
-        except Exception as ex:
-            show_snackbar(f"Error al exportar Excel: {ex}", error=True)
+
+        asyncio.create_task(do_export())
     
+    export_cancelado = threading.Event()
+
+    def on_cancelar_export(e=None):
+        export_cancelado.set()
+        progreso_export("Cancelando...")
+
     def export_to_pdf(e=None):
-        """Exportar a PDF con todas las variedades visibles"""
+        """Exportar a PDF con todas las variedades visibles (en background, cancelable)"""
         if not FPDF_AVAILABLE:
             show_snackbar("⚠️ fpdf2 no disponible. Instalar: pip install fpdf2", error=True)
             return
         
-        lotes = get_export_data()
-        if not lotes:
-            show_snackbar("No hay datos para exportar", error=True)
-            return
-        
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"lotes_export_{timestamp}.pdf"
         
         # Usar carpeta de Descargas
         export_dir = get_downloads_folder()
         filepath = os.path.join(export_dir, filename)
-        
-        try:
-            pdf = FPDF()
-            pdf.set_auto_page_break(auto=True, margin=15)
-            pdf.add_page()
-            
-            # Título
-            pdf.set_font('Helvetica', 'B', 18)
-            pdf.cell(0, 12, 'Control de Lotes - Reporte', new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='C')
-            pdf.set_font('Helvetica', '', 10)
-            pdf.cell(0, 8, f'Generado: {datetime.now().strftime("%Y-%m-%d %H:%M")}', new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='C')
-            pdf.ln(5)
-            
-            # Filtros aplicados
-            filters = []
-            if filter_branch_dd.value != "Todas":
-                filters.append(f"Sucursal: {filter_branch_dd.value}")
-            if filter_stage_dd.value != "Todas":
-                filters.append(f"Etapa: {filter_stage_dd.value}")
-            if filter_location_dd.value != "Todas":
-                filters.append(f"Ubicación: {filter_location_dd.value}")
-            if filters:
-                pdf.set_font('Helvetica', 'I', 9)
-                pdf.cell(0, 6, f'Filtros: {" | ".join(filters)}', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-            
-            pdf.ln(5)
-            
-            # Formato de ficha por cada lote
-            for lote in lotes:
-                variedades = lote.get('Variedades', [])
-                total = sum(v['count'] for v in variedades)
-                
-                # Verificar si hay espacio suficiente, sino nueva página
-                needed_height = 30 + (len(variedades) * 5)
-                if pdf.get_y() + needed_height > 270:
-                    pdf.add_page()
-                
-                # Encabezado del lote (fondo gris)
-                pdf.set_fill_color(230, 230, 230)
-                pdf.set_font('Helvetica', 'B', 11)
-                lote_id = lote.get('ID', '')
-                stage = lote.get('Stage', '')
-                location = lote.get('Location', '')
-                semana = lote.get('Semana', '')
-                
-                pdf.cell(0, 8, f"{lote_id}  |  {stage}  |  {location}  |  Semana {semana}  |  Total: {total} plantas", 
-                         new_x=XPos.LMARGIN, new_y=YPos.NEXT, fill=True, border=1)
-                
-                # Lista de variedades
-                if variedades:
-                    pdf.set_font('Helvetica', '', 9)
-                    for v in sorted(variedades, key=lambda x: x['name']):
-                        pdf.cell(10, 5, '', border=0)  # Indentación
-                        pdf.cell(80, 5, f"- {v['name']}", border=0)
-                        pdf.cell(30, 5, str(v['count']), new_x=XPos.LMARGIN, new_y=YPos.NEXT, align='R')
-                else:
-                    pdf.set_font('Helvetica', 'I', 9)
-                    pdf.cell(10, 5, '', border=0)
-                    pdf.cell(0, 5, 'Sin variedades', new_x=XPos.LMARGIN, new_y=YPos.NEXT)
-                
-                pdf.ln(3)
-            
-            # Resumen final
-            pdf.ln(5)
-            pdf.set_draw_color(0, 0, 0)
-            pdf.set_font('Helvetica', 'B', 12)
-            total_lotes = len(lotes)
-            total_plantas = sum(sum(v['count'] for v in l.get('Variedades', [])) for l in lotes)
-            pdf.cell(0, 10, f'TOTAL: {total_lotes} lotes  |  {total_plantas} plantas', 
-                     new_x=XPos.LMARGIN, new_y=YPos.NEXT, border=1, align='C')
-            
-            pdf.output(filepath)
-            show_export_success(filepath, "PDF")
-        except ImportError as ie:
-            show_snackbar(f"Error de importación: {ie}", error=True)
-        except Exception as ex:
-            import traceback
-            print(f"Error PDF: {traceback.format_exc()}")
-            show_snackbar(f"Error al exportar PDF: {ex}", error=True)
+        predicado = filtros_export()
+        filtros = clave_filtros_export()
+
+        # Filtros aplicados
+        filters = []
+        if filter_branch_dd.value != "Todas":
+            filters.append(f"Sucursal: {filter_branch_dd.value}")
+        if filter_stage_dd.value != "Todas":
+            filters.append(f"Etapa: {filter_stage_dd.value}")
+        if filter_location_dd.value != "Todas":
+            filters.append(f"Ubicación: {filter_location_dd.value}")
+
+        async def do_export():
+            export_cancelado.clear()
+            export_cancel_btn.visible = True
+            progreso_export("Generando PDF...")
+            try:
+                n, _ = await asyncio.to_thread(
+                    exportar_cacheado, 'pdf', filtros, filepath,
+                    lambda ruta: exportar_pdf(
+                        ruta, predicado, filters,
+                        lambda k, total: progreso_export(f"Generando PDF... {k}/{total} sucursales"),
+                        export_cancelado.is_set, con_fecha=False))
+            except Exception as ex:
+                import traceback
+                print(f"Error PDF: {traceback.format_exc()}")
+                export_cancel_btn.visible = False
+                progreso_export("")
+                show_snackbar(f"Error al exportar PDF: {ex}", error=True)
+                return
+            export_cancel_btn.visible = False
+            progreso_export("")
+            if n is None:
+                show_snackbar("Exportación PDF cancelada")
+            elif not n:
+                show_snackbar("No hay datos para exportar", error=True)
+            else:
+                show_export_success(filepath, "PDF")
+
+        asyncio.create_task(do_export())
     
     # Filtros para el listado
     filter_branch_dd = ft.Dropdown(
@@ -2441,8 +5950,54 @@ def main(page: ft.Page):
         dense=True,
     )
     
+    # Tarjetas del Listado por clave estable: {clave: (firma, card)}. Al refrescar solo se
+    # reconstruyen las tarjetas cuyo contenido cambió.
+    listado_cards = {}
+
+    def build_listado_card(lote):
+        """Construye la tarjeta de un lote para el Listado."""
+        branch = lote.get('Branch', '')
+        lote_num = lote.get('LoteNum', '')
+        lote_id = f"L{lote_num}-{branch}"
+        
+        variedades = lote.get('Variedades', [])
+        total = sum(v['count'] for v in variedades)
+        
+        # Mostrar todas las variedades en líneas separadas
+        vars_widgets = []
+        if variedades:
+            for v in sorted(variedades, key=lambda x: x['name']):
+                vars_widgets.append(
+                    ft.Text(f"  🌿 {v['name']}: {v['count']}", size=11, color=ft.Colors.GREY_700)
+                )
+        else:
+            vars_widgets.append(ft.Text("  Sin variedades", size=11, color=ft.Colors.GREY_500, italic=True))
+        
+        return ft.Card(
+            content=ft.Container(
+                content=ft.Column([
+                    ft.Row([
+                        ft.Text(lote_id, size=16, weight=ft.FontWeight.BOLD),
+                        ft.Container(expand=True),
+                        ft.Chip(label=ft.Text(lote.get('Stage', '')), bgcolor=ft.Colors.GREEN_100),
+                        ft.IconButton(
+                            ft.Icons.COPY,
+                            icon_size=18,
+                            tooltip="Copiar lote para compartir",
+                            on_click=lambda e, l=lote: copiar_lote(l),
+                        ),
+                    ]),
+                    ft.Text(f"📍 {lote.get('Location', '')} | 📅 Semana {lote.get('Semana', '')}", size=12),
+                    ft.Column(vars_widgets, spacing=0),
+                    ft.Text(f"🌱 Total: {total} plantas", size=12, weight=ft.FontWeight.W_500),
+                ], spacing=4),
+                padding=12,
+            ),
+        )
+
     def refresh_lotes_list(e=None):
-        lotes = [l for l in leer_csv() if not es_archivado(l)]
+        lotes = leer_lotes_activos()
+        claves = {id(l): k for k, l in indexar_lotes(lotes).items()}
 
         # Aplicar filtros
         branch_filter = filter_branch_dd.value if filter_branch_dd.value != "Todas" else None
@@ -2472,48 +6027,19 @@ def main(page: ft.Page):
             if not lotes_sorted:
                 # Mostrar mensaje claro cuando no hay datos
                 lotes_listview.current.controls.append(ft.Text("No hay lotes locales", color=ft.Colors.GREY_600))
-            else:
-                for lote in lotes_sorted:
-                    branch = lote.get('Branch', '')
-                    lote_num = lote.get('LoteNum', '')
-                    lote_id = f"L{lote_num}-{branch}"
-                    
-                    variedades = lote.get('Variedades', [])
-                    total = sum(v['count'] for v in variedades)
-                    
-                    # Mostrar todas las variedades en líneas separadas
-                    vars_widgets = []
-                    if variedades:
-                        for v in sorted(variedades, key=lambda x: x['name']):
-                            vars_widgets.append(
-                                ft.Text(f"  🌿 {v['name']}: {v['count']}", size=11, color=ft.Colors.GREY_700)
-                            )
-                    else:
-                        vars_widgets.append(ft.Text("  Sin variedades", size=11, color=ft.Colors.GREY_500, italic=True))
-                    
-                    lotes_listview.current.controls.append(
-                        ft.Card(
-                            content=ft.Container(
-                                content=ft.Column([
-                                    ft.Row([
-                                        ft.Text(lote_id, size=16, weight=ft.FontWeight.BOLD),
-                                        ft.Container(expand=True),
-                                        ft.Chip(label=ft.Text(lote.get('Stage', '')), bgcolor=ft.Colors.GREEN_100),
-                                        ft.IconButton(
-                                            ft.Icons.COPY,
-                                            icon_size=18,
-                                            tooltip="Copiar lote para compartir",
-                                            on_click=lambda e, l=lote: copiar_lote(l),
-                                        ),
-                                    ]),
-                                    ft.Text(f"📍 {lote.get('Location', '')} | 📅 Semana {lote.get('Semana', '')}", size=12),
-                                    ft.Column(vars_widgets, spacing=0),
-                                    ft.Text(f"🌱 Total: {total} plantas", size=12, weight=ft.FontWeight.W_500),
-                                ], spacing=4),
-                                padding=12,
-                            ),
-                        )
-                    )
+            vigentes = {}
+            for lote in lotes_sorted:
+                clave = claves[id(lote)]
+                firma = firma_lote(lote)
+                previa = listado_cards.get(clave)
+                if previa and previa[0] == firma:
+                    card = previa[1]
+                else:
+                    card = build_listado_card(lote)
+                vigentes[clave] = (firma, card)
+                lotes_listview.current.controls.append(card)
+            listado_cards.clear()
+            listado_cards.update(vigentes)
             page.update()
     
     tab_listado = ft.Column([
@@ -2536,7 +6062,9 @@ def main(page: ft.Page):
             ft.OutlinedButton("CSV", icon=ft.Icons.TABLE_CHART, on_click=export_to_csv),
             ft.OutlinedButton("Excel", icon=ft.Icons.GRID_ON, on_click=export_to_excel),
             ft.OutlinedButton("PDF", icon=ft.Icons.PICTURE_AS_PDF, on_click=export_to_pdf),
-        ], spacing=8),
+            export_progress_text,
+            export_cancel_btn,
+        ], spacing=8, wrap=True),
         ft.Divider(),
         ft.ListView(ref=lotes_listview, spacing=8, expand=True),
     ], expand=True)
@@ -2725,110 +6253,111 @@ def main(page: ft.Page):
             page.update()
             return
         
-        lotes = leer_csv()
-        idx, lote = find_lote_by_id(current_edit_lote["value"], lotes)
-        
-        if lote is None:
+        encontrado = {"value": True}
+
+        def aplicar(lotes):
+            idx, lote = find_lote_by_id(current_edit_lote["value"], lotes)
+            if lote is None:
+                encontrado["value"] = False
+                return []
+
+            cambios = []
+
+            # Aplicar cambios
+            if edit_stage_dd.value and lote.get('Stage') != edit_stage_dd.value:
+                lote['Stage'] = edit_stage_dd.value
+                cambios.append('Etapa')
+
+            if edit_location_dd.value and lote.get('Location') != edit_location_dd.value:
+                lote['Location'] = edit_location_dd.value
+                cambios.append('Ubicación')
+
+            if edit_semana_dd.value and lote.get('Semana') != edit_semana_dd.value:
+                lote['Semana'] = edit_semana_dd.value
+                cambios.append('Semana')
+                # Si la semana es 20 o 21, cambiar automáticamente a PT/SECADO
+                try:
+                    sem_num = int(edit_semana_dd.value)
+                    if sem_num in (20, 21):
+                        lote['Location'] = 'PT'
+                        lote['Stage'] = 'SECADO'
+                        if 'Ubicación' not in cambios:
+                            cambios.append('Ubicación→PT')
+                        if 'Etapa' not in cambios:
+                            cambios.append('Etapa→SECADO')
+                except:
+                    pass
+            return cambios
+
+        # Guardar y sincronizar
+        try:
+            cambios, subida = SERVICIO_LOTES.mutar(aplicar, sesion_id)
+        except ErrorEscrituraCSV as ex:
+            show_snackbar(f"❌ {ex}: los cambios no se guardaron", error=True)
+            return
+
+        if not encontrado["value"]:
             page.snack_bar = ft.SnackBar(ft.Text("Lote no encontrado"))
             page.snack_bar.open = True
             page.update()
             return
         
-        cambios = []
-        
-        # Aplicar cambios
-        if edit_stage_dd.value and lote.get('Stage') != edit_stage_dd.value:
-            lote['Stage'] = edit_stage_dd.value
-            cambios.append('Etapa')
-        
-        if edit_location_dd.value and lote.get('Location') != edit_location_dd.value:
-            lote['Location'] = edit_location_dd.value
-            cambios.append('Ubicación')
-        
-        if edit_semana_dd.value and lote.get('Semana') != edit_semana_dd.value:
-            lote['Semana'] = edit_semana_dd.value
-            cambios.append('Semana')
-            # Si la semana es 20 o 21, cambiar automáticamente a PT/SECADO
-            try:
-                sem_num = int(edit_semana_dd.value)
-                if sem_num in (20, 21):
-                    lote['Location'] = 'PT'
-                    lote['Stage'] = 'SECADO'
-                    if 'Ubicación' not in cambios:
-                        cambios.append('Ubicación→PT')
-                    if 'Etapa' not in cambios:
-                        cambios.append('Etapa→SECADO')
-            except:
-                pass
-        
         if not cambios:
             page.snack_bar = ft.SnackBar(ft.Text("No hay cambios para guardar"))
             page.snack_bar.open = True
             page.update()
             return
-        
-        # Guardar y sincronizar
-        guardar_csv(lotes)
-        async def do_upload():
-            success, msg = await asyncio.to_thread(subir_csv_github)
-            if not success:
-                show_snackbar(f"⚠️ No sincronizado: {msg}", error=True)
-            else:
-                page.snack_bar = ft.SnackBar(ft.Text(f"✅ Lote actualizado ({', '.join(cambios)})"))
-                page.snack_bar.open = True
+
+        def refrescar():
             # Refrescar listas
             refresh_edit_lotes_popup()
             refresh_lotes_dropdown()
-            page.update()
-        asyncio.create_task(do_upload())
+        asyncio.create_task(esperar_subida(subida, f"✅ Lote actualizado ({', '.join(cambios)})", refrescar))
 
     def _set_archivado(lote_id, archivar):
         """Marca/desmarca un lote como archivado, guarda y sincroniza."""
-        lotes = leer_csv()
-        # Al archivar buscar la primera fila NO archivada; al desarchivar la primera archivada.
-        # Esto evita que filas duplicadas (mismo ID+ubicación en PT) queden inalcanzables.
-        idx, lote = find_lote_by_id(lote_id, lotes, archived=not archivar)
-        if lote is None:
-            # Fallback: cualquier fila con ese ID
-            idx, lote = find_lote_by_id(lote_id, lotes)
-        if lote is None:
+        def aplicar(lotes):
+            # Al archivar buscar la primera fila NO archivada; al desarchivar la primera archivada.
+            # Esto evita que filas duplicadas (mismo ID+ubicación en PT) queden inalcanzables.
+            idx, lote = find_lote_by_id(lote_id, lotes, archived=not archivar)
+            if lote is None and not archivar:
+                # El lote está en el archivo frío: devolverlo al CSV activo (se quita del frío
+                # en la misma escritura, ver _guardar_csv)
+                lote = sacar_de_frio(lote_id)
+                if lote is not None:
+                    lotes.append(lote)
+            if lote is None:
+                # Fallback: cualquier fila con ese ID
+                idx, lote = find_lote_by_id(lote_id, lotes)
+            if lote is None:
+                return False
+            lote['Archivado'] = '1' if archivar else ''
+            lote['ÚltimaActualización'] = datetime.now().strftime('%Y-%m-%d')
+            return True
+
+        try:
+            ok, subida = SERVICIO_LOTES.mutar(aplicar, sesion_id)
+        except ErrorEscrituraCSV as ex:
+            show_snackbar(f"❌ {ex}", error=True)
+            return
+        if not ok:
             show_snackbar("Lote no encontrado", error=True)
             return
-        lote['Archivado'] = '1' if archivar else ''
-        lote['ÚltimaActualización'] = datetime.now().strftime('%Y-%m-%d')
-        guardar_csv(lotes)
 
         # Si el lote archivado/desarchivado era el seleccionado en Editar, limpiar selección
         if archivar and current_edit_lote.get("value") == lote_id:
             current_edit_lote["value"] = None
 
-        async def do_upload():
-            success, msg = await asyncio.to_thread(subir_csv_github)
-            if not success:
-                show_snackbar(f"⚠️ No sincronizado: {msg}", error=True)
-            else:
-                accion = "archivado" if archivar else "desarchivado"
-                page.snack_bar = ft.SnackBar(ft.Text(f"✅ Lote {accion}: {lote_id}"))
-                page.snack_bar.open = True
+        def refrescar():
             # Refrescar todas las listas afectadas
-            try:
-                refresh_edit_lotes_popup()
-            except Exception:
-                pass
-            try:
-                refresh_lotes_list_radios()
-            except Exception:
-                pass
-            try:
-                refresh_lotes_list()
-            except Exception:
-                pass
-            try:
-                refresh_archivados_list()
-            except Exception:
-                pass
-            page.update()
-        asyncio.create_task(do_upload())
+            for refrescar_lista in (refresh_edit_lotes_popup, refresh_lotes_list_radios,
+                                    refresh_lotes_list, refresh_archivados_list):
+                try:
+                    refrescar_lista()
+                except Exception:
+                    pass
+        accion = "archivado" if archivar else "desarchivado"
+        asyncio.create_task(esperar_subida(subida, f"✅ Lote {accion}: {lote_id}", refrescar))
 
     def on_archivar_lote(e):
         """Pide confirmación y archiva el lote seleccionado en Editar."""
@@ -2864,6 +6393,163 @@ def main(page: ft.Page):
         dlg.open = True
         page.update()
 
+    # ---- Edición masiva: varios lotes en una sola mutación (una escritura, una subida) ----
+    masivo_seleccion = set()
+    masivo_branch_dd = ft.Dropdown(
+        label="Sucursal",
+        options=[ft.dropdown.Option("Todas")] + [ft.dropdown.Option(b) for b in BRANCH],
+        value="Todas",
+        width=120,
+        dense=True,
+    )
+    masivo_stage_filtro_dd = ft.Dropdown(
+        label="Etapa",
+        options=[ft.dropdown.Option("Todas")] + [ft.dropdown.Option(s) for s in STAGES],
+        value="Todas",
+        width=150,
+        dense=True,
+    )
+    masivo_location_filtro_dd = ft.Dropdown(
+        label="Ubicación",
+        options=[ft.dropdown.Option("Todas")] + [ft.dropdown.Option(l) for l in LOCATIONS],
+        value="Todas",
+        width=140,
+        dense=True,
+    )
+    masivo_lista = ft.Column([], spacing=0, scroll=ft.ScrollMode.AUTO, height=220)
+    masivo_contador = ft.Text("0 seleccionados", size=12, color=ft.Colors.GREY_600)
+    masivo_stage_dd = ft.Dropdown(
+        label="Nueva Etapa",
+        options=[ft.dropdown.Option("Sin cambio")] + [ft.dropdown.Option(s) for s in STAGES],
+        value="Sin cambio",
+        width=200,
+    )
+    masivo_location_dd = ft.Dropdown(
+        label="Nueva Ubicación",
+        options=[ft.dropdown.Option("Sin cambio")] + [ft.dropdown.Option(l) for l in LOCATIONS],
+        value="Sin cambio",
+        width=200,
+    )
+    masivo_semana_dd = ft.Dropdown(
+        label="Nueva Semana",
+        options=[ft.dropdown.Option("Sin cambio")] + [ft.dropdown.Option(str(i)) for i in range(1, 23)],
+        value="Sin cambio",
+        width=120,
+    )
+    masivo_archivar_check = ft.Checkbox(label="Archivar", value=False)
+
+    def actualizar_contador_masivo():
+        masivo_contador.value = f"{len(masivo_seleccion)} seleccionados"
+
+    def on_masivo_check(e, lote_id):
+        if e.control.value:
+            masivo_seleccion.add(lote_id)
+        else:
+            masivo_seleccion.discard(lote_id)
+        actualizar_contador_masivo()
+        page.update()
+
+    def refresh_masivo_list(e=None):
+        """Lista con casillas de los lotes activos que cumplen el filtro de edición masiva."""
+        predicado = filtro_listado(masivo_branch_dd.value, masivo_stage_filtro_dd.value,
+                                   masivo_location_filtro_dd.value)
+        pares = etiquetas_lotes(leer_lotes_activos())
+        # Descartar de la selección los lotes que ya no existen (archivados, movidos)
+        masivo_seleccion.intersection_update(label for label, _ in pares)
+        masivo_lista.controls = [
+            ft.Checkbox(
+                label=f"{label} · {lote.get('Stage', '')} · {lote.get('Location', '')} · Sem {lote.get('Semana', '')}",
+                value=label in masivo_seleccion,
+                data=label,
+                on_change=lambda e, lid=label: on_masivo_check(e, lid),
+            )
+            for label, lote in pares if predicado(lote)
+        ]
+        actualizar_contador_masivo()
+        page.update()
+
+    def on_masivo_marcar(marcar):
+        """Marca o desmarca todos los lotes visibles con el filtro actual."""
+        for check in masivo_lista.controls:
+            lote_id = check.data
+            check.value = marcar
+            if marcar:
+                masivo_seleccion.add(lote_id)
+            else:
+                masivo_seleccion.discard(lote_id)
+        actualizar_contador_masivo()
+        page.update()
+
+    def on_aplicar_masivo(e):
+        """Confirma y aplica los cambios a todos los lotes seleccionados de una vez."""
+        ids = sorted(masivo_seleccion)
+        stage, location, semana = (None if dd.value in (None, '', 'Sin cambio') else dd.value
+                                   for dd in (masivo_stage_dd, masivo_location_dd, masivo_semana_dd))
+        archivar = bool(masivo_archivar_check.value)
+        if not ids:
+            show_snackbar("Selecciona al menos un lote", error=True)
+            return
+        if not (stage or location or semana or archivar):
+            show_snackbar("Elige al menos un cambio", error=True)
+            return
+
+        resumen = []
+        if stage:
+            resumen.append(f"Etapa → {stage}")
+        if location:
+            resumen.append(f"Ubicación → {location}")
+        if semana:
+            resumen.append(f"Semana → {semana}")
+        if archivar:
+            resumen.append("Archivar")
+
+        def cerrar(ev):
+            dlg.open = False
+            page.update()
+
+        def confirmar(ev):
+            dlg.open = False
+            page.update()
+            try:
+                modificados, subida = SERVICIO_LOTES.mutar(
+                    lambda lotes: editar_lotes_masivo(lotes, ids, stage, location, semana, archivar), sesion_id)
+            except ErrorEscrituraCSV as ex:
+                show_snackbar(f"❌ {ex}", error=True)
+                return
+            if not modificados:
+                show_snackbar("No hay cambios para guardar")
+                return
+            masivo_seleccion.clear()
+
+            def refrescar():
+                for refrescar_lista in (refresh_masivo_list, refresh_edit_lotes_popup, refresh_lotes_dropdown,
+                                        refresh_lotes_list_radios, refresh_lotes_list, refresh_archivados_list):
+                    try:
+                        refrescar_lista()
+                    except Exception:
+                        pass
+            asyncio.create_task(esperar_subida(subida, f"✅ {len(modificados)} lotes actualizados", refrescar))
+
+        lista = "\n".join(ids[:10]) + (f"\n... y {len(ids) - 10} más" if len(ids) > 10 else "")
+        dlg = ft.AlertDialog(
+            modal=True,
+            title=ft.Text(f"¿Editar {len(ids)} lotes?"),
+            content=ft.Container(
+                content=ft.Text(f"{', '.join(resumen)}\n\n{lista}", size=12),
+                height=200,
+                width=300,
+            ),
+            actions=[
+                ft.TextButton("Cancelar", on_click=cerrar),
+                ft.TextButton("Aplicar", on_click=confirmar,
+                              style=ft.ButtonStyle(color=ft.Colors.ORANGE)),
+            ],
+            actions_alignment=ft.MainAxisAlignment.END,
+        )
+        page.overlay.append(dlg)
+        dlg.open = True
+        page.update()
+
     tab_editar = ft.Column([
         ft.Text("Editar Lote", size=20, weight=ft.FontWeight.BOLD),
         ft.Divider(),
@@ -2900,78 +6586,57 @@ def main(page: ft.Page):
             color=ft.Colors.GREY_600,
         ),
         ft.Divider(),
+        ft.Text("Edición masiva", size=16, weight=ft.FontWeight.BOLD),
+        ft.Text(
+            "Filtra y marca varios lotes; los cambios se guardan y suben de una sola vez.",
+            size=11,
+            color=ft.Colors.GREY_600,
+        ),
+        ft.Row([
+            masivo_branch_dd,
+            masivo_stage_filtro_dd,
+            masivo_location_filtro_dd,
+            ft.FilledButton("Filtrar", icon=ft.Icons.FILTER_ALT, on_click=refresh_masivo_list),
+        ], wrap=True, spacing=8),
+        ft.Row([
+            ft.TextButton("Marcar filtrados", on_click=lambda e: on_masivo_marcar(True)),
+            ft.TextButton("Desmarcar", on_click=lambda e: on_masivo_marcar(False)),
+            masivo_contador,
+        ], spacing=8),
+        masivo_lista,
+        ft.Row([masivo_stage_dd, masivo_location_dd, masivo_semana_dd], wrap=True, spacing=8),
+        masivo_archivar_check,
+        ft.FilledButton(
+            "Aplicar a seleccionados",
+            icon=ft.Icons.DONE_ALL,
+            on_click=on_aplicar_masivo,
+            style=ft.ButtonStyle(bgcolor=ft.Colors.ORANGE, color=ft.Colors.WHITE),
+        ),
+        ft.Divider(),
         ft.Text("Actualización automática", size=16, weight=ft.FontWeight.BOLD),
         ft.Text(
             "Avanza +1 semana a todos los lotes según la semana ISO actual.\n"
+            "Si hay semanas sin actualizar, permite ponerse al día en una sola pasada.\n"
             "También actualiza la etapa automáticamente según la semana.",
             size=11,
             color=ft.Colors.GREY_600,
         ),
     ], spacing=10, scroll=ft.ScrollMode.AUTO)
     
-    def etapa_por_semana(semana):
-        """Determina la etapa según la semana del lote."""
-        semana = int(semana)
-        if 1 <= semana <= 4:
-            return 'CLONADO'
-        elif 5 <= semana <= 7:
-            return 'VEG. TEMPRANO'
-        elif 8 <= semana <= 9:
-            return 'VEG. TARDIO'
-        elif 10 <= semana <= 20:
-            return 'FLORACIÓN'
-        elif semana == 21:
-            return 'SECADO'
-        elif semana == 22:
-            return 'PT'
-        else:
-            return ''
-    
     def actualizar_semanas_etapas_auto(e=None):
         """Actualiza semanas y etapas de todos los lotes según semana ISO."""
         try:
-            lotes = leer_csv()
-            hoy = datetime.now()
-            semana_iso_actual = hoy.isocalendar()[1]
-            
-            cambios = []
-            
-            for lote in lotes:
-                if es_archivado(lote):
-                    continue
-                try:
-                    sem = int(lote.get('Semana', '0'))
-                except:
-                    continue
-
-                # Leer la semana ISO de la última actualización
-                ultima_act = lote.get('ÚltimaActualización', '')
-                semana_iso_lote = None
-                if ultima_act:
-                    try:
-                        semana_iso_lote = datetime.strptime(ultima_act, '%Y-%m-%d').isocalendar()[1]
-                    except:
-                        semana_iso_lote = None
-                
-                # Solo avanzar si la semana ISO actual es distinta a la última registrada
-                if 1 <= sem < 22 and (semana_iso_lote is None or semana_iso_lote != semana_iso_actual):
-                    nueva_sem = sem + 1
-                    nueva_etapa = etapa_por_semana(nueva_sem)
-                    etapa_ant = lote.get('Stage', '')
-                    
-                    cambios.append({
-                        'id': lote.get('ID', ''),
-                        'sem_ant': sem,
-                        'sem_nueva': nueva_sem,
-                        'etapa_ant': etapa_ant,
-                        'etapa_nueva': nueva_etapa,
-                    })
-                    
-                    lote['Semana'] = str(nueva_sem)
-                    lote['Stage'] = nueva_etapa
-                    lote['ÚltimaActualización'] = hoy.strftime('%Y-%m-%d')
+            # Vista previa sobre el snapshot ya parseado; no modifica nada
+            lotes_csv = leer_csv()
+            cambios_semana = calcular_avance(lotes_csv, omitir=es_archivado)
+            # Ponerse al día: semanas ISO exactas desde la última actualización (una sola pasada)
+            cambios_al_dia = calcular_avance(lotes_csv, omitir=es_archivado, ponerse_al_dia=True)
+            atrasados = sum(1 for c in cambios_al_dia if c['semanas'] > 1)
+            if not atrasados:
+                # Sin lotes atrasados no se ofrece ponerse al día: solo el avance de esta semana
+                cambios_al_dia = cambios_semana
             
-            if not cambios:
+            if not cambios_semana and not cambios_al_dia:
                 # Usar diálogo en lugar de snackbar para mayor visibilidad
                 def cerrar_info(e):
                     dlg_info.open = False
@@ -2989,12 +6654,34 @@ def main(page: ft.Page):
                 return
             
             # Mostrar diálogo de confirmación
-            cambios_text = "\n".join([
-                f"{c['id']}: Sem {c['sem_ant']}→{c['sem_nueva']} | {c['etapa_ant']}→{c['etapa_nueva']}"
-                for c in cambios[:10]  # Mostrar máximo 10
-            ])
-            if len(cambios) > 10:
-                cambios_text += f"\n... y {len(cambios) - 10} más"
+            def texto_cambios(cambios):
+                texto = "\n".join([
+                    f"{c['id']}: Sem {c['sem_ant']}→{c['sem_nueva']} | {c['etapa_ant']}→{c['etapa_nueva']}"
+                    for c in cambios[:10]  # Mostrar máximo 10
+                ])
+                if len(cambios) > 10:
+                    texto += f"\n... y {len(cambios) - 10} más"
+                return texto
+            
+            def cambios_elegidos():
+                return cambios_al_dia if al_dia_switch.value else cambios_semana
+            
+            def on_al_dia_change(e):
+                cambios = cambios_elegidos()
+                dialogo.title.value = f"¿Actualizar {len(cambios)} lotes?"
+                cambios_texto.value = texto_cambios(cambios)
+                page.update()
+            
+            # Solo se ofrece si hay lotes con más de una semana de atraso; si el avance normal
+            # no tiene cambios queda fijo (apagarlo dejaría "Actualizar 0 lotes")
+            al_dia_switch = ft.Switch(
+                label=f"Ponerse al día ({atrasados} lotes atrasados)",
+                value=atrasados > 0,
+                visible=atrasados > 0,
+                disabled=not cambios_semana,
+                on_change=on_al_dia_change,
+            )
+            cambios_texto = ft.Text(texto_cambios(cambios_elegidos()), size=12)
             
             def cerrar_dialogo(e):
                 dialogo.open = False
@@ -3004,27 +6691,30 @@ def main(page: ft.Page):
                 dialogo.open = False
                 page.update()
                 
-                # Guardar y sincronizar
-                guardar_csv(lotes)
-                async def do_upload():
-                    success, msg = await asyncio.to_thread(subir_csv_github)
-                    if not success:
-                        show_snackbar(f"⚠️ No sincronizado: {msg}", error=True)
-                    else:
-                        page.snack_bar = ft.SnackBar(ft.Text(f"✅ {len(cambios)} lotes actualizados"))
-                        page.snack_bar.open = True
-                    # Refrescar listas
-                    refresh_edit_lotes_popup()
-                    refresh_lotes_dropdown()
-                    page.update()
-                asyncio.create_task(do_upload())
+                # Guardar y sincronizar: el conjunto de cambios se aplica sobre una lectura fresca
+                # (una escritura, una subida); los lotes editados entretanto se omiten
+                cambios = cambios_elegidos()
+                try:
+                    n, subida = SERVICIO_LOTES.mutar(lambda actuales: aplicar_avance(actuales, cambios), sesion_id)
+                except ErrorEscrituraCSV as ex:
+                    show_snackbar(f"❌ {ex}", error=True)
+                    return
+                if subida:
+                    def refrescar():
+                        # Refrescar listas
+                        refresh_edit_lotes_popup()
+                        refresh_lotes_dropdown()
+                    asyncio.create_task(esperar_subida(subida, f"✅ {n} lotes actualizados", refrescar))
             
             dialogo = ft.AlertDialog(
                 modal=True,
-                title=ft.Text(f"¿Actualizar {len(cambios)} lotes?"),
+                title=ft.Text(f"¿Actualizar {len(cambios_elegidos())} lotes?"),
                 content=ft.Container(
-                    content=ft.Text(cambios_text, size=12),
-                    height=200,
+                    content=ft.Column([
+                        al_dia_switch,
+                        ft.Column([cambios_texto], scroll=ft.ScrollMode.AUTO, expand=True),
+                    ], tight=True),
+                    height=240,
                     width=300,
                 ),
                 actions=[
@@ -3045,6 +6735,17 @@ def main(page: ft.Page):
             page.snack_bar.open = True
             page.update()
     
+    def on_reportes_semanales(e=None):
+        """Avance semanal + reportes CSV/XLSX/PDF por sucursal en registros/reports/."""
+        async def do_reportes():
+            show_snackbar("Generando reportes semanales...")
+            ok, msg, carpeta = await asyncio.to_thread(generar_reportes_semanales)
+            if ok and carpeta:
+                show_snackbar(f"📊 {msg}: {carpeta}")
+            else:
+                show_snackbar(f"⚠️ {msg}", error=True)
+        asyncio.create_task(do_reportes())
+
     # Agregar botón de actualización al tab_editar
     tab_editar.controls.append(
         ft.FilledButton(
@@ -3054,6 +6755,14 @@ def main(page: ft.Page):
             style=ft.ButtonStyle(bgcolor=ft.Colors.PURPLE, color=ft.Colors.WHITE),
         )
     )
+    if not hasattr(sys, 'getandroidapilevel'):
+        tab_editar.controls.append(
+            ft.OutlinedButton(
+                "📊 Avance y reportes semanales",
+                icon=ft.Icons.ASSESSMENT,
+                on_click=on_reportes_semanales,
+            )
+        )
     
     # ========== TAB 6: CONFIGURACIÓN ==========
     config_repo_field = ft.TextField(
@@ -3075,6 +6784,23 @@ def main(page: ft.Page):
     )
     
     config_status = ft.Text("", size=12)
+    diagnostico_text = ft.Text("", size=12, color=ft.Colors.GREY_700, selectable=True)
+
+    def refresh_diagnostico(e=None):
+        """Presupuesto de API, cambios pendientes y tiempos de arranque."""
+        transporte = obtener_transporte()
+        lineas = [f"Transporte: {transporte.nombre if transporte else 'github'}",
+                  resumen_rate_limit(), f"Cambios pendientes de subir: {pendientes_outbox()}"]
+        if _LAN_SERVIDOR['server'] is not None:
+            lineas.append(f"Servidor LAN activo en el puerto {_LAN_SERVIDOR['server'].server_address[1]}")
+        if STARTUP_METRICS:
+            lineas.append("Arranque: " + ", ".join(
+                f"{k}={v:.0f}" if isinstance(v, (int, float)) else f"{k}={v}" for k, v in STARTUP_METRICS.items()))
+        diagnostico_text.value = "\n".join(lineas)
+        try:
+            diagnostico_text.update()
+        except Exception:
+            pass
     
     # Campo para usuario actual
     config_user_field = ft.TextField(
@@ -3236,7 +6962,7 @@ def main(page: ft.Page):
                 config_status.color = ft.Colors.RED
                 update_status(False, msg)
                 # Si hubo conflicto, notificar al usuario
-                if isinstance(msg, str) and 'Conflicto' in msg:
+                if codigo_sync(msg) == SYNC_CONFLICTO:
                     show_snackbar('Conflicto detectado: se guardaron backups. Revisa registros/', error=True)
             page.update()
 
@@ -3529,6 +7255,12 @@ def main(page: ft.Page):
             ),
         ]),
         config_status,
+        ft.Divider(),
+        ft.Row([
+            ft.Text("🩺 Diagnóstico", size=16, weight=ft.FontWeight.BOLD),
+            ft.IconButton(ft.Icons.REFRESH, on_click=refresh_diagnostico, tooltip="Actualizar"),
+        ]),
+        diagnostico_text,
     ], spacing=10, scroll=ft.ScrollMode.AUTO)
 
     # show_restore_remote_dialog removed: restoring remote from backup is disabled in the UI by design. Use external tools or manual GitHub restore if necessary.
@@ -3562,8 +7294,30 @@ def main(page: ft.Page):
         dlg.open = True
         page.update()
 
+    frio_sync = {"hecho": False}
+
+    def sincronizar_frio_en_segundo_plano():
+        """La primera vez que se abre Archivados, baja en background las particiones frías remotas."""
+        if frio_sync["hecho"] or not sync_configurado():
+            return
+        frio_sync["hecho"] = True
+
+        async def do_frio():
+            transporte = obtener_transporte()
+            if transporte is not None:
+                ok, msg, n = await asyncio.to_thread(sincronizar_frio_transporte, transporte)
+            else:
+                ok, msg, n = await asyncio.to_thread(en_segundo_plano, descargar_archivo_frio)
+            print(f"[ARCHIVO] {msg} ({n} actualizadas)")
+            if not ok:
+                frio_sync["hecho"] = False
+            elif n:
+                refresh_archivados_list()
+        asyncio.create_task(do_frio())
+
     def refresh_archivados_list(e=None):
-        lotes = [l for l in leer_csv() if es_archivado(l)]
+        sincronizar_frio_en_segundo_plano()
+        lotes = leer_lotes_archivados()
 
         def lote_key(lote):
             try:
@@ -3697,6 +7451,7 @@ def main(page: ft.Page):
             config_repo_field.value = GITHUB_REPO or ""
             config_token_field.value = GITHUB_TOKEN or ""
             config_user_field.value = CURRENT_USER or ""
+            refresh_diagnostico()
             # Intentar actualizar visualmente, pero sin lanzar excepción si aún no hay page
             try:
                 config_repo_field.update()
@@ -3785,24 +7540,28 @@ def main(page: ft.Page):
     )
     page.navigation_bar = nav_bar
     
-    # Inicialización (configuración asíncrona ya lanzada en on_load)
-    # startup_restore y refresco de listas se pueden lanzar aquí si necesario
-    
-    # Refrescar listas (init_config se lanza desde on_page_load)
+    # Etapa 0: pintar las listas desde el snapshot local, sin red ni config.
+    # Las tres vistas comparten el mismo parseo del CSV (snapshot en memoria de leer_csv).
     refresh_lotes_list()
+    STARTUP_METRICS['primera_lista_ms'] = (time.perf_counter() - t_inicio) * 1000
     refresh_edit_lotes_popup()
+    refresh_masivo_list()
     # También poblar popup de selección de lotes
     try:
         refresh_lotes_list_radios()
     except Exception:
         pass
-
-    # Lanzar init_config aquí: UI ya está añadida y los controles existen
+    print(f"[STARTUP] primera lista en {STARTUP_METRICS['primera_lista_ms']:.0f} ms")
     try:
-        asyncio.create_task(init_config())
-    except Exception as e:
-        print(f"No se pudo lanzar init_config desde final de main: {e}")
-    # (El diálogo de usuario solo se muestra si no hay usuario tras cargar config, ver on_page_load)
+        if status_text and status_text.current:
+            status_text.current.value = f"Datos locales listos ({STARTUP_METRICS['primera_lista_ms']:.0f} ms)"
+        page.update()
+    except Exception:
+        pass
+
+    # Etapas 1 y 2 (config y verificación remota) en background; on_load también las
+    # lanza pero solo corren una vez. El diálogo de usuario se muestra tras cargar config.
+    start_background_stages()
 
 
 # Punto de entrada
@@ -5,14 +5,14 @@ import os
 import sys
 import base64
 from datetime import datetime
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from matplotlib.figure import Figure
-import numpy as np
 import requests
 import webbrowser
 import shutil
 import glob
+import hashlib
+import threading
+
+import lotes_semanas
 
 ROOT = os.path.dirname(__file__)
 
@@ -86,6 +86,72 @@ VARIETIES = [
     'Zallah Bread',
 ]
 
+# Estado del sondeo remoto: ETag del último listado, SHA remoto conocido y mtime del CSV
+# local tras la última sincronización (si cambió, hay ediciones locales sin subir) y
+# último SHA remoto ya avisado mientras había ediciones locales.
+_POLL = {'etag': '', 'sha': '', 'mtime_sync': None, 'avisado': ''}
+# Una sola descarga a la vez: "verificar conexión" y el sondeo escriben el CSV y _POLL
+_DESCARGA_LOCK = threading.Lock()
+
+
+def _marcar_sincronizado(sha=''):
+    if sha:
+        _POLL['sha'] = sha
+    try:
+        _POLL['mtime_sync'] = os.path.getmtime(LOTES_CSV)
+    except Exception:
+        _POLL['mtime_sync'] = None
+
+
+def _blob_sha(datos):
+    """SHA de blob de git (el que informa la API de contenidos) de unos bytes."""
+    return hashlib.sha1(b'blob ' + str(len(datos)).encode() + b'\0' + datos).hexdigest()
+
+
+def hay_cambios_locales(sha_remoto=''):
+    """True si el CSV local tiene (o puede tener) ediciones sin subir.
+
+    Sin línea base (arranque offline o primera descarga fallida) se compara el contenido con
+    sha_remoto; si no coincide se asume que hay cambios, para no sobrescribirlos."""
+    try:
+        if _POLL['mtime_sync'] is not None:
+            return os.path.getmtime(LOTES_CSV) != _POLL['mtime_sync']
+        if not os.path.exists(LOTES_CSV) or os.path.getsize(LOTES_CSV) == 0:
+            return False
+        if sha_remoto:
+            with open(LOTES_CSV, 'rb') as f:
+                if _blob_sha(f.read()) == sha_remoto:
+                    _marcar_sincronizado(sha_remoto)
+                    return False
+        return True
+    except Exception:
+        return True
+
+
+def sondear_remoto():
+    """GET condicional del listado del directorio del CSV (304 no consume cuota).
+    Retorna (status, sha_remoto)."""
+    directorio, _, nombre = GITHUB_FILE_PATH.rpartition('/')
+    url = f'https://api.github.com/repos/{GITHUB_REPO}/contents/{directorio}'.rstrip('/')
+    headers = {
+        'Authorization': f'token {GITHUB_TOKEN}',
+        'Accept': 'application/vnd.github.v3+json'
+    }
+    if _POLL['etag']:
+        headers['If-None-Match'] = _POLL['etag']
+    try:
+        response = requests.get(url, headers=headers, params={'ref': GITHUB_BRANCH}, timeout=5)
+    except Exception:
+        return 0, ''
+    if response.status_code != 200:
+        return response.status_code, ''
+    _POLL['etag'] = response.headers.get('ETag', '')
+    for entrada in response.json():
+        if entrada.get('name') == nombre:
+            return 200, entrada.get('sha', '')
+    return 404, ''
+
+
 def descargar_csv_github():
     """Descarga el CSV desde GitHub (repo privado)."""
     if not GITHUB_TOKEN:
@@ -110,6 +176,7 @@ def descargar_csv_github():
                 fix_csv_structure()
             except Exception:
                 pass
+            _marcar_sincronizado(data.get('sha', ''))
             return True, 'Conectado' 
         elif response.status_code == 401:
             return False, f'Token inválido o sin permisos. Verifica el token en github_config.txt y que tenga permisos repo.'
@@ -132,7 +199,21 @@ def subir_csv_github():
     if not GITHUB_TOKEN:
         messagebox.showwarning('Aviso', 'No hay token de GitHub configurado')
         return False
-    
+    success, msg = _subir_csv()
+    # Mostrar mensaje en barra de estado si update_status está disponible
+    try:
+        update_status(success, msg)
+    except Exception:
+        if not success:
+            messagebox.showerror('Error', msg)
+    return success
+
+
+def _subir_csv():
+    """Sube el CSV sin tocar la interfaz (se puede llamar desde un hilo). Devuelve (success, msg)."""
+    if not GITHUB_TOKEN:
+        return False, 'No hay token de GitHub configurado'
+
     # Primero obtener el SHA del archivo actual
     url = f'https://api.github.com/repos/{GITHUB_REPO}/contents/{GITHUB_FILE_PATH}'
     headers = {
@@ -164,21 +245,14 @@ def subir_csv_github():
         
         response = requests.put(url, headers=headers, json=data, timeout=10)
         if response.status_code in [200, 201]:
-            # Mostrar mensaje en barra de estado si update_status está disponible
             try:
-                update_status(True, 'CSV sincronizado con GitHub')
+                _marcar_sincronizado(response.json().get('content', {}).get('sha', ''))
             except Exception:
-                pass
-            return True
-        else:
-            try:
-                update_status(False, f'Error subiendo: {response.status_code}')
-            except Exception:
-                messagebox.showerror('Error', f'Error subiendo: {response.status_code}')
-            return False
+                _marcar_sincronizado()
+            return True, 'CSV sincronizado con GitHub'
+        return False, f'Error subiendo: {response.status_code}'
     except Exception as e:
-        messagebox.showerror('Error', f'Error de conexión: {e}')
-        return False
+        return False, f'Error de conexión: {e}'
 
 
 def leer_csv():
@@ -873,28 +947,9 @@ def grafico_distribucion_por_sucursal():
         messagebox.showinfo('Gráficos', 'No hay lotes para graficar.')
         return
     
-    # Preparar datos para gráfico de radar
-    branches = list(set(l[0] for l in data.keys()))
-    stages = list(set(l[1] for l in data.keys()))
-    
-    fig = Figure(figsize=(10, 10), dpi=100)
-    ax = fig.add_subplot(111, projection='polar')
-    
-    angles = np.linspace(0, 2 * np.pi, len(branches), endpoint=False).tolist()
-    angles += angles[:1]  # Cerrar el polígono
-    
-    for stage in stages:
-        values = [data.get((b, stage), 0) for b in branches]
-        values += values[:1]
-        ax.plot(angles, values, 'o-', linewidth=2, label=stage)
-        ax.fill(angles, values, alpha=0.15)
-    
-    ax.set_xticks(angles[:-1])
-    ax.set_xticklabels(branches)
-    ax.set_ylim(0, max([v for v in data.values()]) + 1)
-    ax.set_title('Distribución de Lotes por Sucursal y Etapa', pad=20)
-    ax.legend(loc='upper right', bbox_to_anchor=(1.3, 1.1))
-    ax.grid(True)
+    # Importación diferida: matplotlib solo se carga al abrir un gráfico
+    import lotes_charts
+    fig = lotes_charts.figura_por_sucursal(data)
     
     # Crear texto con detalles
     info_text = "Detalle de Lotes:\n"
@@ -907,9 +962,7 @@ def grafico_distribucion_por_sucursal():
     
     frame_gra = ttk.Frame(win)
     frame_gra.pack(side='left', fill='both', expand=True)
-    canvas = FigureCanvasTkAgg(fig, master=frame_gra)
-    canvas.draw()
-    canvas.get_tk_widget().pack(fill='both', expand=True)
+    lotes_charts.mostrar_figura(frame_gra, fig)
     
     frame_info = ttk.Frame(win, width=250)
     frame_info.pack(side='right', fill='both')
@@ -942,20 +995,8 @@ def grafico_distribucion_etapas():
         messagebox.showinfo('Gráficos', 'No hay lotes para graficar.')
         return
     
-    fig = Figure(figsize=(10, 8), dpi=100)
-    ax = fig.add_subplot(111)
-    
-    labels = list(por_etapa.keys())
-    sizes = list(por_etapa.values())
-    colors = plt.cm.Set3(np.linspace(0, 1, len(labels)))
-    
-    wedges, texts, autotexts = ax.pie(sizes, labels=labels, autopct='%1.1f%%', 
-                                        colors=colors, startangle=90)
-    ax.set_title('Distribución de Lotes por Etapa')
-    
-    for autotext in autotexts:
-        autotext.set_color('black')
-        autotext.set_fontweight('bold')
+    import lotes_charts
+    fig = lotes_charts.figura_etapas(por_etapa)
     
     # Crear texto con detalles
     info_text = "Detalle de Lotes por Etapa:\n\n"
@@ -969,9 +1010,7 @@ def grafico_distribucion_etapas():
     
     frame_gra = ttk.Frame(win)
     frame_gra.pack(side='left', fill='both', expand=True)
-    canvas = FigureCanvasTkAgg(fig, master=frame_gra)
-    canvas.draw()
-    canvas.get_tk_widget().pack(fill='both', expand=True)
+    lotes_charts.mostrar_figura(frame_gra, fig)
     
     frame_info = ttk.Frame(win, width=250)
     frame_info.pack(side='right', fill='both')
@@ -1004,26 +1043,8 @@ def grafico_distribucion_ubicaciones():
         messagebox.showinfo('Gráficos', 'No hay lotes para graficar.')
         return
     
-    fig = Figure(figsize=(12, 6), dpi=100)
-    ax = fig.add_subplot(111)
-    
-    locations = list(por_ubicacion.keys())
-    counts = list(por_ubicacion.values())
-    colors = plt.cm.Spectral(np.linspace(0, 1, len(locations)))
-    
-    bars = ax.bar(locations, counts, color=colors)
-    ax.set_xlabel('Ubicación', fontsize=11, fontweight='bold')
-    ax.set_ylabel('Cantidad de Lotes', fontsize=11, fontweight='bold')
-    ax.set_title('Distribución de Lotes por Ubicación')
-    ax.tick_params(axis='x', rotation=45)
-    
-    # Agregar valor en cada barra
-    for bar, count in zip(bars, counts):
-        height = bar.get_height()
-        ax.text(bar.get_x() + bar.get_width()/2., height,
-                f'{int(count)}', ha='center', va='bottom', fontweight='bold')
-    
-    fig.tight_layout()
+    import lotes_charts
+    fig = lotes_charts.figura_ubicaciones(por_ubicacion)
     
     # Crear texto con detalles
     info_text = "Detalle de Lotes por Ubicación:\n\n"
@@ -1037,9 +1058,7 @@ def grafico_distribucion_ubicaciones():
     
     frame_gra = ttk.Frame(win)
     frame_gra.pack(side='left', fill='both', expand=True)
-    canvas = FigureCanvasTkAgg(fig, master=frame_gra)
-    canvas.draw()
-    canvas.get_tk_widget().pack(fill='both', expand=True)
+    lotes_charts.mostrar_figura(frame_gra, fig)
     
     frame_info = ttk.Frame(win, width=250)
     frame_info.pack(side='right', fill='both')
@@ -1052,25 +1071,7 @@ def grafico_distribucion_ubicaciones():
 def make_gui():
     def actualizar_semanas_etapas(usar_archivo_real=False):
         """Detecta y propone actualización de semana y etapa en el archivo de lotes, notificando y pidiendo confirmación."""
-        import copy
         from tkinter.simpledialog import askstring
-        # Definición de etapas por semana
-        def etapa_por_semana(semana):
-            semana = int(semana)
-            if 1 <= semana <= 4:
-                return 'CLONADO'
-            elif 5 <= semana <= 7:
-                return 'VEG. TEMPRANO'
-            elif 8 <= semana <= 9:
-                return 'VEG. TARDIO'
-            elif 10 <= semana <= 20:
-                return 'FLORACIÓN'
-            elif semana == 21:
-                return 'SECADO'
-            elif semana == 22:
-                return 'PT'
-            else:
-                return ''
 
         archivo = os.path.join(BASE_PATH, "lotes_template.csv") if usar_archivo_real else os.path.join(BASE_PATH, "lotes_template_test.csv")
         if not os.path.exists(archivo):
@@ -1078,58 +1079,48 @@ def make_gui():
             return
         # Leer lotes
         with open(archivo, 'r', encoding='utf-8') as f:
-            lotes = list(csv.DictReader(f))
-        hoy = datetime.now()
-        semana_iso_actual = hoy.isocalendar()[1]
-        cambios = []
-        nuevos_lotes = copy.deepcopy(lotes)
-        for idx, lote in enumerate(lotes):
-            try:
-                sem = int(lote.get('Semana', '0'))
-            except Exception:
-                continue
-            # Leer la semana ISO de la última actualización
-            ultima_act = lote.get('ÚltimaActualización', '')
-            semana_iso_lote = None
-            if ultima_act:
-                try:
-                    semana_iso_lote = datetime.strptime(ultima_act, '%Y-%m-%d').isocalendar()[1]
-                except Exception:
-                    semana_iso_lote = None
-            # Solo avanzar si la semana ISO actual es distinta a la última registrada
-            if 1 <= sem < 22 and (semana_iso_lote is None or semana_iso_lote != semana_iso_actual):
-                nueva_sem = sem + 1
-                nueva_etapa = etapa_por_semana(nueva_sem)
-                etapa_ant = lote.get('Stage', '')
-                cambios.append((idx, sem, nueva_sem, etapa_ant, nueva_etapa))
-                nuevos_lotes[idx]['Semana'] = str(nueva_sem)
-                nuevos_lotes[idx]['Stage'] = nueva_etapa
-                nuevos_lotes[idx]['ÚltimaActualización'] = hoy.strftime('%Y-%m-%d')
+            reader = csv.DictReader(f)
+            lotes = list(reader)
+            cabecera = list(reader.fieldnames or [])
+        # Conjunto de cambios del motor compartido (no modifica los lotes)
+        cambios = lotes_semanas.calcular_avance(
+            lotes, omitir=lambda l: str(l.get('Archivado', '')).strip().lower() in ('1', 'sí', 'si', 'true'))
         if not cambios:
             messagebox.showinfo('Sin cambios', 'No hay lotes para actualizar esta semana.')
             return
         # Mostrar resumen y pedir confirmación
         resumen = 'Se detectaron los siguientes cambios:\n\n'
-        for idx, sem, nueva_sem, etapa_ant, nueva_etapa in cambios:
-            resumen += f"Lote {nuevos_lotes[idx]['ID']}: Semana {sem} → {nueva_sem} | Etapa: {etapa_ant} → {nueva_etapa}\n"
+        for c in cambios:
+            resumen += f"Lote {c['id']}: Semana {c['sem_ant']} → {c['sem_nueva']} | Etapa: {c['etapa_ant']} → {c['etapa_nueva']}\n"
         resumen += '\n¿Deseas aplicar estos cambios?'
         if not messagebox.askyesno('Confirmar actualización', resumen):
             return
+        lotes_semanas.aplicar_avance(lotes, cambios)
         # Solicitar ubicación si la etapa lo requiere y está vacía
-        for idx, sem, nueva_sem, etapa_ant, nueva_etapa in cambios:
-            if nueva_etapa in ['SECADO', 'PT'] and not nuevos_lotes[idx].get('Location'):
-                ubic = askstring('Ubicación requerida', f"Lote {nuevos_lotes[idx]['ID']} ({nueva_etapa}):\nIngresa ubicación:")
+        for c in cambios:
+            lote = lotes[c['indice']]
+            if c['etapa_nueva'] in ['SECADO', 'PT'] and not lote.get('Location'):
+                ubic = askstring('Ubicación requerida', f"Lote {c['id']} ({c['etapa_nueva']}):\nIngresa ubicación:")
                 if ubic:
-                    nuevos_lotes[idx]['Location'] = ubic
-        # Guardar cambios
-        fieldnames = ['ID','Branch','LoteNum','Stage','Location','Semana','DateCreated','ÚltimaActualización','Notes']
-        for i in range(1, 21):
-            fieldnames.append(f'Variedad_{i}')
-            fieldnames.append(f'Cantidad_{i}')
+                    lote['Location'] = ubic
+        # Guardar cambios con la cabecera del archivo (no perder columnas que esta versión no
+        # conoce) más las que haya agregado el avance, p. ej. ÚltimaActualización
+        for lote in lotes:
+            lote.pop(None, None)   # campos sobrantes de filas mal formadas
+        nuevas = [k for k in dict.fromkeys(k for l in lotes for k in l) if k not in cabecera]
         with open(archivo, 'w', newline='', encoding='utf-8') as f:
-            writer = csv.DictWriter(f, fieldnames=fieldnames)
+            writer = csv.DictWriter(f, fieldnames=cabecera + nuevas)
             writer.writeheader()
-            writer.writerows(nuevos_lotes)
+            writer.writerows(lotes)
+        # Una sola subida con todo el avance, en un hilo como check_connection
+        if usar_archivo_real and GITHUB_TOKEN:
+            status_label.config(text='Subiendo cambios...')
+
+            def trabajo():
+                resultado = _subir_csv()
+                root.after(0, lambda: update_status(*resultado))
+
+            threading.Thread(target=trabajo, daemon=True).start()
         messagebox.showinfo('Actualización exitosa', f'Las semanas y etapas fueron actualizadas en {os.path.basename(archivo)}.')
 
     root = tk.Tk()
@@ -1502,12 +1493,63 @@ def make_gui():
     update_status = update_status_local
     
     def check_connection():
+        # La descarga corre en un hilo para no congelar la ventana; el resultado vuelve con root.after
         status_label.config(text='Verificando...')
-        root.update()
-        success, msg = descargar_csv_github()
-        update_status(success, msg)
-        if success:
-            refresh_lote_selector()
+
+        def trabajo():
+            with _DESCARGA_LOCK:
+                success, msg = descargar_csv_github()
+            root.after(0, lambda: terminar(success, msg))
+
+        def terminar(success, msg):
+            update_status(success, msg)
+            if success:
+                refresh_lote_selector()
+
+        threading.Thread(target=trabajo, daemon=True).start()
+
+    # Sondeo remoto adaptativo (segundos): rápido tras bajar cambios remotos, lento en reposo
+    # o mientras haya ediciones locales (no se puede aplicar nada hasta subirlas)
+    POLL_MIN, POLL_MAX = 20, 300
+    poll_intervalo = {'valor': 60}
+
+    def poll_remoto():
+        def trabajo():
+            # Si hay una verificación manual en curso, este ciclo se salta
+            if not _DESCARGA_LOCK.acquire(blocking=False):
+                root.after(0, lambda: terminar(None))
+                return
+            try:
+                status, sha = sondear_remoto()
+                aplicado = None
+                if status == 200 and sha and sha != _POLL['sha']:
+                    if not hay_cambios_locales(sha):
+                        aplicado = descargar_csv_github()
+                    elif sha != _POLL['avisado']:
+                        # Avisar una vez por versión remota, no en cada ciclo
+                        _POLL['avisado'] = sha
+                        aplicado = (False, 'Hay cambios remotos; sincroniza tus cambios')
+            finally:
+                _DESCARGA_LOCK.release()
+            root.after(0, lambda: terminar(aplicado))
+
+        def terminar(aplicado):
+            if aplicado is not None:
+                update_status(*aplicado)
+            if aplicado is not None and aplicado[0]:
+                poll_intervalo['valor'] = POLL_MIN
+                refresh_lote_selector()
+                try:
+                    refresh_edit_lotes()
+                except Exception:
+                    pass
+            else:
+                poll_intervalo['valor'] = min(int(poll_intervalo['valor'] * 1.5), POLL_MAX)
+            root.after(poll_intervalo['valor'] * 1000, poll_remoto)
+
+        if not GITHUB_TOKEN:
+            return
+        threading.Thread(target=trabajo, daemon=True).start()
     
     def sync_to_github():
         status_label.config(text='Subiendo cambios...')
@@ -1553,8 +1595,9 @@ def make_gui():
     except Exception:
         pass
 
-    # Verificar conexión periódicamente
+    # Verificar conexión al inicio (en segundo plano) y luego sondear cambios remotos
     root.after(500, check_connection)
+    root.after(poll_intervalo['valor'] * 1000, poll_remoto)
 
     root.mainloop()
 
@@ -0,0 +1,145 @@
+"""
+Avance semanal de lotes (semana y etapa), compartido por lotes_flet.py, lotes_gui.py y
+lotes_cli.py.
+
+La etapa de cada semana sale de una tabla precalculada y la semana ISO de cada fecha
+'ÚltimaActualización' se calcula una sola vez por fecha distinta. calcular_avance no
+modifica los lotes: devuelve el conjunto de cambios (sirve de vista previa) y
+aplicar_avance lo aplica de una vez sobre una lectura fresca antes de una única escritura.
+
+En modo ponerse_al_dia cada lote avanza tantas semanas como semanas ISO pasaron desde su
+'ÚltimaActualización' (contando cruces de año), en vez de solo +1.
+"""
+
+from datetime import date, datetime
+from functools import lru_cache
+
+SEMANA_MAX = 22
+
+# Rangos de semanas por etapa (inclusive)
+RANGOS_ETAPA = [
+    (1, 4, 'CLONADO'),
+    (5, 7, 'VEG. TEMPRANO'),
+    (8, 9, 'VEG. TARDIO'),
+    (10, 20, 'FLORACIÓN'),
+    (21, 21, 'SECADO'),
+    (22, 22, 'PT'),
+]
+
+# Tabla semana -> etapa (índice = semana); '' fuera de rango
+ETAPA_POR_SEMANA = [''] * (SEMANA_MAX + 1)
+for _desde, _hasta, _etapa in RANGOS_ETAPA:
+    for _s in range(_desde, _hasta + 1):
+        ETAPA_POR_SEMANA[_s] = _etapa
+del _desde, _hasta, _etapa, _s
+
+
+def etapa_por_semana(semana) -> str:
+    """Determina la etapa según la semana del lote."""
+    semana = int(semana)
+    if 0 <= semana <= SEMANA_MAX:
+        return ETAPA_POR_SEMANA[semana]
+    return ''
+
+
+@lru_cache(maxsize=4096)
+def semana_iso(fecha: str):
+    """(año ISO, semana ISO) de una fecha 'AAAA-MM-DD'; None si no es válida."""
+    try:
+        return tuple(datetime.strptime(fecha, '%Y-%m-%d').isocalendar()[:2])
+    except Exception:
+        return None
+
+
+@lru_cache(maxsize=4096)
+def lunes_iso(fecha: str):
+    """Ordinal del lunes de la semana ISO de una fecha 'AAAA-MM-DD'; None si no es válida."""
+    iso = semana_iso(fecha)
+    if iso is None:
+        return None
+    return date.fromisocalendar(iso[0], iso[1], 1).toordinal()
+
+
+def semanas_desde(fecha: str, hoy=None):
+    """Semanas ISO completas entre fecha y hoy (0 = misma semana); None si la fecha no es válida."""
+    lunes = lunes_iso(fecha)
+    if lunes is None:
+        return None
+    return (lunes_iso((hoy or datetime.now()).strftime('%Y-%m-%d')) - lunes) // 7
+
+
+def calcular_avance(lotes, hoy=None, omitir=None, ponerse_al_dia=False):
+    """Cambios del avance semanal sin modificar los lotes.
+
+    Avanza los lotes con semana entre 1 y SEMANA_MAX-1 cuya última actualización no es de
+    la semana ISO de hoy: +1 semana, o con ponerse_al_dia las semanas transcurridas (tope
+    SEMANA_MAX; +1 si no hay fecha válida). omitir(lote) excluye filas (p.ej. archivadas).
+    Devuelve una lista de dicts {'indice', 'id', 'location', 'sem_ant', 'sem_nueva',
+    'etapa_ant', 'etapa_nueva', 'semanas'}, con indice = posición en lotes."""
+    hoy = hoy or datetime.now()
+    semana_actual = semana_iso(hoy.strftime('%Y-%m-%d'))
+    cambios = []
+    for i, lote in enumerate(lotes):
+        if omitir is not None and omitir(lote):
+            continue
+        try:
+            sem = int(lote.get('Semana', '0'))
+        except (TypeError, ValueError):
+            continue
+        if not 1 <= sem < SEMANA_MAX:
+            continue
+        fecha = lote.get('ÚltimaActualización', '') or ''
+        if ponerse_al_dia:
+            semanas = semanas_desde(fecha, hoy)
+            if semanas is None:
+                semanas = 1
+            elif semanas <= 0:
+                continue
+        else:
+            # (año ISO, semana): la misma semana de otro año también es otra semana
+            if semana_iso(fecha) == semana_actual:
+                continue
+            semanas = 1
+        nueva = min(sem + semanas, SEMANA_MAX)
+        cambios.append({
+            'indice': i,
+            'id': lote.get('ID', ''),
+            'location': lote.get('Location', ''),
+            'sem_ant': sem,
+            'sem_nueva': nueva,
+            'etapa_ant': lote.get('Stage', ''),
+            'etapa_nueva': ETAPA_POR_SEMANA[nueva],
+            'semanas': nueva - sem,
+        })
+    return cambios
+
+
+def _fila_del_cambio(lotes, cambio):
+    """Fila a la que corresponde un cambio, aunque la lista haya cambiado desde el cálculo."""
+    def coincide(lote):
+        return (lote.get('ID', '') == cambio['id'] and lote.get('Location', '') == cambio['location']
+                and str(lote.get('Semana', '')) == str(cambio['sem_ant']))
+    i = cambio.get('indice')
+    if i is not None and 0 <= i < len(lotes) and coincide(lotes[i]):
+        return lotes[i]
+    for lote in lotes:
+        if coincide(lote):
+            return lote
+    return None
+
+
+def aplicar_avance(lotes, cambios, hoy=None) -> int:
+    """Aplica en sitio un conjunto de cambios de calcular_avance. Devuelve cuántos se aplicaron.
+
+    Los cambios cuyo lote ya no está en la semana de origen (editado entretanto) se omiten."""
+    fecha = (hoy or datetime.now()).strftime('%Y-%m-%d')
+    n = 0
+    for cambio in cambios:
+        lote = _fila_del_cambio(lotes, cambio)
+        if lote is None:
+            continue
+        lote['Semana'] = str(cambio['sem_nueva'])
+        lote['Stage'] = cambio['etapa_nueva']
+        lote['ÚltimaActualización'] = fecha
+        n += 1
+    return n